@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## A persistent cache of scan results, stored in a SQLite database and
+## keyed by the SHA256 of the scanned file. This makes it possible to skip
+## trying unpackers on false positives for files that were already seen in
+## an earlier scan: only the unpackers that unpacked data are tried again.
+##
+## Every entry is stored together with a version string. The version is
+## computed from the signatures, the unpackers and the prevalidators that
+## are used and the source code of the modules they use (see
+## computecacheversion()), so when any of these change the old results are
+## no longer used. The size of the cache is bounded: if it grows bigger than
+## the configured maximum the least recently used entries are removed.
+##
+## Results are not written one at a time: every process keeps the results
+## it stored, and the entries it used, and writes them in batches in a
+## single transaction (see flushcache()), so the processes do not have to
+## wait for each other for every scanned file.
+
+import sqlite3, hashlib, json, time, inspect
+
+## the amount of results that are written to the cache in one transaction
+storebatchsize = 256
+
+## Compute a version string for the cache from the signatures, the table
+## that maps signatures to unpacking functions and the table that maps
+## signatures to prevalidators. The version changes when a signature is
+## added, removed or changed, when a signature is mapped to another
+## function, or when the source code of any of the BANG modules used by
+## these functions changes, including the modules that they import (for
+## example the squashfs reader or the staging of files).
+def computecacheversion(signatures, signaturetofunction, signaturetoprevalidator={}):
+        versionhash = hashlib.sha256()
+        for s in sorted(signatures):
+                versionhash.update(("%s:%s\n" % (s, signatures[s].hex())).encode())
+        modules = {}
+        for table in [signaturetofunction, signaturetoprevalidator]:
+                for s in sorted(table):
+                        function = table[s]
+                        versionhash.update(("%s:%s.%s\n" % (s, function.__module__, function.__name__)).encode())
+                        module = inspect.getmodule(function)
+                        modules[module.__name__] = module
+
+        ## add the BANG modules imported by the modules, and the
+        ## modules that they import, and so on.
+        newmodules = list(modules.values())
+        while newmodules != []:
+                module = newmodules.pop()
+                for value in list(vars(module).values()):
+                        if inspect.ismodule(value) and value.__name__.startswith('bang') and not value.__name__ in modules:
+                                modules[value.__name__] = value
+                                newmodules.append(value)
+
+        for m in sorted(modules):
+                sourcefile = open(inspect.getsourcefile(modules[m]), 'rb')
+                versionhash.update(("%s\n" % m).encode())
+                versionhash.update(sourcefile.read())
+                sourcefile.close()
+        return versionhash.hexdigest()
+
+## Open the cache. Every process (or thread) should open the cache itself.
+## As several processes can write to the cache at the same time a generous
+## timeout is used. The cache is a dictionary with the connection, the
+## maximum size of the cache in bytes and the results and the used entries
+## that still need to be written.
+def opencache(cachefile, maxsize):
+        cache = {}
+        cache['connection'] = sqlite3.connect(cachefile, timeout=300, isolation_level=None)
+        cache['maxsize'] = maxsize
+        cache['pending'] = {}
+        cache['used'] = set()
+        return cache
+
+## Write any pending results and close the cache.
+def closecache(cache):
+        flushcache(cache)
+        cache['connection'].close()
+
+## Initialize the cache: create the tables if needed and remove all
+## entries that were stored with another version. This should be done
+## once per scan, before any process uses the cache.
+def initcache(cachefile, version):
+        cacheconnection = sqlite3.connect(cachefile, timeout=300, isolation_level=None)
+        cacheconnection.execute("CREATE TABLE IF NOT EXISTS results(sha256 TEXT PRIMARY KEY, version TEXT, result TEXT, size INTEGER, lastused REAL)")
+        cacheconnection.execute("CREATE INDEX IF NOT EXISTS results_lastused ON results(lastused)")
+        cacheconnection.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value INTEGER)")
+        cacheconnection.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('totalsize', 0)")
+        cacheconnection.commit()
+
+        cacheconnection.execute("BEGIN IMMEDIATE")
+        cacheconnection.execute("DELETE FROM results WHERE version != ?", (version,))
+        cacheconnection.execute("UPDATE meta SET value = (SELECT IFNULL(SUM(size), 0) FROM results) WHERE key = 'totalsize'")
+        cacheconnection.commit()
+        cacheconnection.close()
+
+## Look up the results for a file in the cache. Returns the stored
+## results, or None if there are no (valid) results for the file. Results
+## that were stored by this process but not yet written are found as well.
+def lookupcache(cache, sha256, version):
+        if sha256 in cache['pending'] and cache['pending'][sha256][0] == version:
+                return json.loads(cache['pending'][sha256][1])
+        res = cache['connection'].execute("SELECT result FROM results WHERE sha256 = ? AND version = ?", (sha256, version)).fetchone()
+        if res == None:
+                return None
+        ## record that the entry was used, for evicting entries later
+        cache['used'].add(sha256)
+        return json.loads(res[0])
+
+## Store the results for a file in the cache. The results have to be
+## serializable as JSON. Results that are bigger than the cache are not
+## stored. The results are written when there are enough results (see
+## flushcache()).
+def storecache(cache, sha256, version, result):
+        storedresult = json.dumps(result)
+        if len(storedresult) > cache['maxsize']:
+                return
+        cache['pending'][sha256] = (version, storedresult)
+        if len(cache['pending']) >= storebatchsize:
+                flushcache(cache)
+
+## Write the pending results and record the entries that were used in a
+## single transaction. If the total size of the cache is then bigger than
+## the maximum size the least recently used entries are removed.
+def flushcache(cache):
+        if cache['pending'] == {} and cache['used'] == set():
+                return
+        cacheconnection = cache['connection']
+        maxsize = cache['maxsize']
+        now = time.time()
+
+        cacheconnection.execute("BEGIN IMMEDIATE")
+        for sha256 in cache['used']:
+                cacheconnection.execute("UPDATE results SET lastused = ? WHERE sha256 = ?", (now, sha256))
+        totalsize = cacheconnection.execute("SELECT value FROM meta WHERE key = 'totalsize'").fetchone()[0]
+        for sha256 in cache['pending']:
+                (version, storedresult) = cache['pending'][sha256]
+                oldentry = cacheconnection.execute("SELECT size FROM results WHERE sha256 = ?", (sha256,)).fetchone()
+                if oldentry != None:
+                        totalsize -= oldentry[0]
+                cacheconnection.execute("INSERT OR REPLACE INTO results(sha256, version, result, size, lastused) VALUES (?, ?, ?, ?, ?)", (sha256, version, storedresult, len(storedresult), now))
+                totalsize += len(storedresult)
+
+        ## remove the least recently used entries until the cache is small
+        ## enough again, but never the entries that were just written or used.
+        while totalsize > maxsize:
+                evictentries = cacheconnection.execute("SELECT sha256, size FROM results WHERE lastused < ? ORDER BY lastused LIMIT 100", (now,)).fetchall()
+                if evictentries == []:
+                        break
+                for (evictsha256, evictsize) in evictentries:
+                        if totalsize <= maxsize:
+                                break
+                        cacheconnection.execute("DELETE FROM results WHERE sha256 = ?", (evictsha256,))
+                        totalsize -= evictsize
+        cacheconnection.execute("UPDATE meta SET value = ? WHERE key = 'totalsize'", (totalsize,))
+        cacheconnection.commit()
+        cache['pending'] = {}
+        cache['used'] = set()
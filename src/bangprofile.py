@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Performance counters for the unpackers. Every scanning process keeps
+## counters per signature: how often the unpacker was tried, how often it
+## succeeded, why it failed, how much wall clock and CPU time was spent
+## and how many bytes were read and written. At the end of the scan the
+## counters of all processes are merged and written to a JSON file, so it
+## is possible to see which unpackers take up most of the scanning time
+## and how much of that time is spent on false positives.
+##
+## The CPU time is the CPU time of the thread running the unpacker, so
+## it is correct when several threads scan files in the same process, plus
+## the CPU time of external programs that were run by the unpacker, which
+## is also counted separately. The reasons why unpacking failed are counted
+## by the reason only, so unpackers should not put data from the file (or
+## the message of an exception) in the reason.
+
+import time, json
+
+import bangtools
+
+## The CPU time of the current thread. Python versions before 3.7 do not
+## have time.thread_time(), so there the CPU time of the whole process
+## is used instead.
+if hasattr(time, 'thread_time'):
+        threadcputime = time.thread_time
+else:
+        threadcputime = time.process_time
+
+## Create a new, empty set of counters for a process.
+def createcounters():
+        return {}
+
+## Get the counters for a single signature, creating them if needed.
+def getsignaturecounters(counters, signature):
+        if not signature in counters:
+                counters[signature] = {'attempts': 0, 'successes': 0,
+                                       'failures': 0, 'failurereasons': {},
+                                       'rejected': 0,
+                                       'walltime': 0.0, 'cputime': 0.0,
+                                       'toolcputime': 0.0,
+                                       'failedwalltime': 0.0, 'failedcputime': 0.0,
+                                       'bytesread': 0, 'byteswritten': 0}
+        return counters[signature]
+
+## Get the current wall clock time, the CPU time of the current thread and
+## the CPU time of the finished external programs run by the current thread.
+def starttimer():
+        return (time.monotonic(), threadcputime(), bangtools.toolcputime())
+
+## Record a candidate that was rejected before the unpacker was called.
+def recordrejected(counters, signature):
+        getsignaturecounters(counters, signature)['rejected'] += 1
+
+## Record a single run of an unpacker. This method has the following
+## parameters:
+##
+## * counters :: the counters of the process
+## * signature :: the signature the unpacker was tried for
+## * timer :: the value returned by starttimer() before the unpacker was run
+## * success :: boolean to indicate whether or not data was unpacked
+## * bytesread :: the amount of bytes of the file that were processed by
+##   the unpacker: the length of the unpacked data, or the distance to the
+##   offset of the error if unpacking failed
+## * byteswritten :: the amount of bytes in the files that were unpacked
+## * reason :: the reason unpacking failed, or None
+def recordunpack(counters, signature, timer, success, bytesread, byteswritten, reason=None):
+        (startwalltime, startcputime, starttoolcputime) = timer
+        (endwalltime, endcputime, endtoolcputime) = starttimer()
+        walltime = endwalltime - startwalltime
+        toolcputime = endtoolcputime - starttoolcputime
+        cputime = endcputime - startcputime + toolcputime
+
+        signaturecounters = getsignaturecounters(counters, signature)
+        signaturecounters['attempts'] += 1
+        signaturecounters['walltime'] += walltime
+        signaturecounters['cputime'] += cputime
+        signaturecounters['toolcputime'] += toolcputime
+        signaturecounters['bytesread'] += max(bytesread, 0)
+        signaturecounters['byteswritten'] += byteswritten
+        if success:
+                signaturecounters['successes'] += 1
+        else:
+                signaturecounters['failures'] += 1
+                signaturecounters['failedwalltime'] += walltime
+                signaturecounters['failedcputime'] += cputime
+                signaturecounters['failurereasons'][reason] = signaturecounters['failurereasons'].get(reason, 0) + 1
+
+## Merge the counters of a process into the counters of the whole scan.
+def mergecounters(totalcounters, counters):
+        for signature in counters:
+                totalsignaturecounters = getsignaturecounters(totalcounters, signature)
+                for c in counters[signature]:
+                        if c == 'failurereasons':
+                                for reason in counters[signature][c]:
+                                        totalsignaturecounters[c][reason] = totalsignaturecounters[c].get(reason, 0) + counters[signature][c][reason]
+                        else:
+                                totalsignaturecounters[c] += counters[signature][c]
+
+## Write the merged counters to a file. This method has the following
+## parameters:
+##
+## * reportfilename :: the absolute path of the file to write the report to
+## * counters :: the merged counters of all the processes
+## * signaturetofunction :: the table mapping signatures to unpackers, used
+##   to record the name of the unpacker for every signature
+def writereport(reportfilename, counters, signaturetofunction):
+        report = {}
+        for signature in sorted(counters):
+                report[signature] = dict(counters[signature])
+                if signature in signaturetofunction:
+                        report[signature]['unpacker'] = signaturetofunction[signature].__name__
+        reportfile = open(reportfilename, 'w')
+        json.dump(report, reportfile, indent=4, sort_keys=True)
+        reportfile.write('\n')
+        reportfile.close()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## A scheduler to distribute files that need to be scanned over the scanning
+## processes, without using a manager process. Every process keeps the files
+## it unpacked in a local queue and only gives away work (through a queue
+## built on a pipe) when other processes are idle, or when the local queue
+## becomes too big (see addwork()). Files are added in
+## batches (for example all files unpacked from an archive) so a single
+## operation is needed for a batch instead of one operation per file.
+##
+## The local queue is a priority queue. The order in which files are scanned
+## is determined by a scheduling policy:
+##
+## * fifo :: files are scanned in the order in which they were found
+## * size :: the biggest files are scanned first, so big files (such as a
+##   root file system found late in the scan) do not end up being scanned
+##   by a single process while the other processes are idle
+## * depth :: the most deeply nested files are scanned first, so the
+##   unpacking tree is walked depth first
+##
+## The number of files that were added but not yet processed is kept in a
+## shared counter. When this counter drops to 0 all work is done and every
+## process is told to stop.
+
+import multiprocessing, heapq, os, time, logging
+
+## import the local file with methods for staging files, which
+## is needed to compute the size of files that are not on disk
+import bangstaging
+
+schedulingpolicies = ['fifo', 'size', 'depth']
+
+## the maximum amount of files in the local queue of a process. Files
+## beyond this are put in the shared queue, so other processes can take
+## them while this process is busy.
+localqueuemaxsize = 256
+
+## Create a scheduler for a number of processes. The scheduler is a
+## dictionary with the shared queue, the shared counters, the number of
+## processes and the scheduling policy and should be passed to every process.
+def createscheduler(processes, policy='size'):
+        if not policy in schedulingpolicies:
+                raise ValueError("unknown scheduling policy %s" % policy)
+        scheduler = {}
+        scheduler['sharedqueue'] = multiprocessing.Queue()
+        scheduler['outstanding'] = multiprocessing.Value('q', 0)
+        scheduler['idle'] = multiprocessing.Value('i', 0)
+        scheduler['processes'] = processes
+        scheduler['policy'] = policy
+        return scheduler
+
+## Create the local queue of a process. This should be done in the
+## process itself. Besides the priority queue itself some statistics
+## are kept, which can be logged with logstatistics().
+def createlocalqueue():
+        localqueue = {}
+        localqueue['heap'] = []
+        localqueue['counter'] = 0
+        localqueue['statistics'] = {'scanned': 0, 'added': 0, 'maxlength': 0,
+                                    'donatedbatches': 0, 'donatedfiles': 0,
+                                    'receivedbatches': 0, 'receivedfiles': 0,
+                                    'idletime': 0.0}
+        return localqueue
+
+## Compute the priority of a file according to the scheduling policy.
+## Files with a lower value are scanned first.
+def computepriority(policy, item):
+        if policy == 'size':
+                ## the file could be kept in memory
+                if item[2] != None:
+                        return -bangstaging.stagedsize(item[2])
+                try:
+                        return -os.lstat(item[0]).st_size
+                except OSError:
+                        return 0
+        elif policy == 'depth':
+                return -item[0].count(os.sep)
+        return 0
+
+## Put a batch of (priority, file) tuples in the local queue. A counter is
+## added so files with the same priority are scanned in the order in
+## which they were added.
+def pushlocal(localqueue, batch):
+        for (priority, item) in batch:
+                heapq.heappush(localqueue['heap'], (priority, localqueue['counter'], item))
+                localqueue['counter'] += 1
+        if len(localqueue['heap']) > localqueue['statistics']['maxlength']:
+                localqueue['statistics']['maxlength'] = len(localqueue['heap'])
+
+## Give away a number of files from the local queue (the files with the
+## highest priority) by putting them in the shared queue.
+def donatelocal(scheduler, localqueue, amount):
+        donate = []
+        for i in range(amount):
+                (priority, counter, item) = heapq.heappop(localqueue['heap'])
+                donate.append((priority, item))
+        localqueue['statistics']['donatedbatches'] += 1
+        localqueue['statistics']['donatedfiles'] += len(donate)
+        scheduler['sharedqueue'].put(donate)
+
+## Add a batch of files to be scanned. If other processes are waiting for
+## work, or if there is no local queue (such as in the main process), the
+## batch is put in the shared queue, otherwise the files are kept in the
+## local queue.
+##
+## Files in the local queue can only be given away by the process itself
+## (in getwork()), which can be busy for a long time scanning a single big
+## file, while other processes become idle. So if there are more than
+## localqueuemaxsize files in the local queue the rest is put in the shared
+## queue, where any process (including this one) can take them.
+def addwork(scheduler, localqueue, items):
+        if items == []:
+                return
+        with scheduler['outstanding'].get_lock():
+                scheduler['outstanding'].value += len(items)
+        batch = sorted(map(lambda x: (computepriority(scheduler['policy'], x), x), items), key=lambda x: x[0])
+        if localqueue == None:
+                scheduler['sharedqueue'].put(batch)
+                return
+        localqueue['statistics']['added'] += len(items)
+        if scheduler['idle'].value > 0:
+                localqueue['statistics']['donatedbatches'] += 1
+                localqueue['statistics']['donatedfiles'] += len(batch)
+                scheduler['sharedqueue'].put(batch)
+        else:
+                pushlocal(localqueue, batch)
+                if scheduler['processes'] > 1 and len(localqueue['heap']) > localqueuemaxsize:
+                        donatelocal(scheduler, localqueue, len(localqueue['heap']) - localqueuemaxsize)
+
+## Get the next file to scan. If there are files in the local queue the
+## file with the highest priority is returned, but if other processes are
+## waiting for work half of the local queue (the files with the highest
+## priority) is given away first. If the local queue is empty wait for work
+## in the shared queue. Returns None if all work is done and the process
+## should stop.
+def getwork(scheduler, localqueue):
+        heap = localqueue['heap']
+        if len(heap) > 1 and scheduler['idle'].value > 0:
+                donatelocal(scheduler, localqueue, len(heap)//2)
+
+        if len(heap) == 0:
+                with scheduler['idle'].get_lock():
+                        scheduler['idle'].value += 1
+                idlestart = time.monotonic()
+                batch = scheduler['sharedqueue'].get()
+                localqueue['statistics']['idletime'] += time.monotonic() - idlestart
+                with scheduler['idle'].get_lock():
+                        scheduler['idle'].value -= 1
+                if batch == None:
+                        return None
+                localqueue['statistics']['receivedbatches'] += 1
+                localqueue['statistics']['receivedfiles'] += len(batch)
+                pushlocal(localqueue, batch)
+
+        localqueue['statistics']['scanned'] += 1
+        return heapq.heappop(heap)[2]
+
+## Mark a file that was returned by getwork() as done. If there are no
+## more files left to be scanned, tell all processes to stop. Any new files
+## that were found while scanning the file should be added with addwork()
+## before calling this method.
+def workdone(scheduler):
+        with scheduler['outstanding'].get_lock():
+                scheduler['outstanding'].value -= 1
+                finished = scheduler['outstanding'].value == 0
+        if finished:
+                for i in range(scheduler['processes']):
+                        scheduler['sharedqueue'].put(None)
+
+## Write the queue statistics of a process to the log, so different
+## scheduling policies can be compared.
+def logstatistics(scheduler, localqueue):
+        statistics = localqueue['statistics']
+        logging.info("QUEUE STATISTICS process %d policy %s: scanned %d, added %d, max queue length %d, donated %d files in %d batches, received %d files in %d batches, idle %.2f seconds" % (os.getpid(), scheduler['policy'], statistics['scanned'], statistics['added'], statistics['maxlength'], statistics['donatedfiles'], statistics['donatedbatches'], statistics['receivedfiles'], statistics['receivedbatches'], statistics['idletime']))
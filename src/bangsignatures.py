@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Helper methods for searching for known signatures (magic headers) in
+## data. Instead of searching the data once for every signature all
+## signatures are combined into a single regular expression, so the data
+## only has to be searched once, no matter how many signatures there are.
+
+import re, binascii
+
+## Compile a matcher for a dictionary of signatures. This method has
+## the following parameters:
+##
+## * signatures :: a dictionary with a signature name as key and the
+##   byte sequence to search for as value
+## * signaturesoffset :: a dictionary with a signature name as key and the
+##   offset of the signature relative to the start of the data to be
+##   carved (example: tar), for signatures that do not start at the
+##   beginning of the data.
+##
+## The signatures are stored in a prefix tree, which is then turned into a
+## single regular expression. At every position in the data the longest
+## byte sequence that matches is returned by the regular expression. A
+## lookup table is then used to find all signatures that match at that
+## position, as a signature could also be a prefix of another signature.
+##
+## The matcher is returned as a tuple:
+##
+## * the compiled regular expression
+## * a dict mapping the longest matched byte sequence to a list of
+##   tuples (signature name, signature length) of the signatures that
+##   match with that byte sequence
+## * the signatures offset dictionary
+## * a set of names of signatures that can overlap with themselves
+## * the length of the longest signature
+def compilesignatures(signatures, signaturesoffset):
+        ## first build a prefix tree from all the signatures
+        signaturetree = {}
+        for s in signatures:
+                node = signaturetree
+                for b in signatures[s]:
+                        node = node.setdefault(b, {})
+                node[None] = True
+
+        ## then turn the prefix tree into a regular expression. Every
+        ## byte is escaped, as signatures are literal byte sequences.
+        def treetoregex(node):
+                alternatives = []
+                for b in sorted(filter(lambda x: x != None, node)):
+                        alternatives.append(re.escape(bytes([b])) + treetoregex(node[b]))
+                if alternatives == []:
+                        return b''
+                if len(alternatives) == 1 and not None in node:
+                        return alternatives[0]
+                regex = b'(?:' + b'|'.join(alternatives) + b')'
+                ## a signature ends here, but a longer signature
+                ## might still match, so the rest is optional.
+                if None in node:
+                        regex += b'?'
+                return regex
+
+        signatureregex = re.compile(treetoregex(signaturetree))
+
+        ## create a lookup table for every signature with all signatures
+        ## that are a prefix of that signature (including the signature
+        ## itself).
+        matchtosignatures = {}
+        for s in signatures:
+                matchtosignatures[signatures[s]] = []
+        for m in matchtosignatures:
+                for s in sorted(signatures):
+                        if m.startswith(signatures[s]):
+                                matchtosignatures[m].append((s, len(signatures[s])))
+
+        ## Searching for each signature separately does not report matches
+        ## of a signature that overlap with an earlier match of the same
+        ## signature (for example 'BMBM' when searching for 'BMBMBM') so
+        ## record which signatures could overlap with themselves.
+        selfoverlapping = set()
+        for s in signatures:
+                sig = signatures[s]
+                for i in range(1, len(sig)):
+                        if sig[i:] == sig[:len(sig)-i]:
+                                selfoverlapping.add(s)
+                                break
+
+        maxsignaturelength = max(map(lambda x: len(x), signatures.values()))
+
+        return (signatureregex, matchtosignatures, signaturesoffset, selfoverlapping, maxsignaturelength)
+
+## Search data for all signatures in a single pass. This method has the
+## following parameters:
+##
+## * matcher :: a matcher created by compilesignatures()
+## * scanbytes :: the data to search (anything supporting the buffer protocol)
+## * offsetinfile :: the offset of scanbytes in the file, used to compute
+##   the offsets that are reported
+## * searchstart :: the position in scanbytes where the search starts
+## * searchend :: the position in scanbytes where the search ends. Only
+##   signatures starting before this position are reported, but data after
+##   this position is used to complete signatures. This makes it possible to
+##   search a large buffer (such as a memory mapped file) window by window
+##   without any overlap between windows.
+##
+## Returns a set of tuples (offset, signature name), with the offset
+## adjusted for signatures that do not start at the beginning of the data
+## to be carved. Candidates that would start before the start of the
+## file are ignored.
+def findsignatures(matcher, scanbytes, offsetinfile, searchstart=0, searchend=None):
+        (signatureregex, matchtosignatures, signaturesoffset, selfoverlapping, maxsignaturelength) = matcher
+        candidateoffsetsfound = set()
+
+        if searchend == None:
+                searchend = len(scanbytes)
+        regexend = min(len(scanbytes), searchend + maxsignaturelength - 1)
+
+        ## keep track of where the last match of self overlapping
+        ## signatures ended, to mimic the behaviour of re.finditer()
+        lastmatchend = {}
+
+        searchfunction = signatureregex.search
+        searchoffset = searchstart
+        while True:
+                res = searchfunction(scanbytes, searchoffset, regexend)
+                if res == None:
+                        break
+                offset = res.start()
+                if offset >= searchend:
+                        break
+
+                ## restart the search at the next byte, as other
+                ## signatures could match in the middle of this match.
+                searchoffset = offset + 1
+                for (s, signaturelength) in matchtosignatures[bytes(res.group())]:
+                        if s in selfoverlapping:
+                                if offset < lastmatchend.get(s, 0):
+                                        continue
+                                lastmatchend[s] = offset + signaturelength
+                        if s in signaturesoffset:
+                                ## skip files that aren't big enough if the signature
+                                ## is not at the start of the data to be carved (example:
+                                ## ISO9660).
+                                if offset + offsetinfile - signaturesoffset[s] < 0:
+                                        continue
+                                candidateoffsetsfound.add((offset + offsetinfile - signaturesoffset[s], s))
+                        else:
+                                candidateoffsetsfound.add((offset + offsetinfile, s))
+        return candidateoffsetsfound
+
+## Cheap checks to reject candidates before an unpacking directory is created
+## and the unpacker is called. Many signatures are short (example: 'BM' for
+## BMP) and are found a lot in binary data, while only a few bytes have to
+## be looked at to see that most of these candidates are false positives.
+##
+## Every prevalidator has the following parameters:
+##
+## * checkbytes :: the first bytes of the data at the candidate offset (at
+##   most prevalidatebytes bytes, less if the end of the file is reached)
+## * offset :: the offset of the candidate in the file
+## * filesize :: the size of the file
+##
+## and returns False if the unpacker is certain to reject the candidate, or
+## True otherwise. The checks are the same as (or weaker than) the checks
+## done by the unpackers, so a candidate that is rejected by a prevalidator
+## would never have been unpacked.
+prevalidatebytes = 512
+
+## BMP: check the declared sizes and the size of the DIB header,
+## see unpackBMP()
+def prevalidateBMP(checkbytes, offset, filesize):
+        if filesize - offset < 26 or len(checkbytes) < 16:
+                return False
+        bmpsize = int.from_bytes(checkbytes[2:6], byteorder='little')
+        if offset + bmpsize > filesize:
+                return False
+        bmpoffset = int.from_bytes(checkbytes[10:14], byteorder='little')
+        if offset + bmpoffset > filesize:
+                return False
+        dibheadersize = int.from_bytes(checkbytes[14:16], byteorder='little')
+        if not dibheadersize in set([12, 64, 16, 40, 52, 56, 108, 124]):
+                return False
+        if offset + 14 + dibheadersize > filesize:
+                return False
+        if bmpoffset < dibheadersize + 14:
+                return False
+        return True
+
+## RIFF: the form type has to be one of the supported form types (see
+## riffformtypes in bangunpack) and the data has to fit in the file.
+def prevalidateRIFF(checkbytes, offset, filesize):
+        if filesize - offset < 12 or len(checkbytes) < 12:
+                return False
+        if not checkbytes[8:12] in [b'WEBP', b'WAVE', b'ACON']:
+                return False
+        rifflength = int.from_bytes(checkbytes[4:8], byteorder='little')
+        return offset + rifflength + 8 <= filesize
+
+## LZMA: check the dictionary size and the declared size of the uncompressed
+## data. The dictionary size has to be 2^n or 2^n + 2^(n-1), which is what
+## liblzma checks when it tries to detect the format of the data, as Python's
+## lzma module does. See unpackLZMA() for the checks of the declared size.
+def prevalidateLZMA(checkbytes, offset, filesize):
+        if filesize - offset < 13 or len(checkbytes) < 13:
+                return False
+        dictionarysize = int.from_bytes(checkbytes[1:5], byteorder='little')
+        if dictionarysize != 0xffffffff:
+                d = (dictionarysize - 1) & 0xffffffff
+                d |= d >> 2
+                d |= d >> 3
+                d |= d >> 4
+                d |= d >> 8
+                d |= d >> 16
+                d = (d + 1) & 0xffffffff
+                if d != dictionarysize:
+                        return False
+        if checkbytes[5:13] != b'\xff\xff\xff\xff\xff\xff\xff\xff':
+                lzmaunpackedsize = int.from_bytes(checkbytes[5:13], byteorder='little')
+                if lzmaunpackedsize == 0 or lzmaunpackedsize > 274877906944:
+                        return False
+        return True
+
+## XZ: the stream flags are protected by a CRC32 and only a few
+## bits may be set.
+def prevalidateXZ(checkbytes, offset, filesize):
+        if len(checkbytes) < 12:
+                return False
+        if checkbytes[6] != 0 or checkbytes[7] & 0xf0 != 0:
+                return False
+        if binascii.crc32(checkbytes[6:8]) != int.from_bytes(checkbytes[8:12], byteorder='little'):
+                return False
+        return True
+
+## gzip: check the flag bits, see unpackGzip()
+def prevalidateGzip(checkbytes, offset, filesize):
+        if len(checkbytes) < 4:
+                return False
+        ## multi-part, encrypted and the reserved bits are not supported
+        if checkbytes[3] & 0b11100100 != 0:
+                return False
+        return True
+
+## squashfs: only versions 1-4 exist, see unpackSquashfs()
+def prevalidateSquashfs(checkbytes, offset, filesize):
+        if filesize - offset < 30 or len(checkbytes) < 30:
+                return False
+        if checkbytes[:4] == b'hsqs':
+                majorversion = int.from_bytes(checkbytes[28:30], byteorder='little')
+        else:
+                majorversion = int.from_bytes(checkbytes[28:30], byteorder='big')
+        if majorversion == 0 or majorversion > 4:
+                return False
+        return True
+
+## Parse a number in a tar header: octal digits, optionally surrounded
+## by spaces and ended by a NUL byte, or (a GNU extension) a big endian
+## binary number if the first byte is 0x80 (positive) or 0xff (negative).
+## Returns None if the field is not a number.
+def parsetarnumber(field):
+        if field[0] == 0x80 or field[0] == 0xff:
+                number = int.from_bytes(field[1:], byteorder='big')
+                if field[0] == 0xff:
+                        number -= 256 ** (len(field) - 1)
+                return number
+        field = field.split(b'\x00', 1)[0].strip()
+        if field == b'':
+                return 0
+        if field.strip(b'01234567') != b'':
+                return None
+        return int(field, 8)
+
+## the bytes that are the same as signed and as unsigned bytes
+lowbytes = bytes(range(128))
+
+## Compute the checksums of a tar header: the sum of all bytes of the header,
+## with the bytes of the checksum field counted as spaces. Some old tar
+## programs summed signed bytes, so both the unsigned and the signed sum
+## are returned.
+def computetarchecksums(header):
+        unsignedchecksum = 256 + sum(header[:148]) + sum(header[156:512])
+        highbytes = len(header[:148].translate(None, lowbytes)) + len(header[156:512].translate(None, lowbytes))
+        return (unsignedchecksum, unsignedchecksum - 256 * highbytes)
+
+## tar: the first header has to have a valid checksum, see unpackTar()
+def prevalidateTar(checkbytes, offset, filesize):
+        if len(checkbytes) < 512:
+                return False
+        checksum = parsetarnumber(checkbytes[148:156])
+        if checksum == None:
+                return False
+        return checksum in computetarchecksums(checkbytes[:512])
+
+## timezone: check the version and the reserved bytes,
+## see unpackTimeZone()
+def prevalidateTimeZone(checkbytes, offset, filesize):
+        if filesize - offset < 44 or len(checkbytes) < 20:
+                return False
+        if not checkbytes[4] in [0x00, 0x32, 0x33]:
+                return False
+        if checkbytes[5:20] != b'\x00' * 15:
+                return False
+        return True
+
+## ar: the global header should be followed by the header of a member,
+## which ends with a fixed magic and has a decimal size, unless the whole
+## file is an empty archive.
+def prevalidateAr(checkbytes, offset, filesize):
+        if checkbytes[7:8] != b'\n':
+                return False
+        if offset == 0 and filesize == 8:
+                return True
+        if checkbytes[66:68] != b'`\n':
+                return False
+        return checkbytes[56:66].strip(b' ').isdigit()
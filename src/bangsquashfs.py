@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## A native reader for squashfs 4 file systems. The superblock, the inode
+## table, the directory table and the fragment table are read directly from
+## the data at the offset of the file system and the files are written
+## straight into the unpacking directory, without first copying the file
+## system to a temporary file and running unsquashfs.
+##
+## The format is described in the squashfs-tools source code (squashfs_fs.h)
+## and here:
+##
+## https://dr-emann.github.io/squashfs/
+##
+## Only squashfs 4 in little endian byte order (the only byte order that
+## mksquashfs creates) with gzip, LZMA or XZ compression is supported. For
+## other file systems the caller should fall back to unsquashfs.
+
+import os, zlib, lzma, struct
+
+## compression methods, see squashfs_fs.h
+compressiongzip = 1
+compressionlzma = 2
+compressionxz = 4
+
+supportedcompression = set([compressiongzip, compressionlzma, compressionxz])
+
+## inode types, see squashfs_fs.h
+inodedirectory = 1
+inodefile = 2
+inodesymlink = 3
+inodeextdirectory = 8
+inodeextfile = 9
+inodeextsymlink = 10
+
+## flags in the superblock
+flagnofragments = 0x0010
+
+## a fragment index of 0xffffffff means that the file does not have a fragment
+nofragment = 0xffffffff
+
+## the maximum size of an uncompressed metadata block
+metadatablocksize = 8192
+
+## Decompress a block of data using the compression method of the file
+## system. At most maxsize bytes are decompressed, so a block that would
+## decompress to more data is rejected before it takes up any more memory.
+def decompressblock(compression, data, maxsize):
+        if compression == compressiongzip:
+                decompressor = zlib.decompressobj()
+                blockdata = decompressor.decompress(data, maxsize)
+                if decompressor.unconsumed_tail != b'':
+                        raise ValueError("block too big")
+                if not decompressor.eof:
+                        raise ValueError("incomplete block")
+                return blockdata
+        elif compression == compressionxz:
+                decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        elif compression == compressionlzma:
+                decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+        else:
+                raise ValueError("unsupported compression")
+        blockdata = decompressor.decompress(data, max_length=maxsize)
+        if not decompressor.eof and not decompressor.needs_input:
+                raise ValueError("block too big")
+        return blockdata
+
+## Unpack a squashfs 4 file system. This method has the following parameters:
+##
+## * filedata :: a buffer with the contents of the file
+## * offset :: the offset of the file system in the buffer
+## * unpackdir :: the directory to write the files to
+##
+## Returns a tuple (unpack status, size of the file system, error) like the
+## unpackers. If the file system cannot be handled by this reader (for
+## example because another compression method is used) 'unsupported' is set
+## in the error and nothing is written, so another unpacker can be tried.
+def unpacksquashfs(filedata, offset, unpackdir):
+        filesize = len(filedata)
+
+        if filesize - offset < 96:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'not enough data for superblock', 'unsupported': False})
+
+        ## read the superblock (squashfs_fs.h: struct squashfs_super_block)
+        (magic, inodecount, mkfstime, blocksize, fragmentcount, compression,
+         blocklog, flags, idcount, majorversion, minorversion, rootinode,
+         bytesused, idtablestart, xattrtablestart, inodetablestart,
+         directorytablestart, fragmenttablestart, lookuptablestart) = struct.unpack('<4sIIIIHHHHHHQQQQQQQQ', filedata[offset:offset+96])
+
+        if magic != b'hsqs' or majorversion != 4:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'not a little endian squashfs 4 file system', 'unsupported': True})
+        if not compression in supportedcompression:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'unsupported compression', 'unsupported': True})
+
+        ## sanity checks for the superblock
+        if blocksize < 4096 or blocksize > 1048576 or 1 << blocklog != blocksize:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'invalid block size', 'unsupported': False})
+        if offset + bytesused > filesize:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'file system cannot extend past file', 'unsupported': False})
+        if inodetablestart >= bytesused or directorytablestart >= bytesused or inodetablestart > directorytablestart:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'invalid table offsets', 'unsupported': False})
+
+        ## cache of decompressed metadata blocks, indexed by the position
+        ## of the block in the file system.
+        metadatacache = {}
+
+        ## Read a metadata block at a position (relative to the start of the
+        ## file system). Returns the uncompressed data and the position of
+        ## the next metadata block.
+        def readmetadatablock(position):
+                if position in metadatacache:
+                        return metadatacache[position]
+                if position + 2 > bytesused:
+                        raise ValueError("metadata outside of file system")
+                header = int.from_bytes(filedata[offset+position:offset+position+2], byteorder='little')
+                blocklength = header & 0x7fff
+                if position + 2 + blocklength > bytesused:
+                        raise ValueError("metadata outside of file system")
+                data = filedata[offset+position+2:offset+position+2+blocklength]
+                if header & 0x8000 == 0:
+                        data = decompressblock(compression, data, metadatablocksize)
+                elif len(data) > metadatablocksize:
+                        raise ValueError("metadata block too big")
+                else:
+                        data = bytes(data)
+                metadatacache[position] = (data, position + 2 + blocklength)
+                return metadatacache[position]
+
+        ## Read metadata that starts in the block at a position (relative to
+        ## the start of the file system), at an offset in the uncompressed
+        ## block. The data can continue in the next blocks.
+        def readmetadata(position, blockoffset, length):
+                data = b''
+                while len(data) < length:
+                        (blockdata, nextposition) = readmetadatablock(position)
+                        if blockoffset > len(blockdata):
+                                raise ValueError("invalid metadata offset")
+                        data += blockdata[blockoffset:blockoffset+length-len(data)]
+                        position = nextposition
+                        blockoffset = 0
+                return data
+
+        ## Read an inode, using a reference to an inode (position of the
+        ## metadata block in the inode table and offset in the block)
+        def readinode(inodereference):
+                inodeposition = inodetablestart + (inodereference >> 16)
+                inodeoffset = inodereference & 0xffff
+                (inodetype, mode, uid, gid, mtime, inodenumber) = struct.unpack('<HHHHII', readmetadata(inodeposition, inodeoffset, 16))
+                inode = {'type': inodetype, 'number': inodenumber}
+                if inodetype == inodedirectory:
+                        (startblock, nlink, dirsize, diroffset, parent) = struct.unpack('<IIHHI', readmetadata(inodeposition, inodeoffset, 32)[16:])
+                        inode['startblock'] = startblock
+                        inode['size'] = dirsize
+                        inode['offset'] = diroffset
+                elif inodetype == inodeextdirectory:
+                        (nlink, dirsize, startblock, parent, indexcount, diroffset, xattr) = struct.unpack('<IIIIHHI', readmetadata(inodeposition, inodeoffset, 40)[16:])
+                        inode['startblock'] = startblock
+                        inode['size'] = dirsize
+                        inode['offset'] = diroffset
+                elif inodetype == inodefile or inodetype == inodeextfile:
+                        if inodetype == inodefile:
+                                headersize = 32
+                                (startblock, fragment, fragmentoffset, datasize) = struct.unpack('<IIII', readmetadata(inodeposition, inodeoffset, headersize)[16:])
+                        else:
+                                headersize = 56
+                                (startblock, datasize, sparse, nlink, fragment, fragmentoffset, xattr) = struct.unpack('<QQQIIII', readmetadata(inodeposition, inodeoffset, headersize)[16:])
+                        if fragment == nofragment:
+                                blockcount = (datasize + blocksize - 1) // blocksize
+                        else:
+                                blockcount = datasize // blocksize
+                        blocklist = readmetadata(inodeposition, inodeoffset, headersize + blockcount * 4)[headersize:]
+                        inode['startblock'] = startblock
+                        inode['size'] = datasize
+                        inode['fragment'] = fragment
+                        inode['fragmentoffset'] = fragmentoffset
+                        inode['blocks'] = struct.unpack('<%dI' % blockcount, blocklist)
+
+                        ## the data blocks of a file are stored one after the
+                        ## other, so they should end inside the file system
+                        if startblock + sum(map(lambda x: x & ~(1 << 24), inode['blocks'])) > bytesused:
+                                raise ValueError("file data outside of file system")
+                elif inodetype == inodesymlink or inodetype == inodeextsymlink:
+                        (nlink, targetsize) = struct.unpack('<II', readmetadata(inodeposition, inodeoffset, 24)[16:])
+                        inode['target'] = readmetadata(inodeposition, inodeoffset, 24 + targetsize)[24:]
+                return inode
+
+        ## Read the entries of a directory. Returns a list of tuples
+        ## (name, inode reference).
+        def readdirectory(inode):
+                ## the size includes 3 bytes for the (non existent)
+                ## entries '.' and '..'
+                if inode['size'] <= 3:
+                        return []
+                listing = readmetadata(directorytablestart + inode['startblock'], inode['offset'], inode['size'] - 3)
+                entries = []
+                listingoffset = 0
+                while listingoffset < len(listing):
+                        (entrycount, startblock, inodenumber) = struct.unpack('<III', listing[listingoffset:listingoffset+12])
+                        listingoffset += 12
+                        for i in range(entrycount + 1):
+                                (entryoffset, inodenumberdelta, entrytype, namesize) = struct.unpack('<HhHH', listing[listingoffset:listingoffset+8])
+                                listingoffset += 8
+                                name = listing[listingoffset:listingoffset+namesize+1]
+                                listingoffset += namesize + 1
+                                entries.append((name, (startblock << 16) | entryoffset))
+                return entries
+
+        ## Read a fragment entry from the fragment table. Returns the
+        ## position and the size word of the fragment block.
+        def readfragment(fragment):
+                if fragment >= fragmentcount:
+                        raise ValueError("invalid fragment")
+                indexposition = fragmenttablestart + (fragment // 512) * 8
+                if indexposition + 8 > bytesused:
+                        raise ValueError("fragment table outside of file system")
+                fragmentblock = int.from_bytes(filedata[offset+indexposition:offset+indexposition+8], byteorder='little')
+                (fragmentstart, fragmentsize, unused) = struct.unpack('<QII', readmetadata(fragmentblock, (fragment % 512) * 16, 16))
+                return (fragmentstart, fragmentsize)
+
+        ## Read a data block (or a fragment block). Blocks with size 0 are
+        ## sparse blocks. Returns the uncompressed data.
+        def readdatablock(position, sizeword, expectedsize):
+                datasize = sizeword & ~(1 << 24)
+                if datasize == 0:
+                        return b'\x00' * expectedsize
+                if position + datasize > bytesused or datasize > blocksize:
+                        raise ValueError("data block outside of file system")
+                data = filedata[offset+position:offset+position+datasize]
+                if sizeword & (1 << 24) == 0:
+                        data = decompressblock(compression, data, blocksize)
+                return data
+
+        ## Write the contents of a file. The file should not exist yet: a
+        ## symbolic link with the same name (for example one that points
+        ## outside of the unpacking directory) is not followed.
+        def writefile(inode, outfilename):
+                outfile = os.fdopen(os.open(outfilename, os.O_WRONLY|os.O_CREAT|os.O_EXCL|os.O_NOFOLLOW), 'wb')
+                position = inode['startblock']
+                remaining = inode['size']
+                for sizeword in inode['blocks']:
+                        data = readdatablock(position, sizeword, min(blocksize, remaining))
+                        outfile.write(data[:remaining])
+                        remaining -= min(len(data), remaining)
+                        position += sizeword & ~(1 << 24)
+                if inode['fragment'] != nofragment and remaining > 0:
+                        (fragmentstart, fragmentsize) = readfragment(inode['fragment'])
+                        data = readdatablock(fragmentstart, fragmentsize, blocksize)
+                        if inode['fragmentoffset'] + remaining > len(data):
+                                raise ValueError("file data outside of fragment")
+                        outfile.write(data[inode['fragmentoffset']:inode['fragmentoffset']+remaining])
+                        remaining = 0
+                outfile.close()
+                if remaining != 0:
+                        raise ValueError("not enough data for file")
+
+        ## Walk the directory tree, starting at the root inode, and write all
+        ## directories, files and symbolic links. Block devices, character
+        ## devices, FIFOs and sockets are not created. Directories are
+        ## tracked to avoid loops in corrupted file systems.
+        unpackedfiles = {}
+        seendirectories = set()
+        try:
+                rootinode = readinode(rootinode)
+                if rootinode['type'] != inodedirectory and rootinode['type'] != inodeextdirectory:
+                        raise ValueError("root inode is not a directory")
+                directories = [(rootinode, unpackdir)]
+                while directories != []:
+                        (directoryinode, directoryname) = directories.pop()
+                        if directoryinode['number'] in seendirectories:
+                                raise ValueError("loop in directory tree")
+                        seendirectories.add(directoryinode['number'])
+                        for (name, inodereference) in readdirectory(directoryinode):
+                                if name == b'' or name == b'.' or name == b'..' or b'/' in name or b'\x00' in name:
+                                        raise ValueError("invalid file name")
+                                outfilename = os.path.join(directoryname, os.fsdecode(name))
+                                inode = readinode(inodereference)
+                                if inode['type'] == inodedirectory or inode['type'] == inodeextdirectory:
+                                        os.mkdir(outfilename)
+                                        directories.append((inode, outfilename))
+                                elif inode['type'] == inodefile or inode['type'] == inodeextfile:
+                                        ## files with more than one name (hard links)
+                                        ## only have to be written once.
+                                        if inode['number'] in unpackedfiles:
+                                                os.link(unpackedfiles[inode['number']], outfilename)
+                                        else:
+                                                writefile(inode, outfilename)
+                                                unpackedfiles[inode['number']] = outfilename
+                                elif inode['type'] == inodesymlink or inode['type'] == inodeextsymlink:
+                                        os.symlink(os.fsdecode(inode['target']), outfilename)
+        except (ValueError, IndexError, KeyError, struct.error, zlib.error, lzma.LZMAError, EOFError, OSError) as e:
+                return (False, 0, {'offset': offset, 'fatal': False, 'reason': 'invalid squashfs file system (%s)' % type(e).__name__, 'unsupported': False})
+
+        return (True, bytesused, {})
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Staging of small unpacked files in memory. Unpackers that carve data
+## (such as PNG files or timezone files) write the data with writefile().
+## If the data is small enough it is not written to disk, but kept in memory
+## and passed together with the name of the file to the process that scans
+## the file, so that process does not have to read the file from disk.
+##
+## The process that scans the file is responsible for writing the file to
+## its final location in the unpacking directory. This is done in batches
+## (see addtoflush() and flushpending()), unless the file is needed on disk
+## earlier (for example because an unpacker needs an external program). The
+## size of a batch depends on the maximum size of files kept in memory, so
+## the memory used for pending files is bounded by the same setting. All
+## pending files are written when a scanning thread stops, so the unpacking
+## directory is complete at the end of the scan.
+##
+## Carved files that are bigger can be kept as a reference to the data in
+## the file they were carved from instead ("virtual carving"): a tuple
+## (source file, offset, size), where the source file is a file on disk.
+## The scanning process maps that range of the source file and scans it in
+## place, so the data is not written and read again. These files are
+## written to disk with os.sendfile() in the same batches as the files that
+## are kept in memory, or earlier when they are needed on disk. Unpackers
+## that carve files from such a file get the name of the file, but carve
+## from the same source file, so nested files are ranges of that file too.
+##
+## The configuration is kept per process, the files that are staged are
+## kept per thread, so several threads in a process can scan files at the
+## same time.
+
+import os, mmap, threading
+
+## the maximum size of files that are kept in memory. 0 means that
+## files are always written to disk immediately.
+stagingmaxsize = 0
+
+## whether or not carved files can be kept as a range of another file
+virtualcarving = False
+
+## the staged files of the current thread (see getstate())
+localstate = threading.local()
+
+## the amount of files after which pending files are written, and the
+## amount of pending bytes kept in memory, as a multiple of the maximum
+## size of files that are kept in memory (see configure())
+flushfiles = 1024
+flushfactor = 256
+flushbytes = 0
+
+## Get the state of the current thread, which has:
+##
+## * currentsource :: the file that is currently scanned by this thread and
+##   where its data can be found on disk, as a tuple (file name, source file,
+##   offset in the source file), or None if the data is not on disk.
+## * stagedfiles :: files that were written by an unpacker in this thread
+##   but not yet handed over to a scanning thread with takestaged()
+## * pendingfiles :: files that were scanned by this thread but not yet
+##   written to disk, together with the amount of bytes kept in memory
+##   for these files (pendingbytes)
+def getstate():
+        if not hasattr(localstate, 'stagedfiles'):
+                localstate.currentsource = None
+                localstate.stagedfiles = {}
+                localstate.pendingfiles = []
+                localstate.pendingbytes = 0
+        return localstate
+
+## Set the maximum size of files that are kept in memory and whether
+## or not carved files can be kept as a range of another file.
+def configure(maxsize, virtual=False):
+        global stagingmaxsize, virtualcarving, flushbytes
+        stagingmaxsize = maxsize
+        virtualcarving = virtual
+        flushbytes = flushfactor * maxsize
+
+## Set where the data of the file that is currently scanned can be found
+## on disk: in sourcefile, starting at sourceoffset. If sourcefile is None
+## the data is only available in memory.
+def setsource(filename, sourcefile, sourceoffset):
+        state = getstate()
+        if sourcefile == None:
+                state.currentsource = None
+        else:
+                state.currentsource = (filename, sourcefile, sourceoffset)
+
+## Carve a file from the file that is currently scanned by keeping a
+## reference to the data instead of copying it. Returns False if this is
+## not possible, in which case the file should be written by the caller.
+def carverange(outfilename, filename, offset, size):
+        currentsource = getstate().currentsource
+        if not virtualcarving or size == 0 or currentsource == None or currentsource[0] != filename:
+                return False
+        getstate().stagedfiles[outfilename] = (currentsource[1], currentsource[2] + offset, size)
+        return True
+
+## Get the size of the data of a staged file.
+def stagedsize(data):
+        if isinstance(data, tuple):
+                return data[2]
+        return len(data)
+
+## Make the data of a staged file available for scanning. Returns a tuple
+## with the opened source file and its mapping (both None if the data is
+## in memory) and a memoryview of the data.
+def openstaged(data):
+        if not isinstance(data, tuple):
+                return (None, None, memoryview(data))
+        (sourcefile, sourceoffset, size) = data
+
+        ## mappings have to start at a multiple of the allocation granularity
+        mapoffset = sourceoffset - sourceoffset % mmap.ALLOCATIONGRANULARITY
+        scanfile = open(sourcefile, 'rb')
+        scanmap = mmap.mmap(scanfile.fileno(), size + sourceoffset - mapoffset, access=mmap.ACCESS_READ, offset=mapoffset)
+        return (scanfile, scanmap, memoryview(scanmap)[sourceoffset-mapoffset:])
+
+## Write a file created by an unpacker. Small files are kept in memory,
+## other files are written to disk immediately.
+def writefile(outfilename, data):
+        if len(data) != 0 and len(data) <= stagingmaxsize:
+                getstate().stagedfiles[outfilename] = bytes(data)
+                return
+        outfile = open(outfilename, 'wb')
+        outfile.write(data)
+        outfile.close()
+
+## Take the data of a file that was staged by an unpacker (the data itself
+## or a range of another file), or None if the file was written to disk.
+def takestaged(filename):
+        return getstate().stagedfiles.pop(filename, None)
+
+## Forget about any staged files in a directory, for example because
+## unpacking failed and the directory is removed.
+def discard(directory):
+        stagedfiles = getstate().stagedfiles
+        for filename in list(stagedfiles.keys()):
+                if filename.startswith(directory + os.sep):
+                        del stagedfiles[filename]
+
+## Update the names of any staged files in a directory after the
+## directory was renamed.
+def movestaged(olddirectory, newdirectory):
+        stagedfiles = getstate().stagedfiles
+        for filename in list(stagedfiles.keys()):
+                if filename.startswith(olddirectory + os.sep):
+                        stagedfiles[newdirectory + filename[len(olddirectory):]] = stagedfiles.pop(filename)
+
+## Write a single file that was kept in memory (or as a range of
+## another file) to disk.
+def writetodisk(filename, data):
+        outfile = open(filename, 'wb')
+        if isinstance(data, tuple):
+                (sourcefile, sourceoffset, size) = data
+                infile = open(sourcefile, 'rb')
+                while size > 0:
+                        written = os.sendfile(outfile.fileno(), infile.fileno(), sourceoffset, size)
+                        if written == 0:
+                                break
+                        sourceoffset += written
+                        size -= written
+                infile.close()
+        else:
+                outfile.write(data)
+        outfile.close()
+
+## Add a file that was kept in memory to the files that still need
+## to be written to disk.
+def addtoflush(filename, data):
+        state = getstate()
+        state.pendingfiles.append((filename, data))
+        ## ranges of other files do not take up any memory
+        if not isinstance(data, tuple):
+                state.pendingbytes += len(data)
+
+## Write pending files to disk, but only if there are enough pending files
+## or enough pending data (or if force is set, for example when the
+## thread stops).
+def flushpending(force=False):
+        state = getstate()
+        if not force and len(state.pendingfiles) < flushfiles and state.pendingbytes < flushbytes:
+                return
+        for (filename, data) in state.pendingfiles:
+                writetodisk(filename, data)
+        state.pendingfiles = []
+        state.pendingbytes = 0
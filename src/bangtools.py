@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## A runner for external programs (such as unsquashfs) that
+## are used by unpackers. All scanning processes share a budget of CPUs for
+## external programs, so running these programs from many scanning processes
+## at the same time does not oversubscribe the machine. A program that uses
+## more than one thread (such as unsquashfs) is told how many threads it may
+## use and takes that many CPUs from the budget while it runs.
+##
+## Every program runs in its own process group and is supervised: if it does
+## not finish within the configured time, or if the scanning process is
+## interrupted, the program and any programs it started are killed, and the
+## CPUs are always given back to the budget.
+##
+## The supervision is deliberately synchronous: runtool() starts a program
+## and the calling thread waits for it, instead of an asyncio event loop
+## supervising many programs. The only unpacker that still runs an external
+## program is the squashfs unpacker, for file systems that are not little
+## endian squashfs 4 (unsquashfs), as ar and BMP are unpacked in process.
+## A scanning thread cannot do anything else while its unpacker waits, so
+## an event loop would only add a thread per process without running more
+## programs at the same time. The budget (a semaphore shared by all
+## processes) is what keeps the machine from being oversubscribed.
+##
+## The CPU time used by the programs is kept per thread (see toolcputime()),
+## so the time of a program can be attributed to the unpacker that ran it,
+## also when several threads run programs at the same time.
+
+import multiprocessing, subprocess, os, signal, tempfile, threading, time
+
+## programs that can use more than one thread, with the options
+## to set the number of threads
+threadoptions = {'unsquashfs': ['-p', '%d']}
+
+## the tool runner used by this process, or None if programs should
+## be run without a budget (for example when using the unpackers
+## outside of the scanner)
+toolrunner = None
+
+## the CPU time of the programs run by the current thread
+localstate = threading.local()
+
+## Create a tool runner with a budget of CPUs for all external programs.
+## The tool runner is a dictionary that should be passed to every process
+## and set with configure(). Parameters:
+##
+## * cpus :: the amount of CPUs that external programs can use at the same time
+## * toolthreads :: the amount of threads that a program that supports
+##   threads can use, at most the amount of CPUs
+## * timeout :: the time in seconds after which a program is killed, or
+##   None if programs can run as long as they need
+def createtoolrunner(cpus, toolthreads, timeout=None):
+        if cpus < 1 or toolthreads < 1:
+                raise ValueError("the CPU budget and the amount of threads should be positive")
+        toolrunner = {}
+        toolrunner['budget'] = multiprocessing.Semaphore(cpus)
+        toolrunner['budgetlock'] = multiprocessing.Lock()
+        toolrunner['cpus'] = cpus
+        toolrunner['toolthreads'] = min(toolthreads, cpus)
+        toolrunner['timeout'] = timeout
+        return toolrunner
+
+## Set the tool runner that is used in this process.
+def configure(runner):
+        global toolrunner
+        toolrunner = runner
+
+## Take a number of CPUs from the budget. The CPUs are taken while
+## holding a lock, so two processes that each need several CPUs cannot
+## both end up waiting with only part of the CPUs they need.
+def acquirecpus(cpus):
+        with toolrunner['budgetlock']:
+                for i in range(cpus):
+                        toolrunner['budget'].acquire()
+
+## Give CPUs back to the budget.
+def releasecpus(cpus):
+        for i in range(cpus):
+                toolrunner['budget'].release()
+
+## Kill a program and everything it started.
+def killtool(p):
+        try:
+                os.killpg(p.pid, signal.SIGKILL)
+        except ProcessLookupError:
+                pass
+
+## Get the CPU time (user and system) of all programs run by the current
+## thread that have finished, including the programs started by them.
+def toolcputime():
+        return getattr(localstate, 'cputime', 0.0)
+
+## Wait for a program to finish, or kill it if it does not finish within
+## the timeout. The program is waited for with os.wait4() instead of with
+## the methods of Popen, as that is the only way to get the CPU time of this
+## program only (os.times() has the CPU time of all finished children of the
+## process, from every thread). Like Popen.wait() the status is polled if
+## there is a timeout.
+def waittool(p, timeout):
+        if timeout == None:
+                (pid, status, resourceusage) = os.wait4(p.pid, 0)
+        else:
+                endtime = time.monotonic() + timeout
+                delay = 0.0005
+                while True:
+                        (pid, status, resourceusage) = os.wait4(p.pid, os.WNOHANG)
+                        if pid != 0:
+                                break
+                        remaining = endtime - time.monotonic()
+                        if remaining <= 0:
+                                killtool(p)
+                                (pid, status, resourceusage) = os.wait4(p.pid, 0)
+                                break
+                        delay = min(delay * 2, remaining, 0.05)
+                        time.sleep(delay)
+        if os.WIFSIGNALED(status):
+                p.returncode = -os.WTERMSIG(status)
+        else:
+                p.returncode = os.WEXITSTATUS(status)
+        localstate.cputime = toolcputime() + resourceusage.ru_utime + resourceusage.ru_stime
+
+## Run an external program and wait until it is done. This method has
+## the following parameters:
+##
+## * args :: the program and its arguments
+## * cwd :: the directory to run the program in
+## * inputdata :: data to send to the program on standard input, or None
+##
+## Returns a tuple (return code, standard output, standard error). If the
+## program was killed because it took too long the return code is negative
+## (like for any other program killed by a signal).
+def runtool(args, cwd=None, inputdata=None):
+        cpus = 1
+        timeout = None
+        if toolrunner != None:
+                timeout = toolrunner['timeout']
+                if args[0] in threadoptions:
+                        cpus = toolrunner['toolthreads']
+                        args = [args[0]] + list(map(lambda x: x.replace('%d', str(cpus)), threadoptions[args[0]])) + args[1:]
+                acquirecpus(cpus)
+        ## The input and output of the program are temporary files instead
+        ## of pipes, so there is nothing to read while waiting for the program
+        ## and it can be waited for with waittool().
+        temporaryfiles = []
+        try:
+                outputfile = tempfile.TemporaryFile()
+                temporaryfiles.append(outputfile)
+                errorfile = tempfile.TemporaryFile()
+                temporaryfiles.append(errorfile)
+                if inputdata == None:
+                        stdin = subprocess.DEVNULL
+                else:
+                        stdin = tempfile.TemporaryFile()
+                        temporaryfiles.append(stdin)
+                        stdin.write(inputdata)
+                        stdin.seek(0)
+                p = subprocess.Popen(args, stdin=stdin, stdout=outputfile, stderr=errorfile, cwd=cwd, start_new_session=True)
+                try:
+                        waittool(p, timeout)
+                except BaseException:
+                        if p.returncode == None:
+                                killtool(p)
+                                p.wait()
+                        raise
+                outputfile.seek(0)
+                outputmsg = outputfile.read()
+                errorfile.seek(0)
+                errormsg = errorfile.read()
+                return (p.returncode, outputmsg, errormsg)
+        finally:
+                for temporaryfile in temporaryfiles:
+                        temporaryfile.close()
+                if toolrunner != None:
+                        releasecpus(cpus)
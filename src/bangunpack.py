@@ -16,13 +16,13 @@
 ##  6. XZ
 ##  7. timezone files
 ##  8. tar
+##  9. PNG (needs PIL for strict validation)
+## 10. ar
+## 11. BMP
 ##
 ## Unpackers needing external Python libraries or other tools
 ##
-##  1. PNG (needs PIL)
-##  2. ar (needs binutils)
-##  3. squashfs (needs squashfs-tools)
-##  4. BMP (needs netpbm-progs)
+##  1. squashfs (needs squashfs-tools for versions other than 4)
 ##
 ## For these unpackers it has been attempted to reduce disk I/O as much as possible
 ## using the os.sendfile() method, as well as techniques described in this blog
@@ -30,20 +30,47 @@
 ##
 ## https://eli.thegreenplace.net/2011/11/28/less-copies-in-python-with-the-buffer-protocol-and-memoryviews
 
-import sys, os, struct, shutil, binascii, zlib, subprocess, lzma, tarfile, stat
-import tempfile
+import sys, os, struct, shutil, binascii, zlib, lzma, stat
+import tempfile, string, mmap, io
 
 ## some external packages that are needed
 import PIL.Image
 
+## Whether or not files should be validated more strictly, at the cost of
+## more CPU time and memory (currently: PNG files are fully decoded with PIL)
+strictvalidation = False
+
+## Set whether or not files should be validated more strictly.
+def configure(strict):
+        global strictvalidation
+        strictvalidation = strict
+
+## import the local file with methods for staging small files in memory
+import bangstaging
+
+## import the local file with the signatures, for parsing tar headers
+import bangsignatures
+
+## import the local file with the squashfs reader
+import bangsquashfs
+
+## import the local file for running external programs
+import bangtools
+
 ## Each unpacker has a specific interface:
 ##
-## def unpacker(filename, offset, unpackdir)
+## def unpacker(filename, offset, unpackdir, temporarydirectory, filedata=None)
 ##
 ## * filename: full file name
 ## * offset: offset inside the file where the file system, compressed file
 ##   media file possibly starts
 ## * unpackdir: the target directory where data should be written to
+## * temporarydirectory: the directory where temporary files can be written to
+## * filedata: optional read only buffer (such as a memoryview of a memory
+##   mapping) with the full contents of the file. If set unpackers can use it
+##   to parse data directly from memory instead of opening the file, seeking
+##   and reading. Unpackers should not keep references to (slices of) this
+##   buffer after returning, or modify it.
 ##
 ## The unpackers are supposed to return the following data (in this order):
 ##
@@ -62,43 +89,74 @@ import PIL.Image
 ##   errors are format violations (files, etc.)
 ## * offset: offset where the error occured
 ## * reason: human readable description of the error
-
-## A verifier for the WebP file format.
-## Uses the description of the WebP file format as described here:
 ##
-## https://developers.google.com/speed/webp/docs/riff_container
-def unpackWebP(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
-        unpackedfilesandlabels = []
-
-        ## a list of valid WebP chunk FourCC
+## Unpackers that carve files from the data should write these files with
+## carvefile() (or bangstaging.writefile() for data that is not carved), so
+## they can be kept in memory or as a range of the file that is scanned.
+
+## RIFF is a container format used by several other formats, which are
+## recognized by the form type that follows the length of the RIFF data.
+## For each of the supported form types this table has the name of the
+## format, the valid chunk FourCC and the labels for the format.
+riffformtypes = {
+        ## https://developers.google.com/speed/webp/docs/riff_container
         ## also contains the deprecated FRGM
-        validchunkfourcc = set([b'ALPH', b'ANIM', b'ANMF', b'EXIF', b'FRGM', b'ICCP', b'VP8 ', b'VP8L', b'VP8X', b'XMP '])
-        (unpackstatus, unpackedsize, unpackedfiles, labels, error) = unpackRIFF(filename, offset, unpackdir, validchunkfourcc, 'WebP', b'WEBP', filesize)
-        if unpackstatus:
-                if offset == 0 and unpackedsize == filesize:
-                        labels += ['webp', 'graphics']
-                for u in unpackedfiles:
-                        unpackedfilesandlabels.append((u, ['webp', 'graphics', 'unpacked']))
-        return (unpackstatus, unpackedsize, unpackedfilesandlabels, labels, error)
+        b'WEBP': ('WebP', set([b'ALPH', b'ANIM', b'ANMF', b'EXIF', b'FRGM', b'ICCP', b'VP8 ', b'VP8L', b'VP8X', b'XMP ']), ['webp', 'graphics']),
+
+        ## https://sites.google.com/site/musicgapi/technical-documents/wav-file-format
+        ## http://www-mmsp.ece.mcgill.ca/Documents/AudioFormats/WAVE/WAVE.html
+        b'WAVE': ('WAV', set([b'LGWV', b'bext', b'cue ', b'data', b'fact', b'fmt ', b'inst', b'labl', b'list', b'ltxt', b'note', b'plst', b'smpl']), ['wav', 'audio']),
+
+        ## test files for ANI: http://www.anicursor.com/diercur.html
+        ## http://fileformats.archiveteam.org/wiki/Windows_Animated_Cursor#Sample_files
+        b'ACON': ('ANI', set([b'IART', b'ICON', b'INAM', b'LIST', b'anih', b'rate', b'seq ']), ['ani', 'graphics']),
+}
+
+## A verifier for RIFF files. The form type is read once and the chunks
+## are checked with the chunk FourCC for that form type (see riffformtypes),
+## so a single signature ('RIFF') is enough for all supported formats.
+def unpackRIFFForm(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
+        if filesize - offset < 12:
+                unpackingerror = {'offset': offset, 'reason': 'less than 12 bytes', 'fatal': False}
+                return (False, 0, [], [], unpackingerror)
+
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackRIFFForm, filename, filename, offset, unpackdir, temporarydirectory)
+
+        formtype = bytes(filedata[offset+8:offset+12])
+        if not formtype in riffformtypes:
+                unpackingerror = {'offset': offset+8, 'reason': 'unsupported RIFF form type', 'fatal': False}
+                return (False, 0, [], [], unpackingerror)
+        return unpackRIFFFormType(filename, offset, unpackdir, formtype, filesize, filedata)
+
+## A verifier for the WebP file format.
+def unpackWebP(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
+        return unpackRIFFFormType(filename, offset, unpackdir, b'WEBP', filesize, filedata)
 
 ## A verifier for the WAV file format.
-## Uses the description of the WAV file format as described here:
-##
-## https://sites.google.com/site/musicgapi/technical-documents/wav-file-format
-## http://www-mmsp.ece.mcgill.ca/Documents/AudioFormats/WAVE/WAVE.html
-def unpackWAV(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+def unpackWAV(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
+        return unpackRIFFFormType(filename, offset, unpackdir, b'WAVE', filesize, filedata)
+
+## A verifier for the ANI file format.
+def unpackANI(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
+        return unpackRIFFFormType(filename, offset, unpackdir, b'ACON', filesize, filedata)
+
+## Verify a RIFF file of one of the form types in riffformtypes and
+## label the file, or the carved file, with the labels of the form type.
+def unpackRIFFFormType(filename, offset, unpackdir, formtype, filesize, filedata=None):
         unpackedfilesandlabels = []
-
-        ## a list of valid WAV chunk FourCC
-        validchunkfourcc = set([b'LGWV', b'bext', b'cue ', b'data', b'fact', b'fmt ', b'inst', b'labl', b'list', b'ltxt', b'note', b'plst', b'smpl'])
-        (unpackstatus, unpackedsize, unpackedfiles, labels, error) = unpackRIFF(filename, offset, unpackdir, validchunkfourcc, 'WAV', b'WAVE', filesize)
+        (applicationname, validchunkfourcc, formlabels) = riffformtypes[formtype]
+        (unpackstatus, unpackedsize, unpackedfiles, labels, error) = unpackRIFF(filename, offset, unpackdir, validchunkfourcc, applicationname, formtype, filesize, filedata)
         if unpackstatus:
                 if offset == 0 and unpackedsize == filesize:
-                        labels += ['wav', 'audio']
+                        labels += formlabels
                 for u in unpackedfiles:
-                        unpackedfilesandlabels.append((u, ['wav', 'audio', 'unpacked']))
+                        unpackedfilesandlabels.append((u, formlabels + ['unpacked']))
         return (unpackstatus, unpackedsize, unpackedfilesandlabels, labels, error)
 
 ## An unpacker for RIFF. This is a helper method used by unpackers for:
@@ -106,127 +164,95 @@ def unpackWAV(filename, offset, unpackdir, temporarydirectory):
 ## * WAV
 ## * ANI
 ## https://en.wikipedia.org/wiki/Resource_Interchange_File_Format
-def unpackRIFF(filename, offset, unpackdir, validchunkfourcc, applicationname, applicationheader, filesize):
+def unpackRIFF(filename, offset, unpackdir, validchunkfourcc, applicationname, applicationheader, filesize, filedata=None):
         labels = []
         ## First check if the file size is 12 bytes or more. If not, then it is not a valid RIFF file
         if filesize - offset < 12:
                 unpackingerror = {'offset': offset, 'reason': 'less than 12 bytes', 'fatal': False}
                 return (False, 0, [], labels, unpackingerror)
 
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackRIFF, filename, filename, offset, unpackdir, validchunkfourcc, applicationname, applicationheader, filesize)
+
         unpackedsize = 0
 
-        ## Then open the file and read the first four bytes to see if they are "RIFF"
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset)
-        checkbytes = checkfile.read(4)
-        if checkbytes != b'RIFF':
-                checkfile.close()
+        ## Then check if the first four bytes are "RIFF"
+        if filedata[offset:offset+4] != b'RIFF':
                 unpackingerror = {'offset': offset, 'reason': 'no valid RIFF header', 'fatal': False}
                 return (False, 0, [], labels, unpackingerror)
         unpackedsize += 4
 
         ## Then read four bytes and check the length (stored in little endian format)
-        checkbytes = checkfile.read(4)
-        rifflength = int.from_bytes(checkbytes, byteorder='little')
+        rifflength = int.from_bytes(filedata[offset+4:offset+8], byteorder='little')
         ## the data cannot go outside of the file
-        if rifflength + 8 > filesize:
-                checkfile.close()
+        if offset + rifflength + 8 > filesize:
                 unpackingerror = {'offset': offset+unpackedsize, 'reason': 'wrong length', 'fatal': False}
                 return (False, 0, [], labels, unpackingerror)
         unpackedsize += 4
 
         ## Then read four bytes and check if they match the supplied header
-        checkbytes = checkfile.read(4)
-        if checkbytes != applicationheader:
-                checkfile.close()
+        if filedata[offset+8:offset+12] != applicationheader:
                 unpackingerror = {'offset': offset+unpackedsize, 'reason': 'no valid %s header' % applicationname, 'fatal': False}
                 return (False, 0, [], labels, unpackingerror)
         unpackedsize += 4
 
         ## then read chunks
-        while checkfile.tell() != offset + rifflength + 8:
+        curpos = offset + 12
+        while curpos != offset + rifflength + 8:
                 haspadding = False
-                checkbytes = checkfile.read(4)
+                checkbytes = bytes(filedata[curpos:curpos+4])
                 if len(checkbytes) != 4:
-                        checkfile.close()
                         unpackingerror = {'offset': offset + unpackedsize, 'reason': 'no valid chunk header', 'fatal': False}
                         return (False, 0, [], labels, unpackingerror)
                 if not checkbytes in validchunkfourcc:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset + unpackedsize, 'reason': 'no valid chunk FourCC %s' % checkbytes, 'fatal': False}
+                        unpackingerror = {'offset': offset + unpackedsize, 'reason': 'no valid chunk FourCC', 'fatal': False}
                         return (False, 0, [], labels, unpackingerror)
                 unpackedsize += 4
 
                 ## then the chunk size
-                checkbytes = checkfile.read(4)
-                chunklength = int.from_bytes(checkbytes, byteorder='little')
+                chunklength = int.from_bytes(filedata[curpos+4:curpos+8], byteorder='little')
                 if chunklength % 2 != 0:
                         chunklength += 1
                         haspadding = True
-                curpos = checkfile.tell()
+                curpos = min(curpos + 8, filesize)
                 if chunklength > filesize - curpos:
-                        checkfile.close()
                         unpackingerror = {'offset': offset + unpackedsize, 'reason': 'wrong chunk length', 'fatal': False}
                         return (False, 0, [], labels, unpackingerror)
                 unpackedsize += 4
 
                 ## finally skip over the bytes in the file
                 if haspadding:
-                        checkfile.seek(curpos + chunklength-1)
-                        paddingbyte = checkfile.read(1)
-                        if not paddingbyte == b'\x00':
-                                checkfile.close()
+                        if filedata[curpos + chunklength-1] != 0:
                                 unpackingerror = {'offset': offset + unpackedsize, 'reason': 'wrong value for padding byte length', 'fatal': False}
                                 return (False, 0, [], labels, unpackingerror)
-                else:
-                        checkfile.seek(curpos + chunklength)
+                curpos += chunklength
                 unpackedsize += chunklength
 
         ## extra sanity check to see if the size of the unpacked data
         ## matches the declared size from the header.
         if unpackedsize != rifflength + 8:
-                checkfile.close()
                 unpackingerror = {'offset': offset, 'reason': 'unpacked size does not match declared size', 'fatal': False}
                 return (False, 0, [], labels, unpackingerror)
 
         ## if the entire file is the RIFF file, then label it as such
         if offset == 0 and unpackedsize == filesize:
-                checkfile.close()
                 labels.append('riff')
                 return (True, unpackedsize, [], labels, {})
 
         ## else carve the file. It is anonymous, so just give it a name
         outfilename = os.path.join(unpackdir, "unpacked-%s" % applicationname.lower())
-        outfile = open(outfilename, 'wb')
-        os.sendfile(outfile.fileno(), checkfile.fileno(), offset, unpackedsize)
-        outfile.close()
-        checkfile.close()
+        carvefile(filename, filedata, offset, unpackedsize, outfilename)
 
         return(True, unpackedsize, [outfilename], labels, {})
 
-## test files for ANI: http://www.anicursor.com/diercur.html
-## http://fileformats.archiveteam.org/wiki/Windows_Animated_Cursor#Sample_files
-def unpackANI(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
-        unpackedfilesandlabels = []
-
-        ## a list of valid ANI chunk FourCC
-        validchunkfourcc = set([b'IART', b'ICON', b'INAM', b'LIST', b'anih', b'rate', b'seq '])
-        (unpackstatus, unpackedsize, unpackedfiles, labels, error) = unpackRIFF(filename, offset, unpackdir, validchunkfourcc, 'ANI', b'ACON', filesize)
-        if unpackstatus:
-                if offset == 0 and unpackedsize == filesize:
-                        labels += ['ani', 'graphics']
-                for u in unpackedfiles:
-                        unpackedfilesandlabels.append((u, ['ani', 'graphics', 'unpacked']))
-        return (unpackstatus, unpackedsize, unpackedfilesandlabels, labels, error)
-
 ## PNG specifications can be found at:
 ##
 ## https://www.w3.org/TR/PNG/
 ##
 ## Section 5 describes the structure of a PNG file
-def unpackPNG(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+def unpackPNG(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackedsize = 0
@@ -235,23 +261,23 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'File too small (less than 57 bytes'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## open the file skip over the magic header bytes (section 5.2)
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset+8)
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackPNG, filename, filename, offset, unpackdir, temporarydirectory)
+
+        ## skip over the magic header bytes (section 5.2)
         unpackedsize = 8
 
         ## Then process the PNG data. All data is in network byte order (section 7)
         ## First read the size of the first chunk, which is always 25 bytes (section 11.2.2)
-        checkbytes = checkfile.read(25)
+        checkbytes = filedata[offset+8:offset+33]
         if checkbytes[0:4] != b'\x00\x00\x00\x0d':
                 unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'no valid chunk length'}
-                checkfile.close()
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## The first chunk *has* to be IHDR
         if checkbytes[4:8] != b'IHDR':
                 unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'no IHDR header'}
-                checkfile.close()
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## then compute the CRC32 of bytes 4 - 21 (header + data)
@@ -260,47 +286,66 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
         crcstored = int.from_bytes(checkbytes[21:25], byteorder='big')
         if crccomputed != crcstored:
                 unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'Wrong CRC'}
-                checkfile.close()
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## Then check the values in the IHDR chunk (section 11.2.2), which
+        ## are needed to compute the size of the image data.
+        (width, height, bitdepth, colortype, compressionmethod, filtermethod, interlacemethod) = struct.unpack('>IIBBBBB', checkbytes[8:21])
+        if width == 0 or height == 0 or width > 2147483647 or height > 2147483647:
+                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'invalid PNG dimensions'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        if not colortype in pngchannels or not bitdepth in pngbitdepths[colortype]:
+                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'invalid PNG color type or bit depth'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        if compressionmethod != 0 or filtermethod != 0 or interlacemethod > 1:
+                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'invalid PNG compression, filter or interlace method'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        imagedatasize = computepngimagedatasize(width, height, bitdepth * pngchannels[colortype], interlacemethod)
         unpackedsize += 25
 
+        ## The image data in the IDAT chunks is a single zlib stream, which
+        ## is decompressed while the chunks are read, to check that it is
+        ## valid and has the size computed from the IHDR chunk. The
+        ## decompressed data itself is not needed, so it is thrown away.
+        decompressor = zlib.decompressobj()
+        inflatedsize = 0
+
         ## Then move on to the next chunks in similar fashion (section 5.3)
         endoffilereached = False
         idatseen = False
+        idatended = False
         chunknames = set()
         while True:
                 ## read the chunk size
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
+                curpos = offset + unpackedsize
+                if filesize - curpos < 4:
                         unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'Could not read chunk size'}
-                        checkfile.close()
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-                chunksize = int.from_bytes(checkbytes, byteorder='big')
+                chunksize = int.from_bytes(filedata[curpos:curpos+4], byteorder='big')
                 if offset + chunksize > filesize:
                         unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'PNG data bigger than file'}
-                        checkfile.close()
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
                 unpackedsize += 4
 
-                ## read the chunk type, plus the chunk data
-                checkbytes = checkfile.read(4+chunksize)
-                chunktype = checkbytes[0:4]
-                if len(checkbytes) != 4+chunksize:
+                ## the chunk type, plus the chunk data
+                if filesize - (curpos + 4) < 4 + chunksize:
                         unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'Could not read chunk type'}
-                        checkfile.close()
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+                chunktype = bytes(filedata[curpos+4:curpos+8])
 
                 unpackedsize += 4+chunksize
 
                 ## compute the CRC
-                crccomputed = binascii.crc32(checkbytes)
-                checkbytes = checkfile.read(4)
-                crcstored = int.from_bytes(checkbytes, byteorder='big')
+                crccomputed = computecrc32(filedata, curpos+4, curpos+8+chunksize)
+                crcstored = int.from_bytes(filedata[curpos+8+chunksize:curpos+12+chunksize], byteorder='big')
                 if crccomputed != crcstored:
                         unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'Wrong CRC'}
-                        checkfile.close()
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
+                ## the IDAT chunks have to be consecutive (section 5.6)
+                if idatseen and chunktype != b'IDAT':
+                        idatended = True
+
                 ## add the name of the chunk to the list of chunk names
                 chunknames.add(chunktype)
                 if chunktype == b'IEND':
@@ -310,15 +355,47 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
                         break
                 elif chunktype == b'IDAT':
                         ## a valid PNG file has to have a IDAT section
+                        if idatended:
+                                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'IDAT chunks not consecutive'}
+                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
                         idatseen = True
+
+                        ## decompress the data in the chunk, at most
+                        ## 1 MiB of data at a time. Like libpng any
+                        ## data after the end of the zlib stream is ignored.
+                        checkbytes = filedata[curpos+8:curpos+8+chunksize]
+                        try:
+                                while not decompressor.eof:
+                                        chunkinflatedsize = len(decompressor.decompress(checkbytes, 1048576))
+                                        inflatedsize += chunkinflatedsize
+                                        if inflatedsize > imagedatasize:
+                                                break
+                                        checkbytes = decompressor.unconsumed_tail
+                                        if checkbytes == b'' and chunkinflatedsize < 1048576:
+                                                break
+                        except zlib.error:
+                                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'invalid compressed image data'}
+                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+                        if inflatedsize > imagedatasize:
+                                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'image data bigger than declared dimensions'}
+                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+                elif chunktype == b'PLTE' and not idatseen:
+                        ## the palette has to be a multiple of 3 bytes (section 11.2.3)
+                        if chunksize == 0 or chunksize % 3 != 0:
+                                unpackingerror = {'offset': offset + unpackedsize, 'fatal': False, 'reason': 'invalid PLTE chunk'}
+                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
                 unpackedsize += 4
 
         ## There has to be at least 1 IDAT chunk (section 5.6)
         if not idatseen:
-                checkfile.close()
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'No IDAT found'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
+        ## images with a palette need a PLTE chunk (section 11.2.3)
+        if colortype == 3 and not b'PLTE' in chunknames:
+                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'No PLTE found'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
         ## Check whether or not the PNG is animated.
         ## https://wiki.mozilla.org/APNG_Specification
         animated = False
@@ -327,16 +404,22 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
 
         ## There has to be exactly 1 IEND chunk (section 5.6)
         if endoffilereached:
-                if offset == 0 and unpackedsize == filesize:
-                        ## now load the file into PIL as an extra sanity check
+                ## the image data has to be complete
+                if not decompressor.eof or inflatedsize != imagedatasize:
+                        unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'image data does not match declared dimensions'}
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+                ## if configured, load the data into PIL as an extra sanity check
+                if strictvalidation:
                         try:
-                                testimg = PIL.Image.open(checkfile)
+                                testimg = PIL.Image.open(io.BytesIO(filedata[offset:offset+unpackedsize]))
                                 testimg.load()
+                                testimg.close()
                         except Exception as e:
-                                checkfile.close()
                                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'invalid PNG data according to PIL'}
                                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                        checkfile.close()
+
+                if offset == 0 and unpackedsize == filesize:
                         labels += ['png', 'graphics']
                         if animated:
                                 labels.append('animated')
@@ -345,19 +428,7 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
 
                 ## else carve the file. It is anonymous, so just give it a name
                 outfilename = os.path.join(unpackdir, "unpacked.png")
-                outfile = open(outfilename, 'wb')
-                os.sendfile(outfile.fileno(), checkfile.fileno(), offset, unpackedsize)
-                outfile.close()
-                checkfile.close()
-
-                ## now load the file into PIL as an extra sanity check
-                try:
-                        testimg = PIL.Image.open(outfilename)
-                        testimg.load()
-                except:
-                        os.unlink(outfilename)
-                        unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'invalid PNG data according to PIL'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+                carvefile(filename, filedata, offset, unpackedsize, outfilename)
 
                 if animated:
                         unpackedfilesandlabels.append((outfilename, ['png', 'graphics', 'animated', 'apng', 'unpacked']))
@@ -366,10 +437,35 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
                 return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
         ## There is no end of file, so it is not a valid PNG.
-        checkfile.close()
         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'No IEND found'}
         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
+## The amount of channels for each PNG color type and the valid
+## bit depths per color type (section 11.2.2)
+pngchannels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+pngbitdepths = {0: set([1, 2, 4, 8, 16]), 2: set([8, 16]), 3: set([1, 2, 4, 8]),
+                4: set([8, 16]), 6: set([8, 16])}
+
+## The start and the step of rows and columns of the 7 passes of
+## Adam7 interlacing (section 8.2) as (row start, column start,
+## row step, column step)
+adam7passes = [(0, 0, 8, 8), (0, 4, 8, 8), (4, 0, 8, 4), (0, 2, 4, 4),
+               (2, 0, 4, 2), (0, 1, 2, 2), (1, 0, 2, 1)]
+
+## Compute the size of the decompressed PNG image data: every row of every
+## (interlacing) pass starts with a filter type byte, followed by the pixels
+## of the row, padded to a whole byte (sections 7.2 and 8.2).
+def computepngimagedatasize(width, height, bitsperpixel, interlacemethod):
+        if interlacemethod == 0:
+                return height * (1 + (width * bitsperpixel + 7) // 8)
+        imagedatasize = 0
+        for (rowstart, columnstart, rowstep, columnstep) in adam7passes:
+                passwidth = (width - columnstart + columnstep - 1) // columnstep
+                passheight = (height - rowstart + rowstep - 1) // rowstep
+                if passwidth > 0 and passheight > 0:
+                        imagedatasize += passheight * (1 + (passwidth * bitsperpixel + 7) // 8)
+        return imagedatasize
+
 ## Derived from public gzip specifications and Python module documentation
 ## The gzip format is described in RFC 1952
 ## https://tools.ietf.org/html/rfc1952
@@ -381,15 +477,25 @@ def unpackPNG(filename, offset, unpackdir, temporarydirectory):
 ## Python's gzip module cannot be used, as it cannot correctly process
 ## gzip data if there is other non-gzip data following the gzip compressed
 ## data, so it has to be processed another way.
-def unpackGzip(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+def unpackGzip(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
         unpackedsize = 0
 
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset+3)
+        ## the gzip header has at least 10 bytes, and there should be at
+        ## least one byte of compressed data and 8 bytes of trailer.
+        if filesize - offset < 10:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackGzip, filename, filename, offset, unpackdir, temporarydirectory)
+
+        ## read the fixed part of the header at once
+        checkbytes = filedata[offset:offset+10]
         unpackedsize += 3
         ## RFC 1952 http://www.zlib.org/rfc-gzip.html describes the flags, but omits the "encrytion" flag (bit 5)
         ##
@@ -398,66 +504,47 @@ def unpackGzip(filename, offset, unpackdir, temporarydirectory):
         ## * encrypt (bit 5)
         ##
         ## RFC 1952 says that bit 6 and 7 should not be set
-        checkbytes = checkfile.read(1)
-        if len(checkbytes) != 1:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
-                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-        if (checkbytes[0] >> 2 & 1) == 1:
+        flags = checkbytes[3]
+        if (flags >> 2 & 1) == 1:
                 ## continuation of multi-part gzip
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'unsupported multi-part gzip'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-        if (checkbytes[0] >> 5 & 1) == 1:
+        if (flags >> 5 & 1) == 1:
                 ## encrypted
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'unsupported encrypted'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-        if (checkbytes[0] >> 6 & 1) == 1 or (checkbytes[0] >> 7 & 1) == 1:
+        if (flags >> 6 & 1) == 1 or (flags >> 7 & 1) == 1:
                 ## reserved
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not a valid gzip file'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 1
 
-        havecrc16 = False
         ## if bit on is set then there is a CRC16
-        if (checkbytes[0] >> 1 & 1) == 1:
-                havecrc16 = True
+        havecrc16 = (flags >> 1 & 1) == 1
 
-        havefextra = False
         ## if bit two is set then there is extra info
-        if (checkbytes[0] >> 2 & 1) == 1:
-                havefextra = True
+        havefextra = (flags >> 2 & 1) == 1
 
-        havefname = False
         ## if bit three is set then there is a name
-        if (checkbytes[0] >> 3 & 1) == 1:
-                havefname = True
+        havefname = (flags >> 3 & 1) == 1
 
-        havecomment = False
         ## if bit four is set then there is a comment
-        if (checkbytes[0] >> 4 & 1) == 1:
-                havecomment = True
+        havecomment = (flags >> 4 & 1) == 1
 
         ## skip over the MIME field
-        checkfile.seek(4,os.SEEK_CUR)
         unpackedsize += 4
 
         ## skip over the XFL and OS fields
-        checkfile.seek(2,os.SEEK_CUR)
         unpackedsize += 2
 
         ## optional XLEN
         if havefextra:
-                checkbytes = checkfile.read(2)
+                checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+2]
                 if len(checkbytes) != 2:
-                        checkfile.close()
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
                 xlen = int.from_bytes(checkbytes, byteorder='little')
-                if checkfile.tell() + xlen > filesize:
-                        checkfile.close()
+                if offset + unpackedsize + 2 + xlen > filesize:
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'extra data outside of file'}
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
                 unpackedsize +=  xlen + 2
@@ -466,56 +553,37 @@ def unpackGzip(filename, offset, unpackdir, temporarydirectory):
         ## This can be used later to rename the file. Because of
         ## false positives the name cannot be checked now.
         if havefname:
-                origname = b''
-                while True:
-                        checkbytes = checkfile.read(1)
-                        if len(checkbytes) != 1:
-                                checkfile.close()
-                                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'file name data outside of file'}
-                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-                        if checkbytes == b'\x00':
-                                unpackedsize += 1
-                                break
-                        origname += checkbytes
-                        unpackedsize += 1
+                endofname = findnul(filedata, offset+unpackedsize)
+                if endofname == -1:
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'file name data outside of file'}
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+                origname = bytes(filedata[offset+unpackedsize:endofname])
+                unpackedsize = endofname - offset + 1
 
-       ## then extract the comment
+        ## then extract the comment
         origcomment = b''
         if havecomment:
-                while True:
-                        checkbytes = checkfile.read(1)
-                        if len(checkbytes) != 1:
-                                checkfile.close()
-                                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'comment data outside of file'}
-                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-                        if checkbytes == b'\x00':
-                                unpackedsize += 1
-                                break
-                        origcomment += checkbytes
-                        unpackedsize += 1
-        #origcomment = origcomment.decode()
+                endofcomment = findnul(filedata, offset+unpackedsize)
+                if endofcomment == -1:
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'comment data outside of file'}
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+                origcomment = bytes(filedata[offset+unpackedsize:endofcomment])
+                unpackedsize = endofcomment - offset + 1
 
         ## skip over the CRC16, if present
         if havecrc16:
-                checkfile.seek(2,os.SEEK_CUR)
                 unpackedsize += 2
 
         ## next are blocks of zlib compressed data
         ## RFC 1951 section 3.2.3 describes the algorithm and also
         ## an extra sanity check.
-        checkbytes = checkfile.read(1)
-        if len(checkbytes) != 1:
-                checkfile.close()
+        if offset + unpackedsize >= filesize:
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-        if (checkbytes[0] >> 1 & 1) == 1 and (checkbytes[0] >> 2 & 1) == 1:
-                checkfile.close()
+        if (filedata[offset+unpackedsize] >> 1 & 1) == 1 and (filedata[offset+unpackedsize] >> 2 & 1) == 1:
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'wrong DEFLATE header'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## go back one byte
-        checkfile.seek(-1,os.SEEK_CUR)
-
         ## what follows next is raw deflate blocks. To unpack raw deflate data the windowBits have to be
         ## set to negative values: http://www.zlib.net/manual.html#Advanced
         ## First create a zlib decompressor that can decompress raw deflate
@@ -531,72 +599,102 @@ def unpackGzip(filename, offset, unpackdir, temporarydirectory):
         else:
                 outfilename = os.path.join(unpackdir, "unpacked-from-gz")
 
-        ## open a file to write any unpacked data to
-        outfile = open(outfilename, 'wb')
+        ## The unpacked data is kept in memory and the output file is only
+        ## created when there is more data than fits in the buffer, so for
+        ## most files the CRC32 and ISIZE can be checked before anything is
+        ## written. Data that fits in the buffer is written with
+        ## bangstaging.writefile(), so small files can be kept in memory.
+        outfile = None
+        bufferedoutput = []
+        maxbufferedoutput = 4194304
 
-        ## store the CRC of the uncompressed data
+        ## store the CRC and the size of the uncompressed data
         gzipcrc32 = zlib.crc32(b'')
+        outputsize = 0
 
-        ## then continue
+        ## Then continue. The compressed data is fed to the decompressor
+        ## straight from the buffer in chunks of 10 MB, and at most 10 MB
+        ## of data is decompressed at a time.
         readsize = 10000000
-        checkbytes = bytearray(readsize)
-        while True:
-                checkfile.readinto(checkbytes)
+        readoffset = offset + unpackedsize
+        while not decompressor.eof:
+                if decompressor.unconsumed_tail != b'':
+                        checkbytes = decompressor.unconsumed_tail
+                else:
+                        checkbytes = filedata[readoffset:readoffset+readsize]
+                        readoffset += len(checkbytes)
                 try:
-                        unpackeddata = decompressor.decompress(checkbytes)
-                        outfile.write(unpackeddata)
-                        gzipcrc32 = zlib.crc32(unpackeddata, gzipcrc32)
+                        unpackeddata = decompressor.decompress(checkbytes, readsize)
                 except Exception as e:
                         ## clean up
-                        outfile.close()
-                        os.unlink(os.path.join(unpackdir, outfilename))
-                        checkfile.close()
+                        if outfile != None:
+                                outfile.close()
+                                os.unlink(outfilename)
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'File not a valid gzip file'}
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
-                unpackedsize += len(checkbytes) - len(decompressor.unused_data)
-                if decompressor.unused_data != b'':
+                ## the end of the file was reached before the end of
+                ## the compressed data and no more data is buffered
+                if len(checkbytes) == 0 and unpackeddata == b'':
                         break
-        outfile.close()
+                outputsize += len(unpackeddata)
+                gzipcrc32 = zlib.crc32(unpackeddata, gzipcrc32)
+                if outfile != None:
+                        outfile.write(unpackeddata)
+                        continue
+                bufferedoutput.append(unpackeddata)
+                if outputsize > maxbufferedoutput:
+                        outfile = open(outfilename, 'wb')
+                        outfile.write(b''.join(bufferedoutput))
+                        bufferedoutput = []
+
+        ## the CRC32 and ISIZE are checked before the buffered data is
+        ## written. Any data that was already written is removed if the
+        ## checks fail.
+        unpackedsize = readoffset - offset - len(decompressor.unused_data)
+        unpackingerror = {}
+        if not decompressor.eof:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
 
         ## A valid gzip file has CRC32 and ISIZE at the end, so there should always be
         ## at least 8 bytes left for a valid file.
-        if filesize - unpackedsize + offset < 8:
-                checkfile.close()
+        elif filesize - unpackedsize - offset < 8:
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'no CRC and ISIZE'}
-                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## first reset the file pointer until the end of the unpacked zlib data
-        checkfile.seek(offset + unpackedsize)
-
-        ## now compute the gzip CRC of the unocmpressed data and compare to
-        ## the CRC stored in the file (RFC 1952, section 2.3.1)
-        checkbytes = checkfile.read(4)
-        unpackedsize += 4
 
-        ## compute the ISIZE (RFC 1952, section 2.3.1)
-        checkbytes = checkfile.read(4)
-        checkfile.close()
+        ## now compare the CRC of the uncompressed data to the CRC
+        ## stored in the file (RFC 1952, section 2.3.1)
+        elif int.from_bytes(filedata[offset+unpackedsize:offset+unpackedsize+4], byteorder='little') != gzipcrc32:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'wrong CRC'}
 
-        unpackedsize += 4
+        ## compare the ISIZE (RFC 1952, section 2.3.1). This check is modulo 2^32
+        elif int.from_bytes(filedata[offset+unpackedsize+4:offset+unpackedsize+8], byteorder='little') != outputsize % pow(2,32):
+                unpackingerror = {'offset': offset+unpackedsize+8, 'fatal': False, 'reason': 'wrong value for ISIZE'}
 
-        ## this check is modulo 2^32
-        isize = os.stat(outfilename).st_size % pow(2,32)
-        if int.from_bytes(checkbytes, byteorder='little') != isize:
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'wrong value for ISIZE'}
+        if unpackingerror != {}:
+                if outfile != None:
+                        outfile.close()
+                        os.unlink(outfilename)
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        unpackedsize += 8
 
-        ## now rename the file in case the file name was known
+        ## use the name of the file in case the file name was known, but
+        ## only if it is a name of a file in the unpacking directory.
+        newoutfilename = outfilename
         if havefname:
-                if len(origname) != 0:
+                try:
                         origname = origname.decode()
-                        ## in this case report the original name as well in a
-                        ## different data structure
-                        try:
-                                shutil.move(outfilename, os.path.join(unpackdir, origname))
-                                outfilename = os.path.join(unpackdir, origname)
-                        except:
-                                pass
+                except UnicodeDecodeError:
+                        origname = ''
+                if not origname in ['', '.', '..'] and not os.sep in origname:
+                        newoutfilename = os.path.join(unpackdir, origname)
+
+        if outfile == None:
+                bangstaging.writefile(newoutfilename, b''.join(bufferedoutput))
+        else:
+                outfile.close()
+                if newoutfilename != outfilename:
+                        shutil.move(outfilename, newoutfilename)
+        outfilename = newoutfilename
 
         ## add the unpacked file to the result list
         unpackedfilesandlabels.append((outfilename, []))
@@ -608,8 +706,8 @@ def unpackGzip(filename, offset, unpackdir, temporarydirectory):
         return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
 ## https://en.wikipedia.org/wiki/BMP_file_format
-def unpackBMP(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+def unpackBMP(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
@@ -621,69 +719,149 @@ def unpackBMP(filename, offset, unpackdir, temporarydirectory):
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'File too small (less than 26 bytes'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackBMP, filename, filename, offset, unpackdir, temporarydirectory)
+
         unpackedsize = 0
-        checkfile = open(filename, 'rb')
         ## skip over the magic
-        checkfile.seek(offset+2)
         unpackedsize += 2
 
         ## then extract the declared size of the BMP
-        checkbytes = checkfile.read(4)
-        bmpsize = int.from_bytes(checkbytes, byteorder='little')
+        bmpsize = int.from_bytes(filedata[offset+2:offset+6], byteorder='little')
         if offset + bmpsize > filesize:
-                checkfile.close()
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'not enough data for BMP file'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## skip over 4 bytes of reserved data and read the offset of the BMP data
-        checkfile.seek(4,os.SEEK_CUR)
         unpackedsize += 4
-        checkbytes = checkfile.read(4)
-        bmpoffset = int.from_bytes(checkbytes, byteorder='little')
+        bmpoffset = int.from_bytes(filedata[offset+10:offset+14], byteorder='little')
         unpackedsize += 4
         ## the BMP cannot be outside the file
         if offset + bmpoffset > filesize:
-                checkfile.close()
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'not enough data for BMP'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## read the first two bytes of the DIB header (DIB header size) as an extra sanity check.
         ## There are actually just a few supported values:
         ## https://en.wikipedia.org/wiki/BMP_file_format#DIB_header_(bitmap_information_header)
-        checkbytes = checkfile.read(2)
-        dibheadersize = int.from_bytes(checkbytes, byteorder='little')
+        dibheadersize = int.from_bytes(filedata[offset+14:offset+16], byteorder='little')
         if not dibheadersize in set([12, 64, 16, 40, 52, 56, 108, 124]):
-                checkfile.close()
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'invalid DIB header'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## check if the header size is inside the file
         if offset + 14 + dibheadersize > filesize:
-                checkfile.close()
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'not enough data for DIB header'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## the BMP data offset is from the start of the BMP file. It cannot be inside
         ## the BMP header (14 bytes) or the DIB header (variable).
         if bmpoffset < dibheadersize + 14:
-                checkfile.close()
+                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'invalid BMP data offset'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## the pixel data cannot be outside of the BMP file
+        if bmpoffset >= bmpsize:
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'invalid BMP data offset'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 2
 
-        if shutil.which('bmptopnm') == None:
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'bmptopnm program not found'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        ## Then parse the rest of the DIB header. The pixel data is not
+        ## decoded, but the sizes in the header have to be consistent:
+        ## the color table and the pixel data have to fit in the file.
+        ## https://docs.microsoft.com/en-us/windows/desktop/gdi/bitmap-header-types
+        dibheader = bytes(filedata[offset+14:offset+14+dibheadersize])
+        compression = 0
+        imagesize = 0
+        colorsused = 0
+        if dibheadersize == 12:
+                ## BITMAPCOREHEADER (OS/2 1.x): unsigned 16 bit dimensions
+                ## and a color table with 3 byte entries
+                (width, height, planes, bitsperpixel) = struct.unpack('<HHHH', dibheader[4:12])
+                colortableentrysize = 3
+                validbitsperpixel = set([1, 4, 8, 24])
+        else:
+                ## BITMAPINFOHEADER and its successors, as well as the OS/2 2.x
+                ## header, which can be truncated after the bits per pixel.
+                (width, height, planes, bitsperpixel) = struct.unpack('<iiHH', dibheader[4:16])
+                if dibheadersize >= 40:
+                        (compression, imagesize) = struct.unpack('<II', dibheader[16:24])
+                        colorsused = int.from_bytes(dibheader[32:36], byteorder='little')
+                colortableentrysize = 4
+                validbitsperpixel = set([1, 2, 4, 8, 16, 24, 32])
+
+        if planes != 1:
+                unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'invalid amount of color planes'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## then reset the file pointer, read all the data and feed it
-        ## to bmptopnm for validation.
-        checkfile.seek(offset)
-        checkbytes = checkfile.read(bmpsize)
-        checkfile.close()
-        p = subprocess.Popen(['bmptopnm'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (outputmsg, errormsg) = p.communicate(checkbytes)
-        if p.returncode != 0:
-                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'invalid BMP'}
+        ## a negative height means that the rows are stored top down
+        topdown = height < 0
+        height = abs(height)
+        if width <= 0 or height == 0:
+                unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'invalid BMP dimensions'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## JPEG and PNG compressed data do not have a fixed amount
+        ## of bits per pixel (it is 0).
+        if compression in [4, 5]:
+                validbitsperpixel = set([0])
+        if not bitsperpixel in validbitsperpixel:
+                unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'invalid bits per pixel'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## Only some combinations of compression and bits per pixel are
+        ## valid. Run length encoded data cannot be stored top down.
+        ## 0: BI_RGB, 1: BI_RLE8, 2: BI_RLE4, 3: BI_BITFIELDS, 4: BI_JPEG,
+        ## 5: BI_PNG, 6: BI_ALPHABITFIELDS
+        if compression == 0:
+                pass
+        elif compression == 1 and bitsperpixel == 8 and not topdown:
+                pass
+        elif compression == 2 and bitsperpixel == 4 and not topdown:
+                pass
+        elif compression in [3, 6] and bitsperpixel in [16, 32]:
+                pass
+        elif compression in [4, 5]:
+                pass
+        else:
+                unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'invalid BMP compression'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## With a BITMAPINFOHEADER the bit masks for BI_BITFIELDS and
+        ## BI_ALPHABITFIELDS are stored after the header. Later versions
+        ## of the header include the masks.
+        colortableoffset = 14 + dibheadersize
+        if dibheadersize == 40:
+                if compression == 3:
+                        colortableoffset += 12
+                elif compression == 6:
+                        colortableoffset += 16
+
+        ## The color table is mandatory for images with 8 or less bits per
+        ## pixel. If the amount of colors is not set all colors are used.
+        if bitsperpixel != 0 and bitsperpixel <= 8:
+                if colorsused == 0:
+                        colorsused = 1 << bitsperpixel
+                elif colorsused > 1 << bitsperpixel:
+                        unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'invalid amount of colors'}
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        if colortableoffset + colorsused * colortableentrysize > bmpoffset:
+                unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'color table outside of header'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## Finally check if the pixel data fits in the file. For uncompressed
+        ## data the size can be computed: every row is padded to a multiple of
+        ## 4 bytes. For compressed data the size is stored in the header.
+        if compression in [0, 3, 6]:
+                pixeldatasize = ((bitsperpixel * width + 31) // 32) * 4 * height
+        else:
+                pixeldatasize = imagesize
+                if pixeldatasize == 0:
+                        unpackingerror = {'offset': offset+14, 'fatal': False, 'reason': 'no image size for compressed BMP'}
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        if bmpoffset + pixeldatasize > bmpsize:
+                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'not enough data for BMP pixel data'}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## check if the file was the whole file
@@ -692,17 +870,15 @@ def unpackBMP(filename, offset, unpackdir, temporarydirectory):
                 labels.append('graphics')
                 return (True, filesize, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## carve the file. The data has already been read.
+        ## carve the file
         outfilename = os.path.join(unpackdir, "unpacked.bmp")
-        outfile = open(outfilename, 'wb')
-        outfile.write(checkbytes)
-        outfile.close()
+        carvefile(filename, filedata, offset, bmpsize, outfilename)
         unpackedfilesandlabels.append((outfilename, ['bmp', 'graphics', 'unpacked']))
         return (True, bmpsize, unpackedfilesandlabels, labels, unpackingerror)
 
 ## wrapper for LZMA, with a few extra sanity checks based on LZMA format specifications.
-def unpackLZMA(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+def unpackLZMA(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         if filesize - offset < 13:
@@ -713,10 +889,13 @@ def unpackLZMA(filename, offset, unpackdir, temporarydirectory):
         ## The file lzma-file-format.txt in XZ file distributions describe the
         ## LZMA format. The first 13 bytes describe the header. The last
         ## 8 bytes of the header describe the file size.
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset+5)
-        checkbytes = checkfile.read(8)
-        checkfile.close()
+        if filedata == None:
+                checkfile = open(filename, 'rb')
+                checkfile.seek(offset+5)
+                checkbytes = checkfile.read(8)
+                checkfile.close()
+        else:
+                checkbytes = filedata[offset+5:offset+13]
 
         ## first check if an actual length of the *uncompressed* data is stored, or
         ## if it is possibly stored as a stream. LZMA streams have 0xffffffff stored
@@ -735,33 +914,64 @@ def unpackLZMA(filename, offset, unpackdir, temporarydirectory):
         else:
                 lzmaunpackedsize = -1
 
-        return unpackLZMAWrapper(filename, offset, unpackdir, '.lzma', 'lzma', 'LZMA', lzmaunpackedsize)
+        return unpackLZMAWrapper(filename, offset, unpackdir, '.lzma', 'lzma', 'LZMA', lzmaunpackedsize, filedata=filedata)
 
 ## wrapper for both LZMA and XZ
 ## Uses standard Python code.
-def unpackLZMAWrapper(filename, offset, unpackdir, extension, filetype, ppfiletype, lzmaunpackedsize):
-        filesize = os.stat(filename).st_size
+##
+## As there are many false positives for LZMA the data is checked in stages.
+## First a small probe of the data is decompressed completely, with a bound
+## on the size of the output, so any error in the probe is found. Only if
+## that succeeds the rest of the data is decompressed, in chunks, and the
+## output file is created. If a size of the uncompressed data was declared
+## in the header decompressing stops as soon as more data than declared has
+## been decompressed.
+def unpackLZMAWrapper(filename, offset, unpackdir, extension, filetype, ppfiletype, lzmaunpackedsize, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
 
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackLZMAWrapper, filename, filename, offset, unpackdir, extension, filetype, ppfiletype, lzmaunpackedsize)
+
         unpackedsize = 0
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset)
 
-        ## Extract one 900k block of data as an extra sanity check.
-        ## First create a decompressor
+        ## First create a decompressor and decompress a small probe
+        ## of the data as a sanity check.
         decompressor = lzma.LZMADecompressor()
-        checkdata = checkfile.read(900000)
-
-        ## then try to decompress the data.
+        probesize = 65536
+        maxprobeoutput = 1048576
+        checkdata = filedata[offset:offset+probesize]
+        readoffset = offset + len(checkdata)
+
+        ## then try to decompress the data, until all of the probe is
+        ## used, the stream ends or there is enough output.
+        probedata = []
+        probeoutputsize = 0
         try:
-                unpackeddata = decompressor.decompress(checkdata)
+                while True:
+                        probeoutput = decompressor.decompress(checkdata, max_length=maxprobeoutput)
+                        checkdata = b''
+                        probedata.append(probeoutput)
+                        probeoutputsize += len(probeoutput)
+                        if decompressor.eof or decompressor.needs_input or probeoutputsize >= maxprobeoutput:
+                                break
         except Exception:
-                ## no data could be successfully unpacked, so close the file and exit.
-                checkfile.close()
+                ## no data could be successfully unpacked, so exit.
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not valid %s data' % ppfiletype}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        unpackeddata = b''.join(probedata)
+
+        ## the data is bogus if the stream ended without any output
+        if unpackeddata == b'' and decompressor.eof:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'File not a valid %s file' % ppfiletype}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        if filetype == 'lzma' and lzmaunpackedsize != -1 and len(unpackeddata) > lzmaunpackedsize:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'length of unpacked %s data does not correspond with header' % ppfiletype}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
         ## set the name of the file in case it is "anonymous data"
         ## otherwise just imitate whatever unxz and lzma do. If the file has a
@@ -777,74 +987,105 @@ def unpackLZMAWrapper(filename, offset, unpackdir, extension, filetype, ppfilety
                 else:
                         outfilename = os.path.join(unpackdir, "unpacked-from-%s" % filetype)
 
-        ## data has been unpacked, so open a file and write the data to it.
-        ## unpacked, or if all data has been unpacked
-        outfile = open(outfilename, 'wb')
-        outfile.write(unpackeddata)
-        unpackedsize += len(checkdata) - len(decompressor.unused_data)
+        ## The output file is only opened when there is more data than can
+        ## be kept in memory (see bangstaging), as most false positives fail
+        ## before that. Smaller output is written with bangstaging.writefile().
+        outfile = None
+        outputsize = 0
+        bufferedoutput = []
 
         ## there is still some data left to be unpacked, so
         ## continue unpacking, as described in the Python documentation:
         ## https://docs.python.org/3/library/bz2.html#incremental-de-compression
         ## https://docs.python.org/3/library/lzma.html
-        ## read some more data in chunks of 10 MB
+        ## feed the data in chunks of 10 MB and write at most
+        ## 10 MB of output at a time.
         datareadsize = 10000000
-        checkdata = checkfile.read(datareadsize)
-        while checkdata != b'':
-                try:
-                        unpackeddata = decompressor.decompress(checkdata)
-                except EOFError as e:
+        while True:
+                if unpackeddata != b'':
+                        outputsize += len(unpackeddata)
+                        if outfile != None:
+                                outfile.write(unpackeddata)
+                        else:
+                                bufferedoutput.append(unpackeddata)
+                                if outputsize > bangstaging.stagingmaxsize:
+                                        outfile = open(outfilename, 'wb')
+                                        outfile.write(b''.join(bufferedoutput))
+                                        bufferedoutput = []
+
+                        ## stop as soon as there is more data than declared
+                        if filetype == 'lzma' and lzmaunpackedsize != -1 and outputsize > lzmaunpackedsize:
+                                if outfile != None:
+                                        outfile.close()
+                                        os.unlink(outfilename)
+                                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'length of unpacked %s data does not correspond with header' % ppfiletype}
+                                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+                ## there is no more compressed data
+                if decompressor.eof:
                         break
+
+                ## only feed more data if the decompressor needs it,
+                ## otherwise first get the output that is still buffered.
+                if decompressor.needs_input:
+                        if readoffset >= filesize:
+                                break
+                        checkdata = filedata[readoffset:readoffset+datareadsize]
+                        readoffset += len(checkdata)
+                else:
+                        checkdata = b''
+                try:
+                        unpackeddata = decompressor.decompress(checkdata, max_length=datareadsize)
                 except Exception as e:
                         ## clean up
-                        outfile.close()
-                        os.unlink(outfilename)
-                        checkfile.close()
+                        if outfile != None:
+                                outfile.close()
+                                os.unlink(outfilename)
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'File not a valid %s file' % ppfiletype}
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
-                outfile.write(unpackeddata)
-                ## there is no more compressed data
-                unpackedsize += len(checkdata) - len(decompressor.unused_data)
-                if decompressor.unused_data != b'':
-                        break
-                checkdata = checkfile.read(datareadsize)
-        outfile.close()
-        checkfile.close()
+
+        unpackedsize = readoffset - offset - len(decompressor.unused_data)
 
         ## ignore empty files, as it is bogus data
-        if os.stat(outfilename).st_size == 0:
-                os.unlink(outfilename)
+        if outputsize == 0:
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'File not a valid %s file' % ppfiletype}
                 return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+        if outfile != None:
+                outfile.close()
 
         ## check if the length of the unpacked LZMA data is correct, but
         ## only if any unpacked length has been defined.
         if filetype == 'lzma' and lzmaunpackedsize != -1:
-                if lzmaunpackedsize != os.stat(outfilename).st_size:
-                        os.unlink(outfilename)
+                if lzmaunpackedsize != outputsize:
+                        if outfile != None:
+                                os.unlink(outfilename)
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'length of unpacked %s data does not correspond with header' % ppfiletype}
                         return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
 
-        min_lzma = 256
-
-        ## LZMA sometimes has bogus files filled with 0x00
-        if os.stat(outfilename).st_size < min_lzma:
-                pass
-
-        if offset == 0 and unpackedsize == os.stat(filename).st_size:
-                ## in case the file name ends in extension rename the file
-                ## to mimic the behaviour of "unxz" and similar
+        ## in case the file name ends in extension rename the file
+        ## to mimic the behaviour of "unxz" and similar
+        newoutfilename = outfilename
+        if offset == 0 and unpackedsize == filesize:
                 if filename.lower().endswith(extension):
                         newoutfilename = os.path.join(unpackdir, os.path.basename(filename)[:-len(extension)])
-                        shutil.move(outfilename, newoutfilename)
-                        outfilename = newoutfilename
                 labels += [filetype, 'compressed']
+
+        if outfile == None:
+                bangstaging.writefile(newoutfilename, b''.join(bufferedoutput))
+        elif newoutfilename != outfilename:
+                shutil.move(outfilename, newoutfilename)
+        outfilename = newoutfilename
         unpackedfilesandlabels.append((outfilename, []))
         return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
 ## XZ unpacking works just like LZMA unpacking
-def unpackXZ(filename, offset, unpackdir, temporarydirectory):
-        return unpackLZMAWrapper(filename, offset, unpackdir, '.xz', 'xz', 'XZ', -1)
+def unpackXZ(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        return unpackLZMAWrapper(filename, offset, unpackdir, '.xz', 'xz', 'XZ', -1, filedata=filedata)
+
+## a table for bytes.translate() that translates the characters that are
+## valid in the POSIX TZ string of a timezone file (printable characters
+## that are not whitespace) to 0x01 and any other character to 0x00
+tzstringtable = bytes([chr(i) in string.printable and not chr(i) in string.whitespace for i in range(256)])
 
 ## timezone files
 ## Format is documented in the Linux man pages:
@@ -857,8 +1098,8 @@ def unpackXZ(filename, offset, unpackdir, temporarydirectory):
 ##
 ## in case the distribution man page does not cover version
 ## 3 of the timezone file format.
-def unpackTimeZone(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+def unpackTimeZone(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
@@ -868,13 +1109,15 @@ def unpackTimeZone(filename, offset, unpackdir, temporarydirectory):
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough bytes'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## open the file and skip the offset
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset+4)
+        ## parse the data directly from memory
+        if filedata == None:
+                return mapandunpack(unpackTimeZone, filename, filename, offset, unpackdir, temporarydirectory)
+
+        ## skip the magic
         unpackedsize += 4
 
         ## read the version
-        checkbytes = checkfile.read(1)
+        checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+1]
         if checkbytes == b'\x00':
                 version = 0
         elif checkbytes == b'\x32':
@@ -882,349 +1125,91 @@ def unpackTimeZone(filename, offset, unpackdir, temporarydirectory):
         elif checkbytes == b'\x33':
                 version = 3
         else:
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid version'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 1
 
         ## then 15 NUL bytes
-        checkbytes = checkfile.read(15)
+        checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+15]
         if checkbytes != b'\x00' * 15:
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'reserved bytes not 0'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 15
 
-        ## then the number of UT/local indicators in "standard byte order" (big endian)
-        checkbytes = checkfile.read(4)
-        ut_indicators = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
+        ## then the counts of the different types of data, in "standard
+        ## byte order" (big endian), and then the data itself. Each section
+        ## of the data is checked at once.
+        (position, timezoneerror) = parsetimezonedata(filedata, offset+unpackedsize, 4, 4)
+        unpackedsize = position - offset
+        if timezoneerror != None:
+                (errorposition, reason) = timezoneerror
+                unpackingerror = {'offset': errorposition, 'fatal': False, 'reason': reason}
+                return (False, errorposition - offset, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## then the number of standard/wall indicators
-        checkbytes = checkfile.read(4)
-        standard_indicators = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
+        ## This is the end for version 0 timezone files
+        if version == 0:
+                if offset == 0 and unpackedsize == filesize:
+                        labels.append('resource')
+                        labels.append('timezone')
+                        return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+                ## else carve the file
+                outfilename = os.path.join(unpackdir, "unpacked-from-timezone")
+                carvefile(filename, filedata, offset, unpackedsize, outfilename)
+                unpackedfilesandlabels.append((outfilename, ['timezone', 'resource', 'unpacked']))
+                return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## the number of leap seconds for which data entries are stored
-        checkbytes = checkfile.read(4)
-        leap_cnt = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
+        ## Then continue with version 2 data. The header is identical to the
+        ## version 1 header.
+        if offset + unpackedsize + 44 > filesize:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for version 2 timezone header'}
+                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## the number of transition times for which data entries are stored
-        checkbytes = checkfile.read(4)
-        transition_times = int.from_bytes(checkbytes, byteorder='big')
+        ## first check the header
+        checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+4]
+        if checkbytes != b'TZif':
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid magic for version 2 header'}
+                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 4
 
-        ## the number of local time types (must not be zero)
-        checkbytes = checkfile.read(4)
-        local_times = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-        if local_times == 0:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'local of times set to not-permitted 0'}
+        ## read the version
+        checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+1]
+        if checkbytes == b'\x32':
+                newversion = 2
+        elif checkbytes == b'\x33':
+                newversion = 3
+        else:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid version'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-        ## the number of bytes of timezone abbreviation strings
-        checkbytes = checkfile.read(4)
-        tz_abbrevation_bytes = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-
-        for i in range(0, transition_times):
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for transition time'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 4
-
-        ## then a number of bytes, each serving as an index into
-        ## the next field.
-        for i in range(0, transition_times):
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for transition time'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-                if ord(checkbytes) > local_times:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid index for transition time'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## now read a bunch of ttinfo entries
-        for i in range(0, local_times):
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for ttinfo GMT offsets'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 4
-
-                ## then the DST flag byte
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for ttinfo DST info'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if not (ord(checkbytes) == 0 or ord(checkbytes) == 1):
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid value for ttinfo DST info'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-                ## then the abbreviation index, which points into the
-                ## abbrevation strings, so cannot be larger than than tz_abbrevation_bytes
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for ttinfo abbreviation index'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if ord(checkbytes) > tz_abbrevation_bytes:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid value for ttinfo abbreviation index'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-        ## then the abbrevation strings, as indicated by tz_abbrevation_bytes
-        checkbytes = checkfile.read(tz_abbrevation_bytes)
-        if len(checkbytes) != tz_abbrevation_bytes:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for abbreviation bytes'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-        unpackedsize += tz_abbrevation_bytes
-
-        ## then 2 pairs of 4 bytes for each of the leap second entries
-        for i in range(0, leap_cnt):
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for leap seconds'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 4
-
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for leap seconds'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 4
-
-        ## then one byte for each of the standard/wall indicators
-        for i in range(0, standard_indicators):
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for standard indicator'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-        ## then one byte for each of the UT/local indicators
-        for i in range(0, ut_indicators):
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for UT indicator'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-        ## This is the end for version 0 timezone files
-        if version == 0:
-                if offset == 0 and unpackedsize == filesize:
-                        checkfile.close()
-                        labels.append('resource')
-                        labels.append('timezone')
-                        return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                ## else carve the file
-                outfilename = os.path.join(unpackdir, "unpacked-from-timezone")
-                outfile = open(outfilename, 'wb')
-                os.sendfile(outfile.fileno(), checkfile.fileno(), offset, unpackedsize)
-                outfile.close()
-                unpackedfilesandlabels.append((outfilename, ['timezone', 'resource', 'unpacked']))
-                checkfile.close()
-                return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## Then continue with version 2 data. The header is identical to the
-        ## version 1 header.
-        if offset + unpackedsize + 44 > filesize:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for version 2 timezone header'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## first check the header
-        checkbytes = checkfile.read(4)
-        if checkbytes != b'TZif':
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid magic for version 2 header'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-        unpackedsize += 4
-
-        ## read the version
-        checkbytes = checkfile.read(1)
-        if checkbytes == b'\x32':
-                newversion = 2
-        elif checkbytes == b'\x33':
-                newversion = 3
-        else:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid version'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## The version has to be identical to the previously declard version
-        if version != newversion:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'versions in headers don\'t match'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-        unpackedsize += 1
+        ## The version has to be identical to the previously declard version
+        if version != newversion:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'versions in headers don\'t match'}
+                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        unpackedsize += 1
 
         ## then 15 NUL bytes
-        checkbytes = checkfile.read(15)
+        checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+15]
         if checkbytes != b'\x00' * 15:
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'reserved bytes not 0'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 15
 
-        ## then the number of UT/local indicators in "standard byte order" (big endian)
-        checkbytes = checkfile.read(4)
-        ut_indicators = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-
-        ## then the number of standard/wall indicators
-        checkbytes = checkfile.read(4)
-        standard_indicators = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-
-        ## the number of leap seconds for which data entries are stored
-        checkbytes = checkfile.read(4)
-        leap_cnt = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-
-        ## the number of transition times for which data entries are stored
-        checkbytes = checkfile.read(4)
-        transition_times = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-
-        ## the number of local time types (must not be zero)
-        checkbytes = checkfile.read(4)
-        local_times = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-        if local_times == 0:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'local of times set to not-permitted 0'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## the number of bytes of timezone abbreviation strings
-        checkbytes = checkfile.read(4)
-        tz_abbrevation_bytes = int.from_bytes(checkbytes, byteorder='big')
-        unpackedsize += 4
-
-        for i in range(0, transition_times):
-                checkbytes = checkfile.read(8)
-                if len(checkbytes) != 8:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for transition time'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 8
-
-        ## then a number of bytes, each serving as an index into
-        ## the next field.
-        for i in range(0, transition_times):
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for transition time'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-                if ord(checkbytes) > local_times:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid index for transition time'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## now read a bunch of ttinfo entries
-        for i in range(0, local_times):
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for ttinfo GMT offsets'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 4
-
-                ## then the DST flag byte
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for ttinfo DST info'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if not (ord(checkbytes) == 0 or ord(checkbytes) == 1):
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid value for ttinfo DST info'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-                ## then the abbreviation index, which points into the
-                ## abbrevation strings, so cannot be larger than tz_abbrevation_bytes
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for ttinfo abbreviation index'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if ord(checkbytes) > tz_abbrevation_bytes:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid value for ttinfo abbreviation index'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-        ## then the abbrevation strings, as indicated by tz_abbrevation_bytes
-        checkbytes = checkfile.read(tz_abbrevation_bytes)
-        if len(checkbytes) != tz_abbrevation_bytes:
-                checkfile.close()
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for abbreviation bytes'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-        unpackedsize += tz_abbrevation_bytes
-
-        ## then 2 pairs of 4 bytes for each of the leap second entries
-        for i in range(0, leap_cnt):
-                checkbytes = checkfile.read(8)
-                if len(checkbytes) != 8:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for leap seconds'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 8
-
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for leap seconds'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 4
-
-        ## then one byte for each of the standard/wall indicators
-        for i in range(0, standard_indicators):
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for standard indicator'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-
-        ## then one byte for each of the UT/local indicators
-        for i in range(0, ut_indicators):
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for UT indicator'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
+        ## then the counts and the data, with 64 bit transition times
+        ## and leap second times.
+        (position, timezoneerror) = parsetimezonedata(filedata, offset+unpackedsize, 8, 8)
+        unpackedsize = position - offset
+        if timezoneerror != None:
+                (errorposition, reason) = timezoneerror
+                unpackingerror = {'offset': errorposition, 'fatal': False, 'reason': reason}
+                return (False, errorposition - offset, unpackedfilesandlabels, labels, unpackingerror)
 
         ## next comes a POSIX-TZ-environment-variable-style string (possibly empty)
         ## enclosed between newlines
-        checkbytes = checkfile.read(1)
+        checkbytes = filedata[offset+unpackedsize:offset+unpackedsize+1]
         if len(checkbytes) != 1:
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for POSIX TZ environment style string'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
         if checkbytes != b'\n':
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'wrong value for POSIX TZ environment style string'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
         unpackedsize += 1
@@ -1238,59 +1223,176 @@ def unpackTimeZone(filename, offset, unpackdir, temporarydirectory):
         ## and less punctuation)
         ## The version 3 extensions are simply a change to this string
         ## so it is already covered.
+        ##
+        ## The data is searched for the newline in chunks (like findnul()
+        ## does), and the characters before the newline in a chunk are
+        ## checked at once, by translating every valid character to 0x01
+        ## and every invalid character to 0x00.
+        searchsize = 64
         while True:
-                checkbytes = checkfile.read(1)
-                if len(checkbytes) != 1:
-                        checkfile.close()
+                position = offset + unpackedsize
+                checkbytes = bytes(filedata[position:position+searchsize])
+                if checkbytes == b'':
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'enclosing newline for POSIX TZ environment style string not found'}
                         return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                unpackedsize += 1
-                if checkbytes == b'\n':
-                        break
-                if not chr(ord(checkbytes)) in string.printable or chr(ord(checkbytes)) in string.whitespace:
-                        checkfile.close()
+                newlineindex = checkbytes.find(b'\n')
+                if newlineindex != -1:
+                        checkbytes = checkbytes[:newlineindex]
+                invalidindex = checkbytes.translate(tzstringtable).find(b'\x00')
+                if invalidindex != -1:
+                        unpackedsize += invalidindex + 1
                         unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid character in POSIX TZ environment style string'}
                         return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+                if newlineindex != -1:
+                        unpackedsize += newlineindex + 1
+                        break
+                unpackedsize += len(checkbytes)
+                searchsize = min(searchsize * 2, 1048576)
 
         if offset == 0 and unpackedsize == filesize:
-                checkfile.close()
                 labels.append('resource')
                 labels.append('timezone')
                 return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
         ## else carve the file
         outfilename = os.path.join(unpackdir, "unpacked-from-timezone")
-        outfile = open(outfilename, 'wb')
-        os.sendfile(outfile.fileno(), checkfile.fileno(), offset, unpackedsize)
-        outfile.close()
+        carvefile(filename, filedata, offset, unpackedsize, outfilename)
         unpackedfilesandlabels.append((outfilename, ['timezone', 'resource', 'unpacked']))
-        checkfile.close()
         return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-## unpacker for tar files. Uses the standard Python library.
-## https://docs.python.org/3/library/tarfile.html
-def unpackTar(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+## Parse and check the counts and the data of a timezone file (version 1
+## data, or the version 2+ data following it), starting right after the
+## reserved bytes of the header. Each section is read and checked at once,
+## instead of element by element. This method has the following parameters:
+##
+## * filedata :: buffer with the data of the file
+## * position :: offset of the counts in the buffer
+## * timesize :: size of a transition time (4 for version 1, 8 for version 2+)
+## * leaptimesize :: size of the time of a leap second entry (idem)
+##
+## Returns a tuple with the offset right after the data and None, or, if the
+## data is not valid, a tuple with the offset where parsing stopped and a
+## tuple (offset of the error, reason).
+def parsetimezonedata(filedata, position, timesize, leaptimesize):
+        filesize = len(filedata)
+
+        ## the number of UT/local indicators, standard/wall indicators,
+        ## leap seconds, transition times, local time types and bytes
+        ## of timezone abbreviation strings
+        (ut_indicators, standard_indicators, leap_cnt, transition_times, local_times, tz_abbrevation_bytes) = struct.unpack('>6I', filedata[position:position+24])
+        position += 24
+
+        ## the number of local time types must not be zero
+        if local_times == 0:
+                return (position - 4, (position - 4, 'local of times set to not-permitted 0'))
+
+        ## the transition times themselves are not checked
+        if filesize - position < transition_times * timesize:
+                errorposition = position + (filesize - position) // timesize * timesize
+                return (errorposition, (errorposition, 'not enough data for transition time'))
+        position += transition_times * timesize
+
+        ## then a number of bytes, each serving as an index into
+        ## the next field.
+        checkbytes = bytes(filedata[position:position+transition_times])
+        if len(checkbytes) != 0 and max(checkbytes) > local_times:
+                for i in range(0, len(checkbytes)):
+                        if checkbytes[i] > local_times:
+                                return (position + i + 1, (position + i + 1, 'invalid index for transition time'))
+        if len(checkbytes) != transition_times:
+                errorposition = position + len(checkbytes)
+                return (errorposition, (errorposition, 'not enough data for transition time'))
+        position += transition_times
+
+        ## now check the ttinfo entries: 4 bytes with the GMT offset, a byte
+        ## with the DST flag (0 or 1) and a byte with an index into the
+        ## abbreviation strings, which cannot be larger than tz_abbrevation_bytes
+        checkbytes = bytes(filedata[position:position+local_times*6])
+        completeentries = len(checkbytes) // 6
+        dstflags = checkbytes[4:completeentries*6:6]
+        abbreviationindexes = checkbytes[5:completeentries*6:6]
+        if dstflags.translate(None, b'\x00\x01') != b'' or (completeentries != 0 and max(abbreviationindexes) > tz_abbrevation_bytes):
+                for i in range(0, completeentries):
+                        if dstflags[i] > 1:
+                                return (position + i*6 + 4, (position + i*6 + 4, 'invalid value for ttinfo DST info'))
+                        if abbreviationindexes[i] > tz_abbrevation_bytes:
+                                return (position + i*6 + 5, (position + i*6 + 5, 'invalid value for ttinfo abbreviation index'))
+        if completeentries != local_times:
+                ## the last entry is incomplete
+                errorposition = position + completeentries * 6
+                remainder = len(checkbytes) - completeentries * 6
+                if remainder < 4:
+                        return (errorposition, (errorposition, 'not enough data for ttinfo GMT offsets'))
+                if remainder == 4:
+                        return (errorposition + 4, (errorposition + 4, 'not enough data for ttinfo DST info'))
+                if checkbytes[-1] > 1:
+                        return (errorposition + 4, (errorposition + 4, 'invalid value for ttinfo DST info'))
+                return (errorposition + 5, (errorposition + 5, 'not enough data for ttinfo abbreviation index'))
+        position += local_times * 6
+
+        ## then the abbrevation strings, as indicated by tz_abbrevation_bytes
+        if filesize - position < tz_abbrevation_bytes:
+                return (position, (position, 'not enough data for abbreviation bytes'))
+        position += tz_abbrevation_bytes
+
+        ## then the leap second entries: the time of the leap second
+        ## and 4 bytes with the total correction
+        leapentrysize = leaptimesize + 4
+        if filesize - position < leap_cnt * leapentrysize:
+                errorposition = position + (filesize - position) // leapentrysize * leapentrysize
+                if filesize - errorposition >= leaptimesize:
+                        errorposition += leaptimesize
+                return (errorposition, (errorposition, 'not enough data for leap seconds'))
+        position += leap_cnt * leapentrysize
+
+        ## then one byte for each of the standard/wall indicators
+        if filesize - position < standard_indicators:
+                return (filesize, (filesize, 'not enough data for standard indicator'))
+        position += standard_indicators
+
+        ## then one byte for each of the UT/local indicators
+        if filesize - position < ut_indicators:
+                return (filesize, (filesize, 'not enough data for UT indicator'))
+        position += ut_indicators
+        return (position, None)
+
+## unpacker for tar files. The headers are parsed directly from memory and
+## the data of regular files is copied with os.sendfile() (or kept in memory
+## if it is small, see carvefile()), so no tarfile objects are created.
+##
+## Every header is 512 bytes and has to have a valid checksum and the magic
+## of the POSIX (ustar) or GNU tar format. GNU long names and long link names
+## and pax extended headers are supported. Sparse files and multi-volume
+## archives are not, and neither are old V7 tar files (which do not have
+## a magic).
+##
+## https://www.gnu.org/software/tar/manual/html_node/Standard.html
+## http://pubs.opengroup.org/onlinepubs/9699919799/utilities/pax.html
+def unpackTar(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
         unpackedsize = 0
 
-        ## tar is a concatenation of files. It could be that a tar file has been cut
-        ## halfway but it might still be possible to extract some data.
-        ## Use a file object so it is possible to start tar unpacking at arbitrary
-        ## positions in the file.
+        if filesize - offset < 512:
+                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'not enough data'}
+                return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## parse the headers directly from memory
+        if filedata == None:
+                return mapandunpack(unpackTar, filename, filename, offset, unpackdir, temporarydirectory)
+
+        ## the data of the files is copied from the file on disk
         checkfile = open(filename, 'rb')
 
-        ## seek to the offset where the tar is supposed to start. According to
-        ## the documentation it should be opened at offset 0, but this works
-        ## too.
-        checkfile.seek(offset)
-        unpacktar = tarfile.open(fileobj=checkfile, mode='r')
+        ## file names are checked against the real path of the unpacking
+        ## directory, so symbolic links in the tar file cannot be used to
+        ## write outside of the unpacking directory.
+        realunpackdir = os.path.realpath(unpackdir)
 
-        ## record if something was unpacked and if something went wrong
+        ## record if something was unpacked
         tarunpacked = False
-        tarerror = False
 
         ## keep track of which file names were already
         ## unpacked. Files with the same name can be stored in a tar file
@@ -1302,65 +1404,182 @@ def unpackTar(filename, offset, unpackdir, temporarydirectory):
         ## $ tar --append -f test.tar /path/to/file
         unpackedtarfilenames = set()
 
-        while True:
-                ## store the name of the file unpacked. This is needed to clean
-                ## up if something has gone wrong.
-                tounpack = ''
-                oldunpackedsize = checkfile.tell() - offset
-                try:
-                        unpacktarinfo = unpacktar.next()
-                        if unpacktarinfo == None:
+        ## GNU long names and pax headers apply to the next member, global
+        ## pax headers to all following members.
+        longname = None
+        longlinkname = None
+        paxheaders = {}
+        globalpaxheaders = {}
+
+        while offset + unpackedsize + 512 <= filesize:
+                header = bytes(filedata[offset+unpackedsize:offset+unpackedsize+512])
+
+                ## a block with only NUL bytes marks the end of the archive
+                if header == b'\x00' * 512:
+                        break
+
+                ## check the magic and the checksum of the header
+                if header[257:263] != b'ustar\x00' and header[257:265] != b'ustar  \x00':
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid tar magic'}
+                        break
+                checksum = bangsignatures.parsetarnumber(header[148:156])
+                membersize = bangsignatures.parsetarnumber(header[124:136])
+                if checksum == None or membersize == None:
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid tar header'}
+                        break
+                if not checksum in bangsignatures.computetarchecksums(header):
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'wrong tar header checksum'}
+                        break
+
+                membertype = header[156:157]
+                membername = header[0:100].split(b'\x00', 1)[0]
+                linkname = header[157:257].split(b'\x00', 1)[0]
+
+                ## the POSIX format stores a prefix of the name separately
+                if header[257:263] == b'ustar\x00':
+                        prefix = header[345:500].split(b'\x00', 1)[0]
+                        if prefix != b'':
+                                membername = prefix + b'/' + membername
+
+                ## apply the extended headers of earlier blocks
+                extendedheaders = dict(globalpaxheaders)
+                extendedheaders.update(paxheaders)
+                if longname != None:
+                        membername = longname
+                if longlinkname != None:
+                        linkname = longlinkname
+                if b'path' in extendedheaders:
+                        membername = extendedheaders[b'path']
+                if b'linkpath' in extendedheaders:
+                        linkname = extendedheaders[b'linkpath']
+                if b'size' in extendedheaders and membertype in [b'0', b'\x00', b'7']:
+                        if not extendedheaders[b'size'].isdigit():
+                                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid pax size'}
                                 break
-                        ## don't unpack block devices, character devices or FIFO
-                        ## https://docs.python.org/3/library/tarfile.html#tarfile.TarInfo.isdev
-                        if unpacktarinfo.isdev():
-                                continue
-                        tounpack = unpacktarinfo.name
-                        unpacktar.extract(unpacktarinfo, path=unpackdir, set_attrs=False)
-                        unpackedsize = checkfile.tell() - offset
-                        tarunpacked = True
-                        unpackedname = os.path.join(unpackdir,unpacktarinfo.name)
-
-                        ## TODO: rename files properly with minimum chance of clashes
-                        if unpackedname in unpackedtarfilenames:
-                                pass
-
-
-                        unpackedtarfilenames.add(unpackedname)
-                        if unpacktarinfo.isreg() or unpacktarinfo.isdir():
-                                ## tar changes permissions after unpacking, so change them
-                                ## back to something a bit more sensible
-                                os.chmod(unpackedname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
-                                if not os.path.isdir(unpackedname):
-                                        unpackedfilesandlabels.append((os.path.join(unpackdir, unpacktarinfo.name), []))
-                        elif unpacktarinfo.issym():
-                                unpackedfilesandlabels.append((os.path.join(unpackdir, unpacktarinfo.name), ['symbolic link']))
-                        tounpack = ''
-                except Exception as e:
-                        unpackedsize = oldunpackedsize
-                        tarerror = True
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': str(e)}
-                        if tounpack != '':
-                                unpackedname = os.path.join(unpackdir,unpackedname)
-                                if not os.path.islink(unpackedname):
-                                        os.chmod(unpackedname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
-                                if os.path.isdir(unpackedname) and not os.path.islink(unpackedname):
-                                        shutil.rmtree(unpackedname)
+                        membersize = int(extendedheaders[b'size'])
+
+                ## hard links, symbolic links, devices, directories and
+                ## FIFOs do not have any data.
+                if membertype in [b'1', b'2', b'3', b'4', b'5', b'6']:
+                        membersize = 0
+                if membersize < 0:
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid size'}
+                        break
+
+                ## the data is padded to a multiple of 512 bytes
+                dataoffset = offset + unpackedsize + 512
+                nextheaderoffset = dataoffset + (membersize + 511) // 512 * 512
+                if dataoffset + membersize > filesize:
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data for tar member'}
+                        break
+
+                if membertype in [b'L', b'K', b'x', b'g']:
+                        extendeddata = bytes(filedata[dataoffset:dataoffset+membersize])
+                        if membertype == b'L':
+                                ## GNU long name for the next member
+                                longname = extendeddata.split(b'\x00', 1)[0]
+                        elif membertype == b'K':
+                                ## GNU long link name for the next member
+                                longlinkname = extendeddata.split(b'\x00', 1)[0]
+                        else:
+                                ## pax headers, with records "%d %s=%s\n"
+                                newpaxheaders = parsepaxheaders(extendeddata)
+                                if newpaxheaders == None:
+                                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid pax header'}
+                                        break
+                                if membertype == b'x':
+                                        paxheaders.update(newpaxheaders)
                                 else:
+                                        globalpaxheaders.update(newpaxheaders)
+                        unpackedsize = nextheaderoffset - offset
+                        continue
+
+                if not membertype in [b'0', b'\x00', b'7', b'1', b'2', b'3', b'4', b'5', b'6']:
+                        ## sparse files, multi-volume archives and so on
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'unsupported tar member type'}
+                        break
+
+                ## the extended headers only apply to this member
+                longname = None
+                longlinkname = None
+                paxheaders = {}
+
+                ## old tar implementations store directories as
+                ## regular files with a name that ends in a slash
+                if membertype == b'\x00' and membername.endswith(b'/'):
+                        membertype = b'5'
+
+                ## Make the name relative to the unpacking directory. Members
+                ## with names pointing outside of it are not unpacked.
+                nameparts = splittarname(membername)
+                if nameparts == [] or b'..' in nameparts:
+                        unpackedsize = nextheaderoffset - offset
+                        continue
+                unpackedname = os.path.join(unpackdir, os.fsdecode(b'/'.join(nameparts)))
+
+                ## don't unpack block devices, character devices or FIFO
+                if membertype in [b'3', b'4', b'6']:
+                        unpackedsize = nextheaderoffset - offset
+                        continue
+
+                ## Files kept in memory that have the same name as this member
+                ## or as one of its parent directories are replaced.
+                for i in range(1, len(nameparts)+1):
+                        bangstaging.takestaged(os.path.join(unpackdir, os.fsdecode(b'/'.join(nameparts[:i]))))
+
+                try:
+                        if membertype == b'5':
+                                os.makedirs(unpackedname, exist_ok=True)
+                        else:
+                                parentdirectory = os.path.dirname(unpackedname)
+                                os.makedirs(parentdirectory, exist_ok=True)
+                                realparentdirectory = os.path.realpath(parentdirectory)
+                                if realparentdirectory != realunpackdir and not realparentdirectory.startswith(realunpackdir + os.sep):
+                                        ## the parent directory is a symbolic link
+                                        ## that points outside of the unpacking directory
+                                        unpackedsize = nextheaderoffset - offset
+                                        continue
+
+                                ## a file with the same name can be stored
+                                ## more than once. The last one is kept.
+                                if os.path.lexists(unpackedname) and not os.path.isdir(unpackedname):
                                         os.unlink(unpackedname)
+
+                                if membertype == b'2':
+                                        os.symlink(os.fsdecode(linkname), unpackedname)
+                                        unpackedlabels = ['symbolic link']
+                                elif membertype == b'1':
+                                        ## hard links point to a member that was unpacked
+                                        ## earlier. Data that is still in memory is written.
+                                        linktarget = os.path.join(unpackdir, os.fsdecode(b'/'.join(splittarname(linkname))))
+                                        linkdata = bangstaging.takestaged(linktarget)
+                                        if linkdata != None:
+                                                bangstaging.writetodisk(linktarget, linkdata)
+                                        realtarget = os.path.realpath(linktarget)
+                                        if not realtarget.startswith(realunpackdir + os.sep) or not os.path.isfile(realtarget):
+                                                unpackedsize = nextheaderoffset - offset
+                                                continue
+                                        os.link(realtarget, unpackedname)
+                                        unpackedlabels = []
+                                else:
+                                        carvefile(filename, filedata, dataoffset, membersize, unpackedname, checkfile)
+                                        unpackedlabels = []
+                                if not unpackedname in unpackedtarfilenames:
+                                        unpackedtarfilenames.add(unpackedname)
+                                        unpackedfilesandlabels.append((unpackedname, unpackedlabels))
+                except OSError as e:
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'member could not be unpacked (%s)' % type(e).__name__}
                         break
 
-        ## first close the TarInfo object, then the underlying fileobj
-        unpacktar.close()
+                unpackedsize = nextheaderoffset - offset
+                tarunpacked = True
+
+        checkfile.close()
+
         if not tarunpacked:
-                checkfile.close()
+                bangstaging.discard(unpackdir)
                 unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'Not a valid tar file'}
-                return (False, filesize, unpackedfilesandlabels, labels, unpackingerror)
-
-        ## tar has finished, meaning it should also have read the termination
-        ## blocks for the tar file, so set the unpacked size to just after where
-        ## the tar module finished.
-        unpackedsize = checkfile.tell() - offset
+                return (False, 0, [], labels, unpackingerror)
 
         ## Data was unpacked from the file, so the data up until now is definitely a tar,
         ## but is the rest of the file also part of the tar or of something else?
@@ -1371,178 +1590,289 @@ def unpackTar(filename, offset, unpackdir, temporarydirectory):
         ##
         ## $ tar itvRf /path/to/tar/file
         ##
-        ## These padding bytes are not read by Python's tarfile module and need to
-        if unpackedsize % 512 == 0:
-                 while offset + unpackedsize < filesize:
-                         checkbytes = checkfile.read(512)
-                         if len(checkbytes) != 512:
-                                 break
-                         if checkbytes != b'\x00' * 512:
-                                 break
-                         unpackedsize += 512
+        ## These padding bytes (including the blocks marking the end of the
+        ## archive) are part of the tar file.
+        while offset + unpackedsize + 512 <= filesize:
+                if filedata[offset+unpackedsize:offset+unpackedsize+512] != b'\x00' * 512:
+                        break
+                unpackedsize += 512
+
         if offset == 0 and unpackedsize == filesize:
                 labels.append('tar')
                 labels.append('archive')
 
         return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
+## Split a name in a tar file into its components, without empty
+## components and references to the current directory.
+def splittarname(name):
+        nameparts = []
+        for namepart in name.split(b'/'):
+                if namepart == b'' or namepart == b'.':
+                        continue
+                nameparts.append(namepart)
+        return nameparts
+
+## Parse the records of a pax extended header. Every record looks like
+## "%d %s=%s\n" % (length, keyword, value), where length is the length of
+## the whole record. Returns a dictionary with the keywords and values (as
+## bytes), or None if the records are not valid.
+def parsepaxheaders(paxdata):
+        paxheaders = {}
+        position = 0
+        while position < len(paxdata):
+                ## the data can be padded with NUL bytes
+                if paxdata[position:].strip(b'\x00') == b'':
+                        break
+                lengthend = paxdata.find(b' ', position)
+                if lengthend == -1 or not paxdata[position:lengthend].isdigit():
+                        return None
+                recordlength = int(paxdata[position:lengthend])
+                recordend = position + recordlength
+                if recordlength == 0 or recordend > len(paxdata) or paxdata[recordend-1:recordend] != b'\n':
+                        return None
+                keywordend = paxdata.find(b'=', lengthend, recordend)
+                if keywordend == -1:
+                        return None
+                paxheaders[paxdata[lengthend+1:keywordend]] = paxdata[keywordend+1:recordend-1]
+                position = recordend
+        return paxheaders
+
 ## Unix portable archiver
 ## https://en.wikipedia.org/wiki/Ar_%28Unix%29
 ## https://sourceware.org/binutils/docs/binutils/ar.html
-def unpackAr(filename, offset, unpackdir, temporarydirectory):
-
-        filesize = os.stat(filename).st_size
+##
+## The archive is parsed directly: after the global header there are members,
+## each with a 60 byte header followed by the data of the member, padded to
+## an even length. Both the GNU (System V) and the BSD variants of storing
+## long file names are supported. The archive ends at the end of the file or
+## at the first data that is not a valid member header, so archives can be
+## carved from other data.
+def unpackAr(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
 
         unpackedsize = 0
 
-        if offset != 0:
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'Currently only works on whole files'}
+        ## global header plus at least one member header, unless
+        ## the whole file is an empty archive
+        if filesize - offset < 68 and not (offset == 0 and filesize == 8):
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-        if shutil.which('ar') == None:
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'ar program not found'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        ## parse the headers directly from memory
+        if filedata == None:
+                return mapandunpack(unpackAr, filename, filename, offset, unpackdir, temporarydirectory)
 
-        ## first test the file to see if it is a valid file
-        p = subprocess.Popen(['ar', 't', filename], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (standard_out, standard_error) = p.communicate()
-        if p.returncode != 0:
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'Not a valid ar file'}
+        if filedata[offset:offset+8] != b'!<arch>\n':
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid ar header'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        unpackedsize = 8
 
-        ## then extract the file
-        p = subprocess.Popen(['ar', 'x', filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=unpackdir)
-        (outputmsg, errormsg) = p.communicate()
-        if p.returncode != 0:
-                foundfiles = os.listdir(unpackdir)
-                ## try to remove any files that were left behind
-                for f in foundfiles:
-                        if os.path.isdir(os.path.join(unpackdir, f)):
-                                shutil.rmtree(os.path.join(unpackdir, f))
-                        else:
-                                os.unlink(os.path.join(unpackdir, f))
+        ## the GNU table with long file names
+        longnames = None
 
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'Not a valid ar file'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        ## the names of the members that were unpacked
+        unpackednames = set()
+
+        checkfile = open(filename, 'rb')
+        while offset + unpackedsize + 60 <= filesize:
+                header = bytes(filedata[offset+unpackedsize:offset+unpackedsize+60])
+
+                ## check the magic at the end of the header and the size
+                if header[58:60] != b'`\n':
+                        break
+                membersize = header[48:58].strip(b' ')
+                if membersize == b'' or not membersize.isdigit():
+                        break
+                membersize = int(membersize)
+                memberoffset = offset + unpackedsize + 60
+                if memberoffset + membersize > filesize:
+                        checkfile.close()
+                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'member data outside of file'}
+                        return (False, 0, [], labels, unpackingerror)
+
+                membername = header[:16].rstrip(b' ')
+                if membername == b'/' or membername == b'/SYM64/':
+                        ## GNU symbol table, which is not unpacked
+                        membername = None
+                elif membername == b'//':
+                        ## GNU table with long file names
+                        longnames = bytes(filedata[memberoffset:memberoffset+membersize])
+                        membername = None
+                elif membername.startswith(b'#1/'):
+                        ## BSD long file name, stored in front of the data
+                        namelength = membername[3:]
+                        if not namelength.isdigit() or int(namelength) > membersize:
+                                break
+                        namelength = int(namelength)
+                        membername = bytes(filedata[memberoffset:memberoffset+namelength]).rstrip(b'\x00')
+                        memberoffset += namelength
+                        membersize -= namelength
+                elif membername.startswith(b'/') and membername[1:].isdigit():
+                        ## GNU long file name, stored in the long file name table
+                        if longnames == None or int(membername[1:]) >= len(longnames):
+                                break
+                        nameend = longnames.find(b'/\n', int(membername[1:]))
+                        if nameend == -1:
+                                break
+                        membername = longnames[int(membername[1:]):nameend]
+                elif membername.endswith(b'/'):
+                        ## GNU short file name
+                        membername = membername[:-1]
+
+                ## BSD symbol table, which is not unpacked
+                if membername != None and membername.startswith(b'__.SYMDEF'):
+                        membername = None
+
+                if membername != None:
+                        if membername == b'' or membername == b'.' or membername == b'..' or b'/' in membername or b'\x00' in membername:
+                                break
+
+                        ## write the data of the member. If there are several
+                        ## members with the same name the last one is kept,
+                        ## like ar does.
+                        outfilename = os.path.join(unpackdir, os.fsdecode(membername))
+                        bangstaging.takestaged(outfilename)
+                        carvefile(filename, filedata, memberoffset, membersize, outfilename, checkfile)
+                        if not membername in unpackednames:
+                                unpackednames.add(membername)
+                                unpackedfilesandlabels.append((outfilename, []))
+
+                ## the data of members is padded to an even length
+                unpackedsize = memberoffset + membersize - offset
+                if unpackedsize % 2 == 1 and offset + unpackedsize < filesize:
+                        if filedata[offset+unpackedsize] == 0x0a:
+                                unpackedsize += 1
+        checkfile.close()
 
-        foundfiles = os.listdir(unpackdir)
-        labels += ['archive', 'ar']
+        if unpackedsize == 8 and not (offset == 0 and filesize == 8):
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'no valid ar members'}
+                return (False, 0, [], labels, unpackingerror)
 
-        foundfiles = os.listdir(unpackdir)
-        for f in foundfiles:
-               outputfilename = os.path.join(unpackdir, f)
-               unpackedfilesandlabels.append((outputfilename, []))
-               if f == 'debian-binary':
-                       if filename.lower().endswith('.deb') or filename.lower().endswith('.udeb'):
-                               labels.append('debian')
-                               labels.append('deb')
+        if offset == 0 and unpackedsize == filesize:
+                labels += ['archive', 'ar']
+                if b'debian-binary' in unpackednames:
+                        if filename.lower().endswith('.deb') or filename.lower().endswith('.udeb'):
+                                labels.append('debian')
+                                labels.append('deb')
 
-        return (True, filesize, unpackedfilesandlabels, labels, unpackingerror)
+        return (True, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
 ## Unpacking for squashfs
 ## There are many different flavours of squashfs and configurations
 ## differ per Linux distribution.
 ## This is for the "vanilla" squashfs
-def unpackSquashfs(filename, offset, unpackdir, temporarydirectory):
-        filesize = os.stat(filename).st_size
+##
+## Little endian squashfs 4 file systems (the only variant created by
+## current versions of mksquashfs) with gzip, LZMA or XZ compression are
+## unpacked in process by bangsquashfs, directly from the data and straight
+## into the unpacking directory. Other versions and other compression methods
+## are unpacked with unsquashfs.
+def unpackSquashfs(filename, offset, unpackdir, temporarydirectory, filedata=None):
+        filesize = getfilesize(filename, filedata)
         unpackedfilesandlabels = []
         labels = []
         unpackingerror = {}
 
         unpackedsize = 0
 
-        if shutil.which('unsquashfs') == None:
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'unsquashfs program not found'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-
         ## need at least a header, plus version
         ## see /usr/share/magic
         if filesize - offset < 30:
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-        checkfile = open(filename, 'rb')
-        checkfile.seek(offset)
+        ## read the header directly from memory
+        if filedata == None:
+                return mapandunpack(unpackSquashfs, filename, filename, offset, unpackdir, temporarydirectory)
 
         ## sanity checks for the squashfs header.
         ## First determine the endianness of the file system.
-        checkbytes = checkfile.read(4)
+        checkbytes = filedata[offset:offset+4]
         if checkbytes == b'hsqs':
-                bigendian = False
+                byteorder = 'little'
         else:
-                bigendian = True
+                byteorder = 'big'
 
         ## then skip to the version, as this is an effective way to filter
         ## false positives.
-        checkfile.seek(offset+28)
-        checkbytes = checkfile.read(2)
-        if bigendian:
-                majorversion = int.from_bytes(checkbytes, byteorder='big')
-        else:
-                majorversion = int.from_bytes(checkbytes, byteorder='little')
+        majorversion = int.from_bytes(filedata[offset+28:offset+30], byteorder=byteorder)
 
         ## So far only squashfs 1-4 have been released (June 2018)
         if majorversion == 0 or majorversion > 4:
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'invalid squashfs version'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
-
         ## The location of the size of the squashfs file system depends on
         ## the major version of the file. These values can be found in /usr/share/magic
         ## or in the squashfs-tools source code ( squashfs_compat.h and squashfs_fs.h )
         if majorversion == 4:
-                checkfile.seek(offset+40)
-                checkbytes = checkfile.read(8)
-                if len(checkbytes) != 8:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data to read size'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if bigendian:
-                        squashfssize = int.from_bytes(checkbytes, byteorder='big')
-                else:
-                        squashfssize = int.from_bytes(checkbytes, byteorder='little')
+                (sizeoffset, sizelength) = (40, 8)
         elif majorversion == 3:
-                checkfile.seek(offset+63)
-                checkbytes = checkfile.read(8)
-                if len(checkbytes) != 8:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data to read size'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if bigendian:
-                        squashfssize = int.from_bytes(checkbytes, byteorder='big')
-                else:
-                        squashfssize = int.from_bytes(checkbytes, byteorder='little')
+                (sizeoffset, sizelength) = (63, 8)
         elif majorversion == 2:
-                checkfile.seek(offset+8)
-                checkbytes = checkfile.read(4)
-                if len(checkbytes) != 4:
-                        checkfile.close()
-                        unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data to read size'}
-                        return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
-                if bigendian:
-                        squashfssize = int.from_bytes(checkbytes, byteorder='big')
-                else:
-                        squashfssize = int.from_bytes(checkbytes, byteorder='little')
+                (sizeoffset, sizelength) = (8, 4)
+        else:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'unsupported squashfs version'}
+                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        checkbytes = filedata[offset+sizeoffset:offset+sizeoffset+sizelength]
+        if len(checkbytes) != sizelength:
+                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'not enough data to read size'}
+                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+        squashfssize = int.from_bytes(checkbytes, byteorder=byteorder)
 
         ## file size sanity check
         if offset + squashfssize > filesize:
-                checkfile.close()
                 unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'file system cannot extend past file'}
                 return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
 
+        unpacked = False
+        if majorversion == 4 and byteorder == 'little':
+                (unpacked, unpackedsize, unpackingerror) = bangsquashfs.unpacksquashfs(filedata, offset, unpackdir)
+                if not unpacked and not unpackingerror['unsupported']:
+                        del unpackingerror['unsupported']
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        if not unpacked:
+                (unpacked, unpackingerror) = unpackSquashfsWithUnsquashfs(filename, offset, squashfssize, unpackdir, temporarydirectory)
+                if not unpacked:
+                        return (False, 0, unpackedfilesandlabels, labels, unpackingerror)
+
+        ## now add everything that was unpacked
+        dirwalk = os.walk(unpackdir)
+        for direntries in dirwalk:
+                ## make sure all subdirectories and files can be accessed
+                for subdir in direntries[1]:
+                        subdirname = os.path.join(direntries[0], subdir)
+                        if not os.path.islink(subdirname):
+                                os.chmod(subdirname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
+                for filename in direntries[2]:
+                        fullfilename = os.path.join(direntries[0], filename)
+                        unpackedfilesandlabels.append((fullfilename, []))
+
+        unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'Not a valid Squashfs'}
+        return (True, squashfssize, unpackedfilesandlabels, labels, unpackingerror)
+
+## Unpack a squashfs file system with unsquashfs. Only the data of the
+## file system itself (squashfssize bytes) is copied to a temporary file
+## if the file system does not start at offset 0. Returns a tuple
+## (unpack status, error).
+def unpackSquashfsWithUnsquashfs(filename, offset, squashfssize, unpackdir, temporarydirectory):
+        if shutil.which('unsquashfs') == None:
+                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'unsquashfs program not found'}
+                return (False, unpackingerror)
+
         ## then create a temporary file and copy the data into the temporary file
         ## but only if offset != 0
         if offset != 0:
+                checkfile = open(filename, 'rb')
                 temporaryfile = tempfile.mkstemp(dir=temporarydirectory)
-                ## depending on the variant of squashfs a file size can be determined
-                ## meaning less data needs to be copied.
-                os.sendfile(temporaryfile[0], checkfile.fileno(), offset, filesize - offset)
+                os.sendfile(temporaryfile[0], checkfile.fileno(), offset, squashfssize)
                 os.fdopen(temporaryfile[0]).close()
-        checkfile.close()
+                checkfile.close()
 
         ## unpack in a temporary directory, as unsquashfs expects
         ## to create the directory itself, but the unpacking directory
@@ -1550,50 +1880,144 @@ def unpackSquashfs(filename, offset, unpackdir, temporarydirectory):
         squashfsunpackdirectory = tempfile.mkdtemp(dir=temporarydirectory)
 
         if offset != 0:
-                p = subprocess.Popen(['unsquashfs', temporaryfile[1]], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=squashfsunpackdirectory)
+                (returncode, outputmsg, errormsg) = bangtools.runtool(['unsquashfs', temporaryfile[1]], cwd=squashfsunpackdirectory)
         else:
-                p = subprocess.Popen(['unsquashfs', filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=squashfsunpackdirectory)
-        (outputmsg, errormsg) = p.communicate()
+                (returncode, outputmsg, errormsg) = bangtools.runtool(['unsquashfs', filename], cwd=squashfsunpackdirectory)
 
         if offset != 0:
                 os.unlink(temporaryfile[1])
 
-        if p.returncode != 0:
+        if returncode != 0:
                 shutil.rmtree(squashfsunpackdirectory)
-                unpackingerror = {'offset': offset+unpackedsize, 'fatal': False, 'reason': 'Not a valid squashfs file'}
-                return (False, unpackedsize, unpackedfilesandlabels, labels, unpackingerror)
+                unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'Not a valid squashfs file'}
+                return (False, unpackingerror)
 
-        ## move contents of the unpacked file system
+        ## move contents of the unpacked file system. The current working
+        ## directory is not changed, as it is shared by all threads.
         foundfiles = os.listdir(squashfsunpackdirectory)
         if len(foundfiles) == 1:
                 if foundfiles[0] == 'squashfs-root':
-                        os.chdir(os.path.join(squashfsunpackdirectory, 'squashfs-root'))
+                        squashfsrootdirectory = os.path.join(squashfsunpackdirectory, 'squashfs-root')
                 else:
-                        os.chdir(squashfsunpackdirectory)
-                listoffiles = os.listdir()
+                        squashfsrootdirectory = squashfsunpackdirectory
+                listoffiles = os.listdir(squashfsrootdirectory)
                 for l in listoffiles:
-                        shutil.move(l, unpackdir,copy_function=local_copy2)
+                        shutil.move(os.path.join(squashfsrootdirectory, l), unpackdir,copy_function=local_copy2)
 
         ## clean up the temporary directory
         shutil.rmtree(squashfsunpackdirectory)
 
-        ## now add everything that was unpacked
-        dirwalk = os.walk(unpackdir)
-        for direntries in dirwalk:
-                ## make sure all subdirectories and files can be accessed
-                for subdir in direntries[1]:
-                        subdirname = os.path.join(direntries[0], subdir)
-                        if not os.path.islink(subdirname):
-                                os.chmod(subdirname, stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR)
-                for filename in direntries[2]:
-                        fullfilename = os.path.join(direntries[0], filename)
-                        unpackedfilesandlabels.append((fullfilename, []))
-
-        unpackingerror = {'offset': offset, 'fatal': False, 'reason': 'Not a valid Squashfs'}
-        return (True, squashfssize, unpackedfilesandlabels, labels, unpackingerror)
+        return (True, {})
 
 ## a wrapper around shutil.copy2 to copy symbolic links instead of
 ## following them and copying the data. This is used in squashfs unpacking
 ## amongst others.
 def local_copy2(src, dest):
         return shutil.copy2(src, dest, follow_symlinks=False)
+
+## the printable characters (as defined by string.printable) as bytes,
+## used for quickly determining whether or not data is text.
+printablebytes = string.printable.encode()
+
+## Check if data consists solely of printable characters (as defined by
+## string.printable). The data can be anything supporting the buffer
+## protocol (bytes, bytearray, memoryview, mmap).
+##
+## The data is processed in chunks: all printable characters are removed
+## from a chunk using bytes.translate() (which is done in C, so without a
+## Python call per byte). If anything is left the data is not text and
+## the remaining chunks are not looked at. The first chunk is small, as
+## for binary data a non-printable character is usually found very early.
+def isprintable(data):
+        datalength = len(data)
+        chunkstart = 0
+        chunksize = 4096
+        while chunkstart < datalength:
+                chunk = data[chunkstart:chunkstart+chunksize]
+                if not isinstance(chunk, bytes):
+                        chunk = bytes(chunk)
+                if chunk.translate(None, printablebytes) != b'':
+                        return False
+                chunkstart += chunksize
+                chunksize = 1048576
+        return True
+
+## Compute the CRC32 of a range of a buffer, at most 1 MiB at a time.
+def computecrc32(filedata, start, end):
+        crc = 0
+        while start < end:
+                crc = binascii.crc32(filedata[start:min(start+1048576, end)], crc)
+                start += 1048576
+        return crc
+
+## Determine the size of a file. If the contents of the file are
+## available in a buffer the size of the buffer is used, so no extra
+## stat() call is needed.
+def getfilesize(filename, filedata):
+        if filedata == None:
+                return os.stat(filename).st_size
+        return len(filedata)
+
+## Carve data from a file into a new file. Data that is small enough to be
+## kept in memory (see bangstaging) is taken from the buffer, other data is
+## kept as a range of the file that is scanned, if possible, or copied by
+## the kernel with os.sendfile(), so it does not have to be read into memory
+## first. Data that is only available in memory is always small enough to
+## be kept in memory. An already opened file can be passed as
+## checkfile, for example when many files are carved from the same file.
+def carvefile(filename, filedata, offset, size, outfilename, checkfile=None):
+        if filedata != None and size <= bangstaging.stagingmaxsize:
+                bangstaging.writefile(outfilename, filedata[offset:offset+size])
+                return
+        if bangstaging.carverange(outfilename, filename, offset, size):
+                return
+        if checkfile == None:
+                checkfile = open(filename, 'rb')
+                try:
+                        carvefile(filename, filedata, offset, size, outfilename, checkfile)
+                finally:
+                        checkfile.close()
+                return
+        outfile = open(outfilename, 'wb')
+        while size > 0:
+                written = os.sendfile(outfile.fileno(), checkfile.fileno(), offset, size)
+                if written == 0:
+                        break
+                offset += written
+                size -= written
+        outfile.close()
+
+## Find the first NUL byte in a buffer, starting at an offset, without
+## copying the rest of the buffer first. Returns the offset of the NUL
+## byte, or -1 if there is no NUL byte.
+def findnul(filedata, offset):
+        searchsize = 4096
+        while offset < len(filedata):
+                nulindex = bytes(filedata[offset:offset+searchsize]).find(b'\x00')
+                if nulindex != -1:
+                        return offset + nulindex
+                offset += searchsize
+                searchsize = min(searchsize * 2, 1048576)
+        return -1
+
+## Call an unpacker (or a helper method for unpacking) with a read only
+## memory mapping of a file as the 'filedata' parameter, so the unpacker
+## can parse data directly from memory instead of using seek() and read().
+## This is used by unpackers that were not given a buffer by the caller.
+## The remaining parameters are passed to the unpacker as is.
+def mapandunpack(unpacker, filename, *args):
+        checkfile = open(filename, 'rb')
+        checkmap = mmap.mmap(checkfile.fileno(), 0, access=mmap.ACCESS_READ)
+        filedata = memoryview(checkmap)
+        try:
+                return unpacker(*args, filedata=filedata)
+        finally:
+                filedata.release()
+                try:
+                        checkmap.close()
+                except BufferError:
+                        ## there are still slices of the mapping in use,
+                        ## so it will be closed when these are garbage
+                        ## collected.
+                        pass
+                checkfile.close()
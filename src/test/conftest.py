@@ -0,0 +1,117 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Shared setup for the tests. The modules of BANG are not a package, so the
+## source directory is added to the module search path, like it is when
+## bang-scanner is run.
+
+import os, sys, queue, pathlib, tempfile, importlib.machinery, importlib.util
+import pytest
+
+testdirectory = os.path.dirname(os.path.abspath(__file__))
+sourcedirectory = os.path.dirname(testdirectory)
+sys.path.insert(0, sourcedirectory)
+
+## The scanner itself, for the tables with signatures and unpackers.
+## The file does not end in .py, so it is loaded explicitly.
+@pytest.fixture(scope='session')
+def scanner():
+        loader = importlib.machinery.SourceFileLoader('bangscanner', os.path.join(sourcedirectory, 'bang-scanner'))
+        spec = importlib.util.spec_from_loader('bangscanner', loader)
+        module = importlib.util.module_from_spec(spec)
+        loader.exec_module(module)
+        return module
+
+## Write data to a file in a temporary directory and return the name of the
+## file and an empty directory to unpack to, as passed to the unpackers.
+@pytest.fixture
+def writetestfile(tmp_path):
+        def write(data, name='testfile'):
+                testfile = tmp_path / name
+                testfile.write_bytes(data)
+                unpackdir = tmp_path / ('%s-unpack' % name)
+                unpackdir.mkdir()
+                return (str(testfile), str(unpackdir))
+        return write
+
+## Get the contents of unpacked files, keyed by the name of the file: the
+## data for regular files and the target for symbolic links.
+def unpackedcontents(unpackedfilesandlabels):
+        contents = {}
+        for (unpackedfile, unpackedlabels) in unpackedfilesandlabels:
+                if os.path.islink(unpackedfile):
+                        contents[os.path.basename(unpackedfile)] = os.readlink(unpackedfile)
+                else:
+                        contents[os.path.basename(unpackedfile)] = open(unpackedfile, 'rb').read()
+        return contents
+
+## Get everything in a directory, keyed by the name relative to the
+## directory, as tuples (type, data or target of a symbolic link).
+def directorycontents(directory):
+        contents = {}
+        for (dirpath, subdirectories, files) in os.walk(directory):
+                for name in files + subdirectories:
+                        fullname = os.path.join(dirpath, name)
+                        relativename = os.path.relpath(fullname, directory)
+                        if os.path.islink(fullname):
+                                contents[relativename] = ('link', os.readlink(fullname))
+                        elif os.path.isdir(fullname):
+                                contents[relativename] = ('directory', None)
+                        else:
+                                contents[relativename] = ('file', open(fullname, 'rb').read())
+        return contents
+
+## Scan a file in this process, like bang-scanner does, with one or more
+## scanning threads. Options of the scan can be set with keyword arguments.
+## Returns the top level unpacking directory and the results, keyed by the
+## name of the file relative to the unpacking directory.
+@pytest.fixture
+def scanfile(scanner, tmp_path):
+        def scan(data, name='testfile', threads=1, usemmap=True, stagingmaxsize=65536,
+                 virtualcarving=True, policy='size', maxsearchbytes=2000000):
+                ## every scan gets its own directory, so a test can scan
+                ## the same file with different options
+                unpackdirectory = os.path.join(tempfile.mkdtemp(dir=str(tmp_path)), 'unpack')
+                os.mkdir(unpackdirectory)
+                unpackdirectory = pathlib.Path(unpackdirectory)
+                (unpackdirectory / name).write_bytes(data)
+                scheduler = scanner.bangscheduler.createscheduler(threads, policy)
+                resultqueue = queue.Queue()
+                profilequeue = queue.Queue()
+                scanner.bangscheduler.addwork(scheduler, None, [(str(unpackdirectory / name), ['root'], None)])
+                toolrunner = scanner.bangtools.createtoolrunner(1, 1)
+                processfileargs = (scheduler, resultqueue, maxsearchbytes, str(unpackdirectory), None,
+                                   usemmap, {}, None, profilequeue)
+                try:
+                        scanner.scanprocess(threads, stagingmaxsize, virtualcarving, toolrunner, False, processfileargs)
+                finally:
+                        scanner.bangstaging.configure(0)
+                        scanner.bangtools.configure(None)
+                        state = scanner.bangstaging.getstate()
+                        state.stagedfiles = {}
+                        state.pendingfiles = []
+                        state.pendingbytes = 0
+                results = {}
+                stoppedthreads = 0
+                while stoppedthreads < threads:
+                        fileresult = resultqueue.get()
+                        if fileresult == None:
+                                stoppedthreads += 1
+                                continue
+                        results[fileresult['filename']] = fileresult
+                return (str(unpackdirectory), results)
+        return scan
+
+## Make the results of scans with different options comparable: the
+## full file names differ per scan and the order of labels does not matter.
+def comparableresults(results):
+        comparable = {}
+        for filename in results:
+                fileresult = dict(results[filename])
+                del fileresult['fullfilename']
+                fileresult['labels'] = sorted(fileresult['labels'])
+                comparable[filename] = fileresult
+        return comparable
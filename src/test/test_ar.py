@@ -0,0 +1,69 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for unpacking ar archives.
+
+import os
+
+import bangunpack
+
+from conftest import unpackedcontents
+
+## Create the header of an ar member.
+def createarheader(name, size):
+        return name.ljust(16) + b'0'.ljust(12) + b'0'.ljust(6) + b'0'.ljust(6) + b'644'.ljust(8) + str(size).encode().ljust(10) + b'`\n'
+
+## GNU ar stores long names in a table and pads the data of
+## members to an even length.
+gnuarchive = b'!<arch>\n' + createarheader(b'//', 22) + b'a-very-long-name.txt/\n' \
+             + createarheader(b'/0', 5) + b'hello\n' + createarheader(b'b/', 2) + b'hi'
+
+## BSD ar stores long names in front of the data.
+bsdarchive = b'!<arch>\n' + createarheader(b'#1/24', 29) + b'a-very-long-name.txt\x00\x00\x00\x00hello'
+
+def test_ar(writetestfile):
+        for (name, archive) in [('gnu', gnuarchive), ('bsd', bsdarchive)]:
+                (testfile, unpackdir) = writetestfile(archive, name)
+                (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackAr(testfile, 0, unpackdir, None)
+                assert status
+                assert size == len(archive)
+                assert 'ar' in labels
+                assert unpackedcontents(unpackedfilesandlabels)['a-very-long-name.txt'] == b'hello'
+
+def test_ar_embedded(writetestfile):
+        (testfile, unpackdir) = writetestfile(b'\xff' * 10 + gnuarchive + b'\n\xff')
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackAr(testfile, 10, unpackdir, None)
+        assert status
+        assert size == len(gnuarchive)
+        assert labels == []
+        assert unpackedcontents(unpackedfilesandlabels) == {'a-very-long-name.txt': b'hello', 'b': b'hi'}
+
+## an archive without members is only valid if it is the whole file
+def test_ar_empty(writetestfile):
+        (testfile, unpackdir) = writetestfile(b'!<arch>\n')
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackAr(testfile, 0, unpackdir, None)
+        assert status
+        assert size == 8
+        assert unpackedfilesandlabels == []
+
+        (testfile, unpackdir) = writetestfile(b'\x00\x00!<arch>\n\x00' * 10, 'embedded')
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackAr(testfile, 2, unpackdir, None)
+        assert not status
+
+## a member with data past the end of the file is an error
+def test_ar_truncated(writetestfile):
+        (testfile, unpackdir) = writetestfile(gnuarchive[:-1])
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackAr(testfile, 0, unpackdir, None)
+        assert not status
+        assert error['reason'] == 'member data outside of file'
+
+## members with names pointing outside of the unpacking directory
+def test_ar_invalid_name(writetestfile):
+        archive = b'!<arch>\n' + createarheader(b'#1/8', 10) + b'../../xyhi'
+        (testfile, unpackdir) = writetestfile(archive)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackAr(testfile, 0, unpackdir, None)
+        assert not status
+        assert os.listdir(unpackdir) == []
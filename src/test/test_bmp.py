@@ -0,0 +1,67 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for validating BMP files. Valid files are created with PIL.
+
+import io, os, struct
+import pytest
+import PIL.Image
+
+import bangunpack
+
+def createbmp(mode, size=(13, 7)):
+        image = PIL.Image.new(mode, size)
+        if mode == 'P':
+                image.putpalette(bytes(range(48)))
+        for x in range(size[0]):
+                image.putpixel((x, x % size[1]), 1 if mode in ['1', 'L', 'P'] else (255,) * len(mode))
+        bmpdata = io.BytesIO()
+        image.save(bmpdata, format='BMP')
+        return bmpdata.getvalue()
+
+@pytest.mark.parametrize('mode', ['1', 'L', 'P', 'RGB', 'RGBA'])
+def test_bmp(writetestfile, mode):
+        bmpdata = createbmp(mode)
+        (testfile, unpackdir) = writetestfile(bmpdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackBMP(testfile, 0, unpackdir, None)
+        assert status
+        assert size == len(bmpdata)
+        assert 'bmp' in labels
+
+def test_bmp_carved(writetestfile):
+        bmpdata = createbmp('RGB')
+        (testfile, unpackdir) = writetestfile(b'\x00' * 10 + bmpdata + b'\x00' * 10)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackBMP(testfile, 10, unpackdir, None)
+        assert status
+        assert size == len(bmpdata)
+        assert open(unpackedfilesandlabels[0][0], 'rb').read() == bmpdata
+
+## Change a value in the headers of a valid BMP file.
+def changebmp(bmpdata, position, fmt, value):
+        return bmpdata[:position] + struct.pack(fmt, value) + bmpdata[position+struct.calcsize(fmt):]
+
+@pytest.mark.parametrize('position,fmt,value', [
+        (2, '<I', 100),            ## the pixel data does not fit in the file
+        (10, '<I', 20),            ## pixel data inside of the headers
+        (26, '<H', 2),             ## two color planes
+        (28, '<H', 3),             ## invalid bits per pixel
+        (30, '<I', 1),             ## run length encoding with 24 bits per pixel
+        (18, '<i', 0),             ## no width
+        (22, '<i', 100),           ## pixel data bigger than the file
+        ])
+def test_bmp_invalid(writetestfile, position, fmt, value):
+        bmpdata = changebmp(createbmp('RGB'), position, fmt, value)
+        (testfile, unpackdir) = writetestfile(bmpdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackBMP(testfile, 0, unpackdir, None)
+        assert not status
+        assert os.listdir(unpackdir) == []
+
+## the color table of a palette image has to fit before the pixel data
+def test_bmp_colortable(writetestfile):
+        bmpdata = changebmp(createbmp('P'), 46, '<I', 257)
+        (testfile, unpackdir) = writetestfile(bmpdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackBMP(testfile, 0, unpackdir, None)
+        assert not status
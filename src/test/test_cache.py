@@ -0,0 +1,112 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for the persistent result cache.
+
+import time
+
+import bangcache
+import bangsquashfs
+
+def test_store_and_lookup(tmp_path):
+        cachefile = str(tmp_path / 'cache.sqlite')
+        bangcache.initcache(cachefile, 'v1')
+        cache = bangcache.opencache(cachefile, 1048576)
+        assert bangcache.lookupcache(cache, 'aa', 'v1') == None
+        result = [{'offset': 0, 'signature': 'gzip', 'size': 20}]
+        bangcache.storecache(cache, 'aa', 'v1', result)
+        assert bangcache.lookupcache(cache, 'aa', 'v1') == result
+        assert bangcache.lookupcache(cache, 'aa', 'v2') == None
+        bangcache.closecache(cache)
+
+        ## the results are kept between scans
+        bangcache.initcache(cachefile, 'v1')
+        cache = bangcache.opencache(cachefile, 1048576)
+        assert bangcache.lookupcache(cache, 'aa', 'v1') == result
+        bangcache.closecache(cache)
+
+## Results are written in batches, and the pending results are
+## written when the cache is closed.
+def test_batches(tmp_path):
+        cachefile = str(tmp_path / 'cache.sqlite')
+        bangcache.initcache(cachefile, 'v1')
+        cache = bangcache.opencache(cachefile, 1048576)
+        othercache = bangcache.opencache(cachefile, 1048576)
+        for i in range(bangcache.storebatchsize - 1):
+                bangcache.storecache(cache, str(i), 'v1', [i])
+        assert bangcache.lookupcache(othercache, '0', 'v1') == None
+        bangcache.storecache(cache, 'last', 'v1', ['last'])
+        assert bangcache.lookupcache(othercache, '0', 'v1') == [0]
+        assert bangcache.lookupcache(othercache, 'last', 'v1') == ['last']
+
+        bangcache.storecache(cache, 'closed', 'v1', ['closed'])
+        assert bangcache.lookupcache(othercache, 'closed', 'v1') == None
+        bangcache.closecache(cache)
+        assert bangcache.lookupcache(othercache, 'closed', 'v1') == ['closed']
+        bangcache.closecache(othercache)
+
+## Results stored with another version are removed.
+def test_version(tmp_path):
+        cachefile = str(tmp_path / 'cache.sqlite')
+        bangcache.initcache(cachefile, 'v1')
+        cache = bangcache.opencache(cachefile, 1048576)
+        bangcache.storecache(cache, 'aa', 'v1', [1])
+        bangcache.closecache(cache)
+        bangcache.initcache(cachefile, 'v2')
+        cache = bangcache.opencache(cachefile, 1048576)
+        assert cache['connection'].execute("SELECT COUNT(*) FROM results").fetchone()[0] == 0
+        assert cache['connection'].execute("SELECT value FROM meta WHERE key = 'totalsize'").fetchone()[0] == 0
+        bangcache.closecache(cache)
+
+## The least recently used results are removed when the cache is full,
+## and results that are bigger than the cache are not stored.
+def test_eviction(tmp_path):
+        cachefile = str(tmp_path / 'cache.sqlite')
+        bangcache.initcache(cachefile, 'v1')
+        result = ['x' * 96]
+        entrysize = len('["%s"]' % result[0])
+        cache = bangcache.opencache(cachefile, 3 * entrysize)
+        for sha256 in ['aa', 'bb', 'cc']:
+                bangcache.storecache(cache, sha256, 'v1', result)
+                bangcache.flushcache(cache)
+                time.sleep(0.01)
+        assert bangcache.lookupcache(cache, 'aa', 'v1') == result
+        bangcache.storecache(cache, 'dd', 'v1', result)
+        bangcache.flushcache(cache)
+        assert bangcache.lookupcache(cache, 'bb', 'v1') == None
+        for sha256 in ['aa', 'cc', 'dd']:
+                assert bangcache.lookupcache(cache, sha256, 'v1') == result
+
+        bangcache.storecache(cache, 'ee', 'v1', ['x' * 1000])
+        bangcache.flushcache(cache)
+        assert bangcache.lookupcache(cache, 'ee', 'v1') == None
+
+        ## replacing an entry does not count its old size
+        bangcache.storecache(cache, 'aa', 'v1', result)
+        bangcache.flushcache(cache)
+        assert cache['connection'].execute("SELECT value FROM meta WHERE key = 'totalsize'").fetchone()[0] == 3 * entrysize
+        bangcache.closecache(cache)
+
+## The version changes when the signatures, the unpackers or the
+## prevalidators change, or when any of the modules they use changes.
+def test_cache_version(scanner, tmp_path, monkeypatch):
+        version = bangcache.computecacheversion(scanner.signatures, scanner.signaturetofunction, scanner.signaturetoprevalidator)
+        assert version == bangcache.computecacheversion(dict(scanner.signatures), dict(scanner.signaturetofunction), dict(scanner.signaturetoprevalidator))
+        signatures = dict(scanner.signatures)
+        signatures['png'] = b'\x89PNG'
+        assert version != bangcache.computecacheversion(signatures, scanner.signaturetofunction, scanner.signaturetoprevalidator)
+        signaturetofunction = dict(scanner.signaturetofunction)
+        signaturetofunction['bmp'] = scanner.signaturetofunction['png']
+        assert version != bangcache.computecacheversion(scanner.signatures, signaturetofunction, scanner.signaturetoprevalidator)
+        signaturetoprevalidator = dict(scanner.signaturetoprevalidator)
+        del signaturetoprevalidator['bmp']
+        assert version != bangcache.computecacheversion(scanner.signatures, scanner.signaturetofunction, signaturetoprevalidator)
+
+        ## a change in a module that is only imported by the unpackers
+        changedsquashfs = tmp_path / 'bangsquashfs.py'
+        changedsquashfs.write_bytes(open(bangsquashfs.__file__, 'rb').read() + b'\n')
+        monkeypatch.setattr(bangsquashfs, '__file__', str(changedsquashfs))
+        assert version != bangcache.computecacheversion(scanner.signatures, scanner.signaturetofunction, scanner.signaturetoprevalidator)
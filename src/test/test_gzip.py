@@ -0,0 +1,78 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for unpacking gzip compressed data.
+
+import gzip, io, os, struct
+import pytest
+
+import bangunpack
+
+from conftest import unpackedcontents
+
+def creategzip(data, filename=None):
+        gzipdata = io.BytesIO()
+        gzipfile = gzip.GzipFile(filename=filename, mode='wb', fileobj=gzipdata, mtime=0)
+        gzipfile.write(data)
+        gzipfile.close()
+        return gzipdata.getvalue()
+
+## test data: empty, small, and bigger than the buffer for the output
+testdata = {'empty': b'', 'small': b'hello\n', 'random': os.urandom(100000),
+            'big': os.urandom(1000) * 5000}
+
+## Data that is bigger than the buffer for the output is written while
+## it is decompressed.
+@pytest.mark.parametrize('dataname', ['empty', 'small', 'random', 'big'])
+def test_gzip(writetestfile, dataname):
+        data = testdata[dataname]
+        gzipdata = creategzip(data)
+        (testfile, unpackdir) = writetestfile(gzipdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackGzip(testfile, 0, unpackdir, None)
+        assert status
+        assert size == len(gzipdata)
+        assert 'gzip' in labels
+        assert unpackedcontents(unpackedfilesandlabels) == {'unpacked-from-gz': data}
+
+## The file is renamed to the name stored in the header.
+def test_gzip_name(writetestfile):
+        gzipdata = creategzip(b'hello\n', 'original.txt')
+        (testfile, unpackdir) = writetestfile(b'\x00' * 5 + gzipdata + b'\x00' * 5)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackGzip(testfile, 5, unpackdir, None)
+        assert status
+        assert size == len(gzipdata)
+        assert labels == []
+        assert unpackedcontents(unpackedfilesandlabels) == {'original.txt': b'hello\n'}
+
+## Nothing is written if the CRC32 or ISIZE are wrong or
+## if the data is truncated.
+@pytest.mark.parametrize('dataname', ['small', 'big'])
+@pytest.mark.parametrize('change,reason', [
+        (lambda x: x[:-8] + struct.pack('<I', (struct.unpack('<I', x[-8:-4])[0] + 1) % (1 << 32)) + x[-4:], 'wrong CRC'),
+        (lambda x: x[:-4] + struct.pack('<I', (struct.unpack('<I', x[-4:])[0] + 1) % (1 << 32)), 'wrong value for ISIZE'),
+        (lambda x: x[:-6], 'no CRC and ISIZE'),
+        (lambda x: x[:len(x)//2], 'not enough data'),
+        ])
+def test_gzip_invalid(writetestfile, dataname, change, reason):
+        gzipdata = change(creategzip(testdata[dataname]))
+        (testfile, unpackdir) = writetestfile(gzipdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackGzip(testfile, 0, unpackdir, None)
+        assert not status
+        assert error['reason'] == reason
+        assert os.listdir(unpackdir) == []
+
+## A stored name that is not the name of a file in the unpacking
+## directory is not used.
+@pytest.mark.parametrize('storedname', ['../escaped', 'a/b', '..'])
+def test_gzip_bad_name(writetestfile, storedname):
+        ## the gzip module only stores the last part of a name
+        gzipdata = creategzip(b'hello\n')
+        gzipdata = gzipdata[:3] + b'\x08' + gzipdata[4:10] + storedname.encode() + b'\x00' + gzipdata[10:]
+        (testfile, unpackdir) = writetestfile(gzipdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackGzip(testfile, 0, unpackdir, None)
+        assert status
+        assert unpackedcontents(unpackedfilesandlabels) == {'unpacked-from-gz': b'hello\n'}
+        assert os.listdir(unpackdir) == ['unpacked-from-gz']
@@ -0,0 +1,50 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for unpacking LZMA and XZ compressed data, which is first
+## checked by decompressing a small probe.
+
+import lzma, os, random
+import pytest
+
+import bangunpack
+
+from conftest import unpackedcontents
+
+## test data of different sizes and how well it compresses
+testdata = {'tiny': b'a', 'text': b'hello world\n' * 10000, 'random': os.urandom(300000),
+            'zeroes': b'\x00' * 3000000}
+
+@pytest.mark.parametrize('dataname', sorted(testdata))
+def test_lzma(writetestfile, dataname):
+        data = testdata[dataname]
+        lzmadata = lzma.compress(data, format=lzma.FORMAT_ALONE)
+        (testfile, unpackdir) = writetestfile(lzmadata + b'\x00' * 10)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackLZMA(testfile, 0, unpackdir, None)
+        assert status
+        assert list(unpackedcontents(unpackedfilesandlabels).values()) == [data]
+
+@pytest.mark.parametrize('dataname', sorted(testdata))
+def test_xz(writetestfile, dataname):
+        data = testdata[dataname]
+        xzdata = lzma.compress(data, format=lzma.FORMAT_XZ)
+        (testfile, unpackdir) = writetestfile(xzdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackXZ(testfile, 0, unpackdir, None)
+        assert status
+        assert size == len(xzdata)
+        assert list(unpackedcontents(unpackedfilesandlabels).values()) == [data]
+
+## Random data after a valid LZMA header is rejected by the probe,
+## without anything being written.
+@pytest.mark.parametrize('seed', range(10))
+def test_lzma_garbage(writetestfile, seed):
+        randomgenerator = random.Random(seed)
+        header = lzma.compress(b'x', format=lzma.FORMAT_ALONE)[:5] + b'\xff' * 8
+        garbage = bytes(randomgenerator.getrandbits(8) for i in range(100000))
+        (testfile, unpackdir) = writetestfile(header + garbage)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackLZMA(testfile, 0, unpackdir, None)
+        assert not status
+        assert os.listdir(unpackdir) == []
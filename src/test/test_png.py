@@ -0,0 +1,138 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for validating PNG files. The result of the validation is compared
+## with the result of decoding the file with PIL, which is how PNG files
+## were validated before (and still are with strict validation).
+
+import io, os, random, struct, zlib
+import pytest
+import PIL.Image
+
+import bangunpack
+
+## Create a PNG chunk.
+def createpngchunk(chunktype, data):
+        return struct.pack('>I', len(data)) + chunktype + data + struct.pack('>I', zlib.crc32(chunktype + data))
+
+## Create the uncompressed image data for a PNG image with random pixels,
+## with every row of every (interlacing) pass starting with a filter type.
+def createpngimagedata(width, height, bitsperpixel, interlacemethod, randomgenerator):
+        if interlacemethod == 0:
+                passes = [(0, 0, 1, 1)]
+        else:
+                passes = bangunpack.adam7passes
+        imagedata = b''
+        for (rowstart, columnstart, rowstep, columnstep) in passes:
+                passwidth = (width - columnstart + columnstep - 1) // columnstep
+                passheight = (height - rowstart + rowstep - 1) // rowstep
+                if passwidth <= 0 or passheight <= 0:
+                        continue
+                for row in range(passheight):
+                        rowsize = (passwidth * bitsperpixel + 7) // 8
+                        imagedata += bytes([randomgenerator.randrange(5)]) + bytes(randomgenerator.getrandbits(8) for i in range(rowsize))
+        return imagedata
+
+## Create a PNG file. The image data can be changed with imagedatachange,
+## a function that gets the uncompressed image data and returns new data.
+def createpng(width, height, colortype, bitdepth, interlacemethod, imagedatachange=None, seed=0, idatsize=100):
+        randomgenerator = random.Random(seed)
+        bitsperpixel = bitdepth * bangunpack.pngchannels[colortype]
+        imagedata = createpngimagedata(width, height, bitsperpixel, interlacemethod, randomgenerator)
+        if imagedatachange != None:
+                imagedata = imagedatachange(imagedata)
+        compresseddata = zlib.compress(imagedata)
+
+        pngdata = b'\x89PNG\r\n\x1a\n'
+        pngdata += createpngchunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bitdepth, colortype, 0, 0, interlacemethod))
+        if colortype == 3:
+                pngdata += createpngchunk(b'PLTE', bytes(randomgenerator.getrandbits(8) for i in range(3 * (1 << bitdepth))))
+        ## the image data is split over several IDAT chunks
+        for i in range(0, len(compresseddata), idatsize):
+                pngdata += createpngchunk(b'IDAT', compresseddata[i:i+idatsize])
+        pngdata += createpngchunk(b'IEND', b'')
+        return pngdata
+
+## The old validation: decode the whole image with PIL.
+def validwithpil(pngdata):
+        try:
+                image = PIL.Image.open(io.BytesIO(pngdata))
+                image.load()
+                image.close()
+        except Exception:
+                return False
+        return True
+
+def validwithbang(writetestfile, pngdata):
+        (testfile, unpackdir) = writetestfile(pngdata)
+        return bangunpack.unpackPNG(testfile, 0, unpackdir, None)[0]
+
+## all combinations of color type and bit depth (section 11.2.2)
+pngformats = []
+for colortype in sorted(bangunpack.pngbitdepths):
+        for bitdepth in sorted(bangunpack.pngbitdepths[colortype]):
+                pngformats.append((colortype, bitdepth))
+
+@pytest.mark.parametrize('colortype,bitdepth', pngformats)
+@pytest.mark.parametrize('interlacemethod', [0, 1])
+@pytest.mark.parametrize('width,height', [(1, 1), (3, 5), (8, 8), (17, 9)])
+def test_png(writetestfile, colortype, bitdepth, interlacemethod, width, height):
+        pngdata = createpng(width, height, colortype, bitdepth, interlacemethod)
+        assert validwithpil(pngdata)
+        assert validwithbang(writetestfile, pngdata)
+
+## Image data that is too short is rejected, like PIL does. PIL does
+## not always notice this for images with less than 8 bits per sample.
+@pytest.mark.parametrize('colortype,bitdepth', [(0, 1), (0, 16), (2, 16), (3, 2), (3, 8), (6, 16)])
+@pytest.mark.parametrize('interlacemethod', [0, 1])
+def test_png_short_image_data(writetestfile, colortype, bitdepth, interlacemethod):
+        pngdata = createpng(17, 9, colortype, bitdepth, interlacemethod, lambda x: x[:-20])
+        if bitdepth >= 8:
+                assert not validwithpil(pngdata)
+        assert not validwithbang(writetestfile, pngdata)
+
+## Image data that is longer than the dimensions of the image is rejected
+## as well. PIL does not check this.
+@pytest.mark.parametrize('interlacemethod', [0, 1])
+def test_png_long_image_data(writetestfile, interlacemethod):
+        pngdata = createpng(17, 9, 2, 16, interlacemethod, lambda x: x + b'\x00' * 20)
+        assert not validwithbang(writetestfile, pngdata)
+
+def test_png_invalid_header(writetestfile):
+        ## palette images with 16 bits per sample do not exist
+        pngdata = createpng(4, 4, 3, 8, 0)
+        pngdata = pngdata[:8] + createpngchunk(b'IHDR', struct.pack('>IIBBBBB', 4, 4, 16, 3, 0, 0, 0)) + pngdata[33:]
+        assert not validwithpil(pngdata)
+        assert not validwithbang(writetestfile, pngdata)
+
+def test_png_no_palette(writetestfile):
+        pngdata = createpng(4, 4, 3, 8, 0)
+        plteend = pngdata.index(b'IDAT') - 4
+        pngdata = pngdata[:33] + pngdata[plteend:]
+        assert not validwithbang(writetestfile, pngdata)
+
+def test_png_bad_crc(writetestfile):
+        pngdata = bytearray(createpng(8, 8, 6, 8, 1))
+        pngdata[-20] ^= 0xff
+        assert not validwithbang(writetestfile, bytes(pngdata))
+
+## Files written by PIL itself.
+@pytest.mark.parametrize('mode', ['1', 'L', 'P', 'RGB', 'RGBA', 'I;16', 'LA'])
+def test_png_pil(writetestfile, mode):
+        image = PIL.Image.effect_noise((31, 17), 64).convert(mode)
+        pngdata = io.BytesIO()
+        image.save(pngdata, format='PNG')
+        assert validwithbang(writetestfile, pngdata.getvalue())
+
+## A carved PNG file is written to the unpacking directory.
+def test_png_carved(writetestfile):
+        pngdata = createpng(17, 9, 3, 4, 1)
+        (testfile, unpackdir) = writetestfile(b'\x00' * 20 + pngdata + b'\x00' * 20)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackPNG(testfile, 20, unpackdir, None)
+        assert status
+        assert size == len(pngdata)
+        assert open(unpackedfilesandlabels[0][0], 'rb').read() == pngdata
+        assert os.listdir(unpackdir) == ['unpacked.png']
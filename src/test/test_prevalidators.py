@@ -0,0 +1,95 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for the prevalidators, which reject candidates before the unpacker
+## is called. A prevalidator may only reject candidates that the unpacker
+## would reject as well, which is checked for every prevalidator with the
+## samples of the tests of the formats, on their own and embedded in other
+## data, and with signatures scattered through random data.
+
+import gzip, lzma, random, tarfile
+import pytest
+
+import bangsignatures
+
+from test_ar import gnuarchive, bsdarchive
+from test_bmp import createbmp
+from test_riff import rifffiles
+from test_signatures import createtestdata
+from test_squashfs import createsquashfs
+from test_tar import createtar, members
+from test_timezone import createtimezone
+
+## Compress data as LZMA with the properties byte of one of the signatures.
+def createlzma(data, literalcontextbits, literalpositionbits):
+        lzmafilter = {'id': lzma.FILTER_LZMA1, 'lc': literalcontextbits, 'lp': literalpositionbits, 'pb': 2}
+        return lzma.compress(data, format=lzma.FORMAT_ALONE, filters=[lzmafilter])
+
+## Samples per signature. There are no samples of big endian squashfs
+## file systems, as these can only be unpacked with unsquashfs.
+prevalidatorsamples = {
+        'riff': lambda: list(rifffiles.values()),
+        'gzip': lambda: [gzip.compress(b'hello\n' * 100), gzip.compress(b'')],
+        'bmp': lambda: [createbmp(mode) for mode in ['1', 'L', 'P', 'RGB', 'RGBA']],
+        'xz': lambda: [lzma.compress(b'hello\n' * 100), lzma.compress(b'hello\n', check=lzma.CHECK_NONE)],
+        'lzma_var1': lambda: [createlzma(b'hello\n' * 100, 3, 0)],
+        'lzma_var2': lambda: [createlzma(b'hello\n' * 100, 1, 2)],
+        'lzma_var3': lambda: [createlzma(b'hello\n' * 100, 0, 2)],
+        'timezone': lambda: [createtimezone(version) for version in [b'\x00', b'2', b'3']],
+        'tar_posix': lambda: [createtar(members, tarfile.PAX_FORMAT), createtar(members[:2], tarfile.USTAR_FORMAT)],
+        'tar_gnu': lambda: [createtar(members, tarfile.GNU_FORMAT)],
+        'ar': lambda: [gnuarchive, bsdarchive, b'!<arch>\n'],
+        'squashfs_var1': lambda: [],
+        'squashfs_var2': lambda: [createsquashfs([(b'a', 'file', b'data'), (b'b', 'symlink', b'a')])],
+}
+
+def test_prevalidatorsamples(scanner):
+        assert sorted(prevalidatorsamples) == sorted(scanner.signaturetoprevalidator)
+
+## Try the unpacker for every candidate for a signature in the data and
+## check that the prevalidator accepts the candidates that were unpacked.
+## The files are written in a new directory. Returns the amount of
+## candidates that were unpacked.
+def checkcandidates(scanner, directory, data, signature):
+        directory.mkdir()
+        testfile = directory / 'testfile'
+        testfile.write_bytes(data)
+        unpacked = 0
+        for (offset, candidatesignature) in sorted(bangsignatures.findsignatures(scanner.signaturematcher, data, 0)):
+                if candidatesignature != signature:
+                        continue
+                unpackdir = directory / ('unpack-%d' % offset)
+                unpackdir.mkdir()
+                unpackresult = scanner.signaturetofunction[signature](str(testfile), offset, str(unpackdir), str(directory))
+                if unpackresult[0]:
+                        unpacked += 1
+                        checkbytes = data[offset:offset+bangsignatures.prevalidatebytes]
+                        assert scanner.signaturetoprevalidator[signature](checkbytes, offset, len(data)), offset
+        return unpacked
+
+@pytest.mark.parametrize('signature', sorted(prevalidatorsamples))
+def test_prevalidator_samples(scanner, tmp_path, signature):
+        randomgenerator = random.Random(signature)
+        for (i, sample) in enumerate(prevalidatorsamples[signature]()):
+                assert checkcandidates(scanner, tmp_path / str(i), sample, signature) >= 1
+                prefix = bytes(randomgenerator.getrandbits(8) for i in range(513))
+                suffix = bytes(randomgenerator.getrandbits(8) for i in range(100))
+                checkcandidates(scanner, tmp_path / ('%d-embedded' % i), prefix + sample + suffix, signature)
+
+@pytest.mark.parametrize('signature', sorted(prevalidatorsamples))
+def test_prevalidator_random(scanner, tmp_path, signature):
+        for seed in range(3):
+                checkcandidates(scanner, tmp_path / str(seed), createtestdata(scanner.signatures, seed, 16384), signature)
+
+## The prevalidators do reject candidates.
+def test_prevalidator_reject():
+        assert not bangsignatures.prevalidateAr(b'!<arch>\n\x00' * 10, 2, 110)
+        tardata = createtar(members[:2], tarfile.USTAR_FORMAT)
+        assert bangsignatures.prevalidateTar(tardata[:512], 0, len(tardata))
+        assert not bangsignatures.prevalidateTar(tardata[:148] + b'0000000\x00' + tardata[156:512], 0, len(tardata))
+        assert not bangsignatures.prevalidateTar(tardata[:148] + b'999999\x00 ' + tardata[156:512], 0, len(tardata))
+        assert not bangsignatures.prevalidateGzip(b'\x1f\x8b\x08\x20', 0, 100)
+        assert not bangsignatures.prevalidateLZMA(b'\x5d\x00\x00\x01\x01' + b'\xff' * 8, 0, 100)
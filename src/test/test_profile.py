@@ -0,0 +1,84 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for the performance counters of the unpackers and for keeping
+## the CPU time of external programs.
+
+import sys, threading, time
+
+import bangprofile
+import bangtools
+import bangunpack
+
+## Use CPU time in the current thread for a while.
+def busy(seconds):
+        endtime = time.monotonic() + seconds
+        while time.monotonic() < endtime:
+                pass
+
+## Only the CPU time of the thread running the unpacker is counted, not
+## the CPU time of other threads in the same process.
+def test_cputime_thread():
+        counters = bangprofile.createcounters()
+        timer = bangprofile.starttimer()
+        otherthread = threading.Thread(target=busy, args=(0.5,))
+        otherthread.start()
+        otherthread.join()
+        bangprofile.recordunpack(counters, 'test', timer, True, 10, 0)
+        assert counters['test']['walltime'] >= 0.5
+        assert counters['test']['cputime'] < 0.25
+
+        timer = bangprofile.starttimer()
+        busy(0.5)
+        bangprofile.recordunpack(counters, 'test', timer, True, 10, 0)
+        assert counters['test']['cputime'] >= 0.4
+        assert counters['test']['toolcputime'] == 0.0
+
+## The CPU time of external programs is counted for the thread that ran
+## the program, and separately as well.
+def test_cputime_tool():
+        program = [sys.executable, '-c', 'import time\nendtime = time.time() + 0.5\nwhile time.time() < endtime: pass']
+        counters = bangprofile.createcounters()
+        timer = bangprofile.starttimer()
+        otherthread = threading.Thread(target=bangtools.runtool, args=(program,))
+        otherthread.start()
+        otherthread.join()
+        bangprofile.recordunpack(counters, 'test', timer, True, 10, 0)
+        assert counters['test']['toolcputime'] == 0.0
+
+        timer = bangprofile.starttimer()
+        (returncode, outputmsg, errormsg) = bangtools.runtool(program)
+        bangprofile.recordunpack(counters, 'test', timer, False, 10, 0, 'reason')
+        assert returncode == 0
+        assert counters['test']['toolcputime'] >= 0.4
+        assert counters['test']['cputime'] >= counters['test']['toolcputime']
+        assert counters['test']['failedcputime'] >= counters['test']['toolcputime']
+
+def test_runtool():
+        (returncode, outputmsg, errormsg) = bangtools.runtool([sys.executable, '-c', 'import sys\nsys.stdout.write(sys.stdin.read().upper())\nsys.exit(3)'], inputdata=b'hello')
+        assert (returncode, outputmsg, errormsg) == (3, b'HELLO', b'')
+
+## Programs that take too long are killed.
+def test_runtool_timeout():
+        bangtools.configure(bangtools.createtoolrunner(1, 1, 0.5))
+        try:
+                starttime = time.monotonic()
+                (returncode, outputmsg, errormsg) = bangtools.runtool([sys.executable, '-c', 'import time\ntime.sleep(60)'])
+        finally:
+                bangtools.configure(None)
+        assert returncode < 0
+        assert time.monotonic() - starttime < 30
+
+## Failures are counted by reason, which does not depend on the data.
+def test_failurereasons(writetestfile):
+        counters = bangprofile.createcounters()
+        for chunkid in [b'abcd', b'efgh']:
+                (testfile, unpackdir) = writetestfile(b'RIFF' + (12).to_bytes(4, 'little') + b'WAVE' + chunkid + b'\x00' * 4, chunkid.decode())
+                timer = bangprofile.starttimer()
+                (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackWAV(testfile, 0, unpackdir, None)
+                assert not status
+                bangprofile.recordunpack(counters, 'wav', timer, False, error['offset'], 0, error['reason'])
+        assert counters['wav']['failurereasons'] == {'no valid chunk FourCC': 2}
@@ -0,0 +1,76 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for verifying RIFF files (WebP, WAV and ANI) found with the
+## single RIFF signature.
+
+import io, os, struct, wave
+import pytest
+
+import bangunpack
+
+def createriffchunk(fourcc, data):
+        chunk = fourcc + struct.pack('<I', len(data)) + data
+        if len(data) % 2 == 1:
+                chunk += b'\x00'
+        return chunk
+
+def createriff(formtype, chunks):
+        data = formtype + b''.join(map(lambda x: createriffchunk(x[0], x[1]), chunks))
+        return b'RIFF' + struct.pack('<I', len(data)) + data
+
+def createwav():
+        wavdata = io.BytesIO()
+        wavfile = wave.open(wavdata, 'wb')
+        wavfile.setnchannels(1)
+        wavfile.setsampwidth(1)
+        wavfile.setframerate(8000)
+        wavfile.writeframes(bytes(range(256)))
+        wavfile.close()
+        return wavdata.getvalue()
+
+rifffiles = {
+        'wav': createwav(),
+        'webp': createriff(b'WEBP', [(b'VP8L', b'\x2f\x00\x00\x00\x00')]),
+        'ani': createriff(b'ACON', [(b'anih', b'\x24' + b'\x00' * 35), (b'rate', b'\x0a\x00\x00\x00')]),
+}
+
+@pytest.mark.parametrize('formname,formlabel', [('wav', 'wav'), ('webp', 'webp'), ('ani', 'ani')])
+def test_riff(writetestfile, formname, formlabel):
+        riffdata = rifffiles[formname]
+        (testfile, unpackdir) = writetestfile(riffdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackRIFFForm(testfile, 0, unpackdir, None)
+        assert status
+        assert size == len(riffdata)
+        assert formlabel in labels
+
+        ## the result is the same as the result of the unpacker for the format
+        formunpacker = {'wav': bangunpack.unpackWAV, 'webp': bangunpack.unpackWebP, 'ani': bangunpack.unpackANI}[formname]
+        assert formunpacker(testfile, 0, unpackdir, None) == (status, size, unpackedfilesandlabels, labels, error)
+
+def test_riff_carved(writetestfile):
+        riffdata = rifffiles['wav']
+        (testfile, unpackdir) = writetestfile(b'RIFF' + riffdata + b'\xff' * 3)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackRIFFForm(testfile, 4, unpackdir, None)
+        assert status
+        assert size == len(riffdata)
+        assert labels == []
+        (unpackedfile, unpackedlabels) = unpackedfilesandlabels[0]
+        assert 'wav' in unpackedlabels and 'unpacked' in unpackedlabels
+        assert open(unpackedfile, 'rb').read() == riffdata
+
+@pytest.mark.parametrize('riffdata', [
+        createriff(b'AVI ', [(b'data', b'xx')]),                       ## unsupported form type
+        createriff(b'WAVE', [(b'VP8L', b'xx')]),                       ## chunk of another form type
+        b'RIFF\x0e\x00\x00\x00WAVEdata\x64\x00\x00\x00xx' + b'\xff' * 200,  ## chunk past the end of the RIFF data
+        createriff(b'WAVE', [(b'data', b'xxx')])[:-1] + b'\x01',       ## padding byte not 0
+        rifffiles['wav'][:4] + b'\xff\xff\x00\x00' + rifffiles['wav'][8:],  ## RIFF data past the end of the file
+        ])
+def test_riff_invalid(writetestfile, riffdata):
+        (testfile, unpackdir) = writetestfile(riffdata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackRIFFForm(testfile, 0, unpackdir, None)
+        assert not status
+        assert os.listdir(unpackdir) == []
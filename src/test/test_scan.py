@@ -0,0 +1,171 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for scanning files with the scanner, with different options. The
+## results of a scan should not depend on the options used for scanning.
+
+import gzip, io, json, lzma, mmap, os, queue, tarfile
+import pytest
+import PIL.Image
+
+from conftest import comparableresults
+
+## Create a tar archive with the given (name, data) members.
+def createtar(members):
+        tarbuffer = io.BytesIO()
+        with tarfile.open(fileobj=tarbuffer, mode='w') as tar:
+                for (name, data) in members:
+                        tarinfo = tarfile.TarInfo(name)
+                        tarinfo.size = len(data)
+                        tar.addfile(tarinfo, io.BytesIO(data))
+        return tarbuffer.getvalue()
+
+## A file with compressed files and an archive embedded in other data,
+## with files that are unpacked again in the archive.
+def createscandata():
+        members = [('a.txt', b'hello world\n' * 100), ('b.gz', gzip.compress(b'x' * 1000)),
+                   ('c.xz', lzma.compress(os.urandom(1000) * 2)), ('d.bin', os.urandom(5000))]
+        return b'\xff' * 100 + gzip.compress(b'hello\n' * 50) + createtar(members) + b'\x00' * 100
+
+## Reading from the memory mapped file gives the same checksums and
+## candidates as reading the file, whatever the size of the windows.
+def test_readandsearchfile_mmap(scanner, tmp_path):
+        testfile = tmp_path / 'testfile'
+        testfile.write_bytes(createscandata())
+        with open(testfile, 'rb') as scanfile:
+                expected = scanner.readandsearchfile(scanfile, None, 2000000)
+                scanmap = mmap.mmap(scanfile.fileno(), 0, access=mmap.ACCESS_READ)
+                filedata = memoryview(scanmap)
+                for maxsearchbytes in [1, 7, 512, 4096, 2000000]:
+                        assert scanner.readandsearchfile(scanfile, None, maxsearchbytes) == expected
+                        assert scanner.readandsearchfile(scanfile, filedata, maxsearchbytes) == expected
+                filedata.release()
+                scanmap.close()
+
+## The unpackers get the mapping of the file when memory mapping is used,
+## which should not change what is unpacked.
+def test_scan_mmap(scanfile):
+        data = createscandata()
+        (unpackdirectory, results) = scanfile(data, usemmap=True)
+        (otherunpackdirectory, otherresults) = scanfile(data, usemmap=False)
+        assert comparableresults(results) == comparableresults(otherresults)
+        assert results['testfile-tar-1/c.xz-xz-1/c']['filesize'] == 2000
+        assert len(results) == 8
+
+## Create a small PNG image.
+def createpng():
+        pngbuffer = io.BytesIO()
+        PIL.Image.new('RGB', (16, 16), (255, 0, 0)).save(pngbuffer, format='PNG')
+        return pngbuffer.getvalue()
+
+## A file with the same contents as a file that was scanned before is not
+## unpacked again, but the files unpacked from the earlier file are linked.
+## The results refer to the earlier file and have the same labels, also
+## if the earlier file got labels from the file it was unpacked from. Files
+## can only be linked once they are written, so nothing is kept in memory.
+def test_scan_duplicates(scanfile):
+        compressed = gzip.compress(b'hello world\n' * 100)
+        png = createpng()
+        data = b'\xff' * 100 + png + createtar([('a.gz', compressed), ('b.gz', compressed), ('c.png', png)])
+        (unpackdirectory, results) = scanfile(data, stagingmaxsize=0)
+        duplicates = [r for r in results.values() if 'duplicateof' in r]
+        assert sorted(r['filename'] for r in duplicates) == ['testfile-tar-1/b.gz', 'testfile-tar-1/b.gz-gzip-1/a', 'testfile-tar-1/c.png']
+        for fileresult in duplicates:
+                original = results[fileresult['duplicateof']]
+                ## except for the label of files carved from another file
+                assert sorted(fileresult['labels']) == sorted(set(original['labels']) - {'unpacked'})
+                assert fileresult['sha256'] == original['sha256']
+                assert [(r['offset'], r['signature'], r['files']) for r in fileresult['unpackedfiles']] == \
+                       [(r['offset'], r['signature'], r['files']) for r in original['unpackedfiles']]
+        assert results['testfile-tar-1/c.png']['duplicateof'] == 'testfile-png-1/unpacked.png'
+        assert 'png' in results['testfile-tar-1/c.png']['labels']
+
+        ## the files of the original are linked
+        linkedfile = os.path.join(unpackdirectory, 'testfile-tar-1/b.gz-gzip-1/a')
+        assert os.path.samefile(linkedfile, os.path.join(unpackdirectory, 'testfile-tar-1/a.gz-gzip-1/a'))
+        assert open(linkedfile, 'rb').read() == b'hello world\n' * 100
+        assert results['testfile-tar-1/b.gz-gzip-1/a']['labels'] == ['text']
+
+## The collector writes every result as a single line of JSON, compressed
+## if the name of the file ends in .gz, until every process has stopped.
+@pytest.mark.parametrize('resultsname', ['results.jsonl', 'results.jsonl.gz'])
+def test_collectresults(scanner, tmp_path, capsys, resultsname):
+        resultqueue = queue.Queue()
+        fileresults = [{'filename': 'a', 'labels': ['text']}, {'filename': 'b\n', 'labels': []}]
+        resultqueue.put(fileresults[0])
+        resultqueue.put(None)
+        resultqueue.put(fileresults[1])
+        resultqueue.put(None)
+        resultsfilename = str(tmp_path / resultsname)
+        scanner.collectresults(resultqueue, resultsfilename, False, 2)
+        if resultsname.endswith('.gz'):
+                resultsfile = gzip.open(resultsfilename, 'rt')
+        else:
+                resultsfile = open(resultsfilename, 'r')
+        assert [json.loads(line) for line in resultsfile] == fileresults
+        resultsfile.close()
+        assert resultqueue.empty()
+        assert capsys.readouterr().out == ''
+
+def test_collectresults_print(scanner, tmp_path, capsys):
+        resultqueue = queue.Queue()
+        resultqueue.put({'filename': 'a'})
+        resultqueue.put(None)
+        scanner.collectresults(resultqueue, str(tmp_path / 'results.jsonl'), True, 1)
+        assert capsys.readouterr().out == '{"filename": "a"}\n'
+        assert open(tmp_path / 'results.jsonl').read() == '{"filename": "a"}\n'
+
+## Unpacking directories get the next name that is not taken, also by
+## files that are kept in memory and are not on disk yet.
+def test_scan_unpackdirectories(scanfile):
+        compressed = gzip.compress(b'hello world\n' * 100)
+        data = b'\x1f\x8b\x08\x00' + b'\xff' * 100 + compressed + b'\xff' * 10 + compressed
+        data += createtar([('a.gz', compressed), ('a.gz-gzip-1', b'taken')])
+        (unpackdirectory, results) = scanfile(data)
+        assert [r['unpackdirectory'] for r in results['testfile']['unpackedfiles']] == \
+               ['testfile-gzip-1', 'testfile-gzip-2', 'testfile-tar-1']
+        assert results['testfile-tar-1/a.gz']['unpackedfiles'][0]['unpackdirectory'] == 'testfile-tar-1/a.gz-gzip-2'
+        assert open(os.path.join(unpackdirectory, 'testfile-tar-1/a.gz-gzip-1'), 'rb').read() == b'taken'
+        assert sorted(os.listdir(unpackdirectory)) == ['testfile', 'testfile-gzip-1', 'testfile-gzip-2', 'testfile-tar-1']
+
+## Unpackers write to a scratch directory, which is only renamed to an
+## unpacking directory if files were unpacked. Nothing is left behind for
+## candidates that failed and the scratch directories are removed at the
+## end of the scan.
+def test_scan_failed(scanfile):
+        (unpackdirectory, results) = scanfile(b'\x1f\x8b\x08\x00' + b'\xff' * 100 + b'ustar\x00' * 100)
+        assert results['testfile']['unpackedfiles'] == []
+        assert os.listdir(unpackdirectory) == ['testfile']
+        assert os.listdir(os.path.dirname(unpackdirectory)) == ['unpack']
+
+## A scratch directory where nothing was written is left alone, anything
+## else is removed, also if it cannot be read or written.
+def test_cleanscratchdirectory(scanner, tmp_path):
+        scratchdirectory = tmp_path / 'scratch'
+        scratchdirectory.mkdir()
+        inode = os.stat(scratchdirectory).st_ino
+        scanner.cleanscratchdirectory(str(scratchdirectory))
+        assert os.stat(scratchdirectory).st_ino == inode
+
+        (scratchdirectory / 'subdirectory').mkdir()
+        (scratchdirectory / 'subdirectory' / 'file').write_bytes(b'data')
+        os.symlink('/nonexistent', str(scratchdirectory / 'link'))
+        os.chmod(scratchdirectory / 'subdirectory' / 'file', 0)
+        os.chmod(scratchdirectory / 'subdirectory', 0)
+        scanner.cleanscratchdirectory(str(scratchdirectory))
+        assert os.listdir(scratchdirectory) == []
+
+## Scanning with several threads in a process gives the same results as
+## scanning with a single thread, and the unpackers do not change the
+## working directory, which is shared by the threads.
+def test_scan_threads(scanfile):
+        data = createscandata()
+        currentdirectory = os.getcwd()
+        (unpackdirectory, results) = scanfile(data, threads=1)
+        for threads in [2, 4]:
+                (otherunpackdirectory, otherresults) = scanfile(data, threads=threads)
+                assert comparableresults(otherresults) == comparableresults(results)
+        assert os.getcwd() == currentdirectory
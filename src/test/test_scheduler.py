@@ -0,0 +1,139 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for the scheduler that distributes files over the scanning processes.
+
+import multiprocessing
+import pytest
+
+import bangscheduler
+
+def createitems(names):
+        return list(map(lambda x: (x, [], None), names))
+
+## Get all work from the local queue until the scheduler says to stop.
+def getallwork(scheduler, localqueue):
+        names = []
+        while True:
+                item = bangscheduler.getwork(scheduler, localqueue)
+                if item == None:
+                        return names
+                names.append(item[0])
+                bangscheduler.workdone(scheduler)
+
+def test_fifo():
+        scheduler = bangscheduler.createscheduler(1, 'fifo')
+        localqueue = bangscheduler.createlocalqueue()
+        bangscheduler.addwork(scheduler, None, createitems(['/a', '/b']))
+        assert bangscheduler.getwork(scheduler, localqueue)[0] == '/a'
+        ## files found while scanning are added before the work is done
+        bangscheduler.addwork(scheduler, localqueue, createitems(['/c', '/d']))
+        bangscheduler.workdone(scheduler)
+        assert getallwork(scheduler, localqueue) == ['/b', '/c', '/d']
+        assert scheduler['outstanding'].value == 0
+
+def test_unknown_policy():
+        with pytest.raises(ValueError):
+                bangscheduler.createscheduler(1, 'random')
+
+def test_empty_batch():
+        scheduler = bangscheduler.createscheduler(1, 'fifo')
+        bangscheduler.addwork(scheduler, None, [])
+        assert scheduler['outstanding'].value == 0
+
+## If another process is waiting for work new files are given away, and
+## half of the local queue is given away before taking a file.
+def test_donate():
+        scheduler = bangscheduler.createscheduler(2, 'fifo')
+        localqueue = bangscheduler.createlocalqueue()
+        scheduler['idle'].value = 1
+        bangscheduler.addwork(scheduler, localqueue, createitems(['/a', '/b']))
+        assert localqueue['heap'] == []
+        assert list(map(lambda x: x[1][0], scheduler['sharedqueue'].get(timeout=10))) == ['/a', '/b']
+
+        scheduler['idle'].value = 0
+        bangscheduler.addwork(scheduler, localqueue, createitems(['/c', '/d', '/e', '/f']))
+        scheduler['idle'].value = 1
+        assert bangscheduler.getwork(scheduler, localqueue)[0] == '/e'
+        assert list(map(lambda x: x[1][0], scheduler['sharedqueue'].get(timeout=10))) == ['/c', '/d']
+        assert localqueue['statistics']['donatedfiles'] == 4
+
+## Files beyond the maximum size of the local queue are put in the shared
+## queue, also if no other process is waiting yet, so another process can
+## take them while this process is busy.
+def test_overflow(monkeypatch):
+        monkeypatch.setattr(bangscheduler, 'localqueuemaxsize', 4)
+        scheduler = bangscheduler.createscheduler(2, 'fifo')
+        localqueue = bangscheduler.createlocalqueue()
+        bangscheduler.addwork(scheduler, localqueue, createitems(['/%d' % i for i in range(10)]))
+        assert len(localqueue['heap']) == 4
+        otherlocalqueue = bangscheduler.createlocalqueue()
+        assert bangscheduler.getwork(scheduler, otherlocalqueue)[0] == '/0'
+        assert len(otherlocalqueue['heap']) == 5
+        assert bangscheduler.getwork(scheduler, localqueue)[0] == '/6'
+
+        ## a single process keeps all files
+        scheduler = bangscheduler.createscheduler(1, 'fifo')
+        localqueue = bangscheduler.createlocalqueue()
+        bangscheduler.addwork(scheduler, localqueue, createitems(['/%d' % i for i in range(10)]))
+        assert len(localqueue['heap']) == 10
+
+## Every file is scanned exactly once when several processes take
+## work from the shared queue and add new work.
+def scanworker(scheduler, donequeue):
+        localqueue = bangscheduler.createlocalqueue()
+        while True:
+                item = bangscheduler.getwork(scheduler, localqueue)
+                if item == None:
+                        break
+                depth = item[0].count('/')
+                if depth < 4:
+                        bangscheduler.addwork(scheduler, localqueue, createitems(['%s/%d' % (item[0], i) for i in range(3)]))
+                donequeue.put(item[0])
+                bangscheduler.workdone(scheduler)
+        donequeue.put(None)
+
+@pytest.mark.parametrize('localqueuemaxsize', [256, 2])
+def test_processes(monkeypatch, localqueuemaxsize):
+        monkeypatch.setattr(bangscheduler, 'localqueuemaxsize', localqueuemaxsize)
+        processes = 3
+        scheduler = bangscheduler.createscheduler(processes, 'fifo')
+        donequeue = multiprocessing.Queue()
+        bangscheduler.addwork(scheduler, None, createitems(['/r']))
+        workers = [multiprocessing.Process(target=scanworker, args=(scheduler, donequeue)) for i in range(processes)]
+        for w in workers:
+                w.start()
+        scanned = []
+        stopped = 0
+        while stopped < processes:
+                name = donequeue.get(timeout=60)
+                if name == None:
+                        stopped += 1
+                else:
+                        scanned.append(name)
+        for w in workers:
+                w.join()
+        assert len(scanned) == 1 + 3 + 9 + 27
+        assert len(set(scanned)) == len(scanned)
+
+## The size policy scans the biggest files first, also for
+## files that are kept in memory or as a range of another file.
+def test_size(tmp_path):
+        for (name, size) in [('small', 10), ('big', 1000), ('medium', 100)]:
+                (tmp_path / name).write_bytes(b'x' * size)
+        scheduler = bangscheduler.createscheduler(1, 'size')
+        localqueue = bangscheduler.createlocalqueue()
+        items = createitems([str(tmp_path / 'small'), str(tmp_path / 'big'), str(tmp_path / 'medium'), str(tmp_path / 'missing')])
+        items.append((str(tmp_path / 'staged'), [], b'x' * 500))
+        items.append((str(tmp_path / 'range'), [], (str(tmp_path / 'big'), 0, 2000)))
+        bangscheduler.addwork(scheduler, None, items)
+        assert getallwork(scheduler, localqueue) == list(map(lambda x: str(tmp_path / x), ['range', 'big', 'staged', 'medium', 'small', 'missing']))
+
+def test_depth():
+        scheduler = bangscheduler.createscheduler(1, 'depth')
+        localqueue = bangscheduler.createlocalqueue()
+        bangscheduler.addwork(scheduler, None, createitems(['/a', '/a/b/c', '/a/b', '/d/e/f']))
+        assert getallwork(scheduler, localqueue) == ['/a/b/c', '/d/e/f', '/a/b', '/a']
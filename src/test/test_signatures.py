@@ -0,0 +1,111 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for the signature search. The results of findsignatures() are
+## compared with the results of searching for every signature separately
+## with re.finditer(), which is how the signatures were searched before.
+
+import hashlib, mmap, re, random
+import pytest
+
+import bangsignatures
+
+## The old search: one pass over the data per signature.
+def findsignaturesseparately(signatures, signaturesoffset, scanbytes, offsetinfile):
+        candidateoffsetsfound = set()
+        for s in signatures:
+                for r in re.finditer(re.escape(signatures[s]), scanbytes):
+                        offset = r.start()
+                        if s in signaturesoffset:
+                                if offset + offsetinfile - signaturesoffset[s] < 0:
+                                        continue
+                                candidateoffsetsfound.add((offset + offsetinfile - signaturesoffset[s], s))
+                        else:
+                                candidateoffsetsfound.add((offset + offsetinfile, s))
+        return candidateoffsetsfound
+
+## Create data with the signatures (and parts of them) scattered
+## through random data.
+def createtestdata(signatures, seed, size=65536):
+        randomgenerator = random.Random(seed)
+        pieces = []
+        signaturelist = sorted(signatures.values())
+        while sum(map(len, pieces)) < size:
+                choice = randomgenerator.random()
+                if choice < 0.3:
+                        pieces.append(randomgenerator.choice(signaturelist))
+                elif choice < 0.4:
+                        signature = randomgenerator.choice(signaturelist)
+                        pieces.append(signature[:randomgenerator.randrange(1, len(signature)+1)])
+                else:
+                        pieces.append(bytes(randomgenerator.getrandbits(8) for i in range(randomgenerator.randrange(1, 64))))
+        return b''.join(pieces)
+
+## signatures that are prefixes of each other and that overlap with themselves
+trickysignatures = {'bm': b'BM', 'bmbm': b'BMBM', 'bmx': b'BMX', 'aaa': b'AAA',
+                    'aab': b'AAB', 'tar': b'ustar\x00'}
+trickyoffsets = {'tar': 0x101}
+
+@pytest.mark.parametrize('seed', range(5))
+def test_scanner_signatures(scanner, seed):
+        matcher = bangsignatures.compilesignatures(scanner.signatures, scanner.signaturesoffset)
+        scanbytes = createtestdata(scanner.signatures, seed)
+        for offsetinfile in [0, 0x80, 1048576]:
+                expected = findsignaturesseparately(scanner.signatures, scanner.signaturesoffset, scanbytes, offsetinfile)
+                assert bangsignatures.findsignatures(matcher, scanbytes, offsetinfile) == expected
+
+@pytest.mark.parametrize('seed', range(5))
+def test_tricky_signatures(seed):
+        matcher = bangsignatures.compilesignatures(trickysignatures, trickyoffsets)
+        scanbytes = createtestdata(trickysignatures, seed) + b'AAAAAABMBMBMBMX'
+        expected = findsignaturesseparately(trickysignatures, trickyoffsets, scanbytes, 0)
+        assert bangsignatures.findsignatures(matcher, scanbytes, 0) == expected
+
+def test_self_overlapping():
+        matcher = bangsignatures.compilesignatures(trickysignatures, trickyoffsets)
+        ## re.finditer() does not report overlapping matches of a signature
+        assert bangsignatures.findsignatures(matcher, b'AAAA', 0) == set([(0, 'aaa')])
+        assert bangsignatures.findsignatures(matcher, b'BMBMBM', 0) == set([(0, 'bm'), (2, 'bm'), (4, 'bm'), (0, 'bmbm')])
+
+def test_signature_before_start_of_file():
+        matcher = bangsignatures.compilesignatures(trickysignatures, trickyoffsets)
+        scanbytes = b'\x00' * 0x10 + b'ustar\x00' + b'\x00' * 0x200 + b'ustar\x00'
+        assert bangsignatures.findsignatures(matcher, scanbytes, 0) == set([(0x216 - 0x101, 'tar')])
+        assert bangsignatures.findsignatures(matcher, scanbytes, 0x100) == set([(0x100 + 0x10 - 0x101, 'tar'), (0x100 + 0x216 - 0x101, 'tar')])
+
+## Searching a buffer window by window has to give the same result as
+## searching the whole buffer, also for signatures that cross a window.
+@pytest.mark.parametrize('windowsize', [1, 3, 7, 4096])
+def test_windows(scanner, windowsize):
+        matcher = bangsignatures.compilesignatures(scanner.signatures, scanner.signaturesoffset)
+        scanbytes = createtestdata(scanner.signatures, 42, 16384)
+        expected = findsignaturesseparately(scanner.signatures, scanner.signaturesoffset, scanbytes, 0)
+        found = set()
+        for windowstart in range(0, len(scanbytes), windowsize):
+                found.update(bangsignatures.findsignatures(matcher, memoryview(scanbytes), 0, windowstart, windowstart + windowsize))
+        assert found == expected
+
+## Reading a file once for the checksums, the signatures and the text check
+## has to give the same checksums as hashlib and the same candidates as
+## searching the whole file for every signature separately, whatever the
+## size of the windows and with or without memory mapping.
+@pytest.mark.parametrize('maxsearchbytes', [1, 7, 4096, 2000000])
+def test_readandsearchfile(scanner, tmp_path, maxsearchbytes):
+        scanbytes = createtestdata(scanner.signatures, 7, 20000)
+        testfile = tmp_path / 'testfile'
+        testfile.write_bytes(scanbytes)
+        expected = findsignaturesseparately(scanner.signatures, scanner.signaturesoffset, scanbytes, 0)
+        with open(testfile, 'rb') as scanfile:
+                scanmap = mmap.mmap(scanfile.fileno(), 0, access=mmap.ACCESS_READ)
+                filedata = memoryview(scanmap)
+                for searchdata in [None, filedata]:
+                        (checksums, candidateoffsetsfound, istext) = scanner.readandsearchfile(scanfile, searchdata, maxsearchbytes)
+                        for hashtocompute in ['sha256', 'md5', 'sha1']:
+                                assert checksums[hashtocompute] == hashlib.new(hashtocompute, scanbytes).hexdigest()
+                        assert candidateoffsetsfound == expected
+                        assert not istext
+                filedata.release()
+                scanmap.close()
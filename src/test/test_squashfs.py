@@ -0,0 +1,159 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for unpacking squashfs 4 file systems in process. The file systems
+## are created by the tests, so mksquashfs is not needed.
+
+import lzma, os, struct, zlib
+import pytest
+
+import bangunpack
+import bangsquashfs
+
+from conftest import unpackedcontents
+
+## Compress data as a sequence of metadata blocks.
+def createmetadatablocks(data):
+        metadata = b''
+        for i in range(0, len(data), 8192):
+                block = zlib.compress(data[i:i+8192])
+                metadata += struct.pack('<H', len(block)) + block
+        return metadata
+
+## Create a little endian squashfs 4 file system with gzip compression,
+## without fragments, with all entries in the root directory. The entries
+## are tuples (name, kind, value) where kind is one of:
+##
+## * file :: a regular file, value is the contents
+## * blocks :: a regular file with a declared size and list of block
+##   sizes, but without data, value is (size, list of block sizes)
+## * symlink :: a symbolic link, value is the target
+def createsquashfs(entries, blocksize=4096):
+        data = b''
+        inodes = b''
+        inodenumber = 1
+        directoryentries = []
+        for (name, kind, value) in entries:
+                inodeoffset = len(inodes)
+                if kind == 'file':
+                        blocks = []
+                        startblock = 96 + len(data)
+                        for i in range(0, len(value), blocksize):
+                                block = zlib.compress(value[i:i+blocksize])
+                                if len(block) < len(value[i:i+blocksize]):
+                                        blocks.append(len(block))
+                                else:
+                                        ## blocks that do not compress
+                                        ## are stored uncompressed
+                                        block = value[i:i+blocksize]
+                                        blocks.append(len(block) | (1 << 24))
+                                data += block
+                        inodes += struct.pack('<HHHHII', 2, 0o644, 0, 0, 0, inodenumber)
+                        inodes += struct.pack('<IIII', startblock, 0xffffffff, 0, len(value))
+                        inodes += struct.pack('<%dI' % len(blocks), *blocks)
+                        entrytype = 2
+                elif kind == 'blocks':
+                        (size, blocks) = value
+                        inodes += struct.pack('<HHHHII', 2, 0o644, 0, 0, 0, inodenumber)
+                        inodes += struct.pack('<IIII', 96, 0xffffffff, 0, size)
+                        inodes += struct.pack('<%dI' % len(blocks), *blocks)
+                        entrytype = 2
+                elif kind == 'symlink':
+                        inodes += struct.pack('<HHHHII', 3, 0o777, 0, 0, 0, inodenumber)
+                        inodes += struct.pack('<II', 1, len(value)) + value
+                        entrytype = 3
+                directoryentries.append((name, inodeoffset, inodenumber, entrytype))
+                inodenumber += 1
+
+        ## a single directory header for all entries
+        listing = struct.pack('<III', len(directoryentries) - 1, 0, 1)
+        for (name, inodeoffset, entryinodenumber, entrytype) in directoryentries:
+                listing += struct.pack('<HhHH', inodeoffset, entryinodenumber - 1, entrytype, len(name) - 1) + name
+        rootinodeoffset = len(inodes)
+        inodes += struct.pack('<HHHHII', 1, 0o755, 0, 0, 0, inodenumber)
+        inodes += struct.pack('<IIHHI', 0, 2, len(listing) + 3, 0, inodenumber + 1)
+
+        inodetablestart = 96 + len(data)
+        inodetable = createmetadatablocks(inodes)
+        directorytablestart = inodetablestart + len(inodetable)
+        directorytable = createmetadatablocks(listing)
+        idblockstart = directorytablestart + len(directorytable)
+        idblock = createmetadatablocks(struct.pack('<I', 0))
+        idtablestart = idblockstart + len(idblock)
+        idtable = struct.pack('<Q', idblockstart)
+        bytesused = idtablestart + len(idtable)
+
+        superblock = struct.pack('<4sIIIIHHHHHHQQQQQQQQ', b'hsqs', inodenumber, 0, blocksize, 0, 1,
+                                 blocksize.bit_length() - 1, 0x0010, 1, 4, 0, rootinodeoffset,
+                                 bytesused, idtablestart, 0xffffffffffffffff, inodetablestart,
+                                 directorytablestart, 0xffffffffffffffff, 0xffffffffffffffff)
+        image = superblock + data + inodetable + directorytable + idblock + idtable
+        return image + b'\x00' * (-len(image) % 4096)
+
+def test_squashfs(writetestfile):
+        bigdata = os.urandom(10000)
+        textdata = b'hello world\n' * 2000
+        image = createsquashfs([(b'big', 'file', bigdata), (b'empty', 'file', b''),
+                                (b'link', 'symlink', b'big'), (b'small', 'file', b'hello\n'),
+                                (b'text', 'file', textdata)])
+        (testfile, unpackdir) = writetestfile(image)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackSquashfs(testfile, 0, unpackdir, None)
+        assert status
+        assert size == struct.unpack('<Q', image[40:48])[0]
+        assert unpackedcontents(unpackedfilesandlabels) == {'big': bigdata, 'empty': b'', 'link': 'big', 'small': b'hello\n', 'text': textdata}
+
+def test_squashfs_embedded(writetestfile):
+        image = createsquashfs([(b'a', 'file', b'data')])
+        (testfile, unpackdir) = writetestfile(b'\x00' * 100 + image + b'\xff' * 100)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackSquashfs(testfile, 100, unpackdir, None)
+        assert status
+        assert unpackedcontents(unpackedfilesandlabels) == {'a': b'data'}
+
+## blocks with size 0 are sparse and are all zeroes
+def test_squashfs_sparse(writetestfile):
+        image = createsquashfs([(b'sparse', 'blocks', (6000, [0, 0]))])
+        (testfile, unpackdir) = writetestfile(image)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackSquashfs(testfile, 0, unpackdir, None)
+        assert status
+        assert unpackedcontents(unpackedfilesandlabels) == {'sparse': b'\x00' * 6000}
+
+def test_squashfs_truncated(writetestfile):
+        image = createsquashfs([(b'a', 'file', os.urandom(10000))])
+        (testfile, unpackdir) = writetestfile(image[:200])
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackSquashfs(testfile, 0, unpackdir, None)
+        assert not status
+        assert os.listdir(unpackdir) == []
+
+## the blocks of a file have to be inside of the file system
+def test_squashfs_blocks_outside(writetestfile):
+        image = createsquashfs([(b'a', 'blocks', (8192, [0x100000, 0x100000]))])
+        (testfile, unpackdir) = writetestfile(image)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackSquashfs(testfile, 0, unpackdir, None)
+        assert not status
+
+## A file with the same name as a symbolic link that points outside of the
+## unpacking directory should not be written through the link.
+def test_squashfs_symlink_escape(writetestfile, tmp_path):
+        victim = tmp_path / 'victim'
+        victim.write_bytes(b'original')
+        image = createsquashfs([(b'a', 'symlink', str(victim).encode()), (b'a', 'file', b'overwritten')])
+        (testfile, unpackdir) = writetestfile(image)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackSquashfs(testfile, 0, unpackdir, None)
+        assert not status
+        assert victim.read_bytes() == b'original'
+
+## Blocks are decompressed with a bound on the size of the output, so
+## a block that decompresses to more than a block is rejected without
+## decompressing all of it.
+@pytest.mark.parametrize('compression,compressor', [
+        (bangsquashfs.compressiongzip, zlib.compress),
+        (bangsquashfs.compressionxz, lzma.compress),
+        (bangsquashfs.compressionlzma, lambda x: lzma.compress(x, format=lzma.FORMAT_ALONE)),
+        ])
+def test_squashfs_decompressblock(compression, compressor):
+        assert bangsquashfs.decompressblock(compression, compressor(b'\x00' * 4096), 4096) == b'\x00' * 4096
+        with pytest.raises(ValueError):
+                bangsquashfs.decompressblock(compression, compressor(b'\x00' * 1000000), 4096)
@@ -0,0 +1,113 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for staging small unpacked files in memory and writing them
+## to disk in batches.
+
+import gzip, lzma, os
+import pytest
+
+import bangstaging
+import bangunpack
+
+## Keep files up to a size in memory for a test only, as the configuration
+## of bangstaging is kept per process.
+@pytest.fixture
+def staging():
+        def configure(maxsize, virtual=False):
+                bangstaging.configure(maxsize, virtual)
+        yield configure
+        bangstaging.configure(0)
+        bangstaging.setsource(None, None, 0)
+        bangstaging.discard('')
+        state = bangstaging.getstate()
+        state.pendingfiles = []
+        state.pendingbytes = 0
+
+def test_writefile(staging, tmp_path):
+        staging(16)
+        bangstaging.writefile(str(tmp_path / 'small'), b'small')
+        bangstaging.writefile(str(tmp_path / 'big'), b'x' * 17)
+        bangstaging.writefile(str(tmp_path / 'empty'), b'')
+        assert sorted(os.listdir(tmp_path)) == ['big', 'empty']
+        assert bangstaging.takestaged(str(tmp_path / 'small')) == b'small'
+        assert bangstaging.takestaged(str(tmp_path / 'big')) == None
+
+## Pending files are written once there are enough files or enough bytes
+## kept in memory, the amount of bytes depending on the maximum size of
+## files kept in memory.
+def test_flushpending(staging, tmp_path):
+        staging(16)
+        assert bangstaging.flushbytes == 16 * bangstaging.flushfactor
+        for i in range(bangstaging.flushfactor - 1):
+                bangstaging.addtoflush(str(tmp_path / str(i)), b'x' * 16)
+                bangstaging.flushpending()
+        assert os.listdir(tmp_path) == []
+        bangstaging.addtoflush(str(tmp_path / 'last'), b'x' * 16)
+        bangstaging.flushpending()
+        assert len(os.listdir(tmp_path)) == bangstaging.flushfactor
+        assert open(tmp_path / 'last', 'rb').read() == b'x' * 16
+
+        bangstaging.addtoflush(str(tmp_path / 'forced'), b'y')
+        bangstaging.flushpending()
+        assert not os.path.exists(tmp_path / 'forced')
+        bangstaging.flushpending(force=True)
+        assert open(tmp_path / 'forced', 'rb').read() == b'y'
+
+## The output of gzip and LZMA is kept in memory if it is small enough.
+@pytest.mark.parametrize('compressor,unpacker', [
+        (gzip.compress, bangunpack.unpackGzip),
+        (lambda x: lzma.compress(x, format=lzma.FORMAT_ALONE), bangunpack.unpackLZMA),
+        (lzma.compress, bangunpack.unpackXZ),
+        ])
+def test_staged_output(staging, writetestfile, compressor, unpacker):
+        staging(65536)
+        data = b'hello world\n' * 100
+        (testfile, unpackdir) = writetestfile(compressor(data))
+        (status, size, unpackedfilesandlabels, labels, error) = unpacker(testfile, 0, unpackdir, None)
+        assert status
+        assert os.listdir(unpackdir) == []
+        assert bangstaging.takestaged(unpackedfilesandlabels[0][0]) == data
+
+        ## output that is bigger is written to disk
+        data = os.urandom(100000)
+        (testfile, unpackdir) = writetestfile(compressor(data), 'big')
+        (status, size, unpackedfilesandlabels, labels, error) = unpacker(testfile, 0, unpackdir, None)
+        assert status
+        assert bangstaging.takestaged(unpackedfilesandlabels[0][0]) == None
+        assert open(unpackedfilesandlabels[0][0], 'rb').read() == data
+
+## Data carved from a file on disk is kept as a range of that file, also
+## if it is carved from a file that is itself a range of that file, and
+## it is only written when the pending files are written.
+def test_carverange(staging, tmp_path):
+        staging(0, True)
+        sourcedata = os.urandom(200000)
+        sourcefile = tmp_path / 'source'
+        sourcefile.write_bytes(sourcedata)
+        bangstaging.setsource('carved', str(sourcefile), 1000)
+        bangunpack.carvefile('carved', None, 500, 100000, str(tmp_path / 'nested'))
+        assert not os.path.exists(tmp_path / 'nested')
+        stageddata = bangstaging.takestaged(str(tmp_path / 'nested'))
+        assert stageddata == (str(sourcefile), 1500, 100000)
+
+        (scanfile, scanmap, filedata) = bangstaging.openstaged(stageddata)
+        assert bytes(filedata) == sourcedata[1500:101500]
+        filedata.release()
+        scanmap.close()
+        scanfile.close()
+
+        bangstaging.addtoflush(str(tmp_path / 'nested'), stageddata)
+        bangstaging.flushpending(force=True)
+        assert open(tmp_path / 'nested', 'rb').read() == sourcedata[1500:101500]
+
+        ## other files, or empty files, are not kept as a range
+        bangunpack.carvefile(str(sourcefile), None, 0, 10, str(tmp_path / 'other'))
+        bangstaging.setsource(str(sourcefile), str(sourcefile), 0)
+        bangunpack.carvefile(str(sourcefile), None, 0, 0, str(tmp_path / 'empty'))
+        assert bangstaging.takestaged(str(tmp_path / 'other')) == None
+        assert bangstaging.takestaged(str(tmp_path / 'empty')) == None
+        assert open(tmp_path / 'other', 'rb').read() == sourcedata[:10]
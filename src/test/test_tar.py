@@ -0,0 +1,113 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for unpacking tar files. The tar files are created with the
+## tarfile module.
+
+import io, os, tarfile
+import pytest
+
+import bangunpack
+
+from conftest import directorycontents
+
+## Create a tar file. The members are tuples (name, type, value), where
+## value is the data for regular files and the target for links.
+def createtar(members, tarformat=tarfile.GNU_FORMAT):
+        tardata = io.BytesIO()
+        tar = tarfile.open(fileobj=tardata, mode='w', format=tarformat)
+        for (name, membertype, value) in members:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.type = membertype
+                if membertype == tarfile.REGTYPE:
+                        tarinfo.size = len(value)
+                        tar.addfile(tarinfo, io.BytesIO(value))
+                else:
+                        if membertype in [tarfile.SYMTYPE, tarfile.LNKTYPE]:
+                                tarinfo.linkname = value
+                        tar.addfile(tarinfo)
+        tar.close()
+        return tardata.getvalue()
+
+longname = 'directory/' + 'x' * 120 + '/file'
+
+members = [('directory', tarfile.DIRTYPE, None),
+           ('directory/a', tarfile.REGTYPE, b'hello'),
+           ('directory/big', tarfile.REGTYPE, os.urandom(5000)),
+           ('directory/link', tarfile.SYMTYPE, 'a'),
+           ('directory/hardlink', tarfile.LNKTYPE, 'directory/a'),
+           ('empty', tarfile.REGTYPE, b''),
+           (longname, tarfile.REGTYPE, b'long name'),
+          ]
+
+@pytest.mark.parametrize('tarformat', [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT])
+def test_tar(writetestfile, tarformat):
+        tardata = createtar(members, tarformat)
+        (testfile, unpackdir) = writetestfile(tardata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 0, unpackdir, None)
+        assert status
+        assert size == len(tardata)
+        assert 'tar' in labels
+        contents = directorycontents(unpackdir)
+        assert contents['directory/a'] == ('file', b'hello')
+        assert contents['directory/big'] == ('file', members[2][2])
+        assert contents['directory/link'] == ('link', 'a')
+        assert contents['directory/hardlink'] == ('file', b'hello')
+        assert contents['empty'] == ('file', b'')
+        assert contents[longname] == ('file', b'long name')
+
+def test_tar_carved(writetestfile):
+        tardata = createtar(members[:3])
+        (testfile, unpackdir) = writetestfile(b'\xff' * 1000 + tardata + b'\xff' * 1000)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 1000, unpackdir, None)
+        assert status
+        assert size == len(tardata)
+        assert directorycontents(unpackdir)['directory/a'] == ('file', b'hello')
+
+## The last member with the same name is kept.
+def test_tar_duplicate(writetestfile):
+        tardata = createtar([('a', tarfile.REGTYPE, b'first'), ('a', tarfile.REGTYPE, b'second')])
+        (testfile, unpackdir) = writetestfile(tardata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 0, unpackdir, None)
+        assert status
+        assert len(unpackedfilesandlabels) == 1
+        assert directorycontents(unpackdir) == {'a': ('file', b'second')}
+
+## members with names pointing outside of the unpacking directory, or
+## through a symbolic link to outside of the unpacking directory, are
+## skipped. If nothing else is in the file it is not a valid tar file.
+def test_tar_outside(writetestfile, tmp_path):
+        outside = tmp_path / 'outside'
+        outside.mkdir()
+        tardata = createtar([('../escaped', tarfile.REGTYPE, b'x'), ('..', tarfile.DIRTYPE, None)])
+        (testfile, unpackdir) = writetestfile(tardata, 'dotdot')
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 0, unpackdir, None)
+        assert not status
+        assert not os.path.exists(tmp_path / 'escaped')
+
+        tardata = createtar([('../escaped', tarfile.REGTYPE, b'x'), ('ok', tarfile.REGTYPE, b'ok'),
+                             ('link', tarfile.SYMTYPE, str(outside)), ('link/escaped', tarfile.REGTYPE, b'x'),
+                             ('hardlink', tarfile.LNKTYPE, '../../etc/passwd')])
+        (testfile, unpackdir) = writetestfile(tardata, 'mixed')
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 0, unpackdir, None)
+        assert status
+        assert directorycontents(unpackdir) == {'ok': ('file', b'ok'), 'link': ('link', str(outside))}
+        assert os.listdir(outside) == []
+        assert not os.path.exists(tmp_path / 'escaped')
+
+def test_tar_truncated(writetestfile):
+        tardata = createtar([('a', tarfile.REGTYPE, os.urandom(5000))])
+        (testfile, unpackdir) = writetestfile(tardata[:3000])
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 0, unpackdir, None)
+        assert not status
+        assert os.listdir(unpackdir) == []
+
+def test_tar_bad_checksum(writetestfile):
+        tardata = bytearray(createtar([('a', tarfile.REGTYPE, b'hello')]))
+        tardata[0] = ord('b')
+        (testfile, unpackdir) = writetestfile(bytes(tardata))
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTar(testfile, 0, unpackdir, None)
+        assert not status
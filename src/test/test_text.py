@@ -0,0 +1,47 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for deciding whether or not data is text. The result of
+## isprintable() is compared with checking every byte separately, which
+## is how text files were recognised before.
+
+import random, string
+import pytest
+
+import bangunpack
+
+## The old check: look up every byte in string.printable.
+def isprintableperbyte(data):
+        return list(filter(lambda x: chr(x) not in string.printable, data)) == []
+
+def test_isprintable_bytes():
+        for i in range(256):
+                assert bangunpack.isprintable(bytes([i])) == isprintableperbyte(bytes([i]))
+                assert bangunpack.isprintable(b'text ' + bytes([i]) + b' text') == isprintableperbyte(bytes([i]))
+
+## A single byte that is not printable is found wherever it is, also
+## right before or after the boundaries of the chunks that are checked.
+@pytest.mark.parametrize('seed', range(5))
+def test_isprintable_random(seed):
+        randomgenerator = random.Random(seed)
+        text = ''.join(randomgenerator.choice(string.printable) for i in range(10000)).encode()
+        assert bangunpack.isprintable(text)
+        assert bangunpack.isprintable(memoryview(text))
+        for position in [0, 4095, 4096, 4097, randomgenerator.randrange(len(text)), len(text) - 1]:
+                data = bytearray(text)
+                data[position] = randomgenerator.choice([0, 0x7f, 0x80, 0xff])
+                assert bangunpack.isprintable(bytes(data)) == isprintableperbyte(data) == False
+                assert bangunpack.isprintable(memoryview(bytes(data))) == False
+
+def test_isprintable_empty():
+        assert bangunpack.isprintable(b'')
+
+## The scanner labels files as text or binary.
+def test_scan_text(scanfile):
+        (unpackdirectory, results) = scanfile(b'hello world\n' * 1000, 'text')
+        assert 'text' in results['text']['labels']
+        (unpackdirectory, results) = scanfile(b'hello world\n' * 1000 + b'\x00', 'binary')
+        assert 'binary' in results['binary']['labels']
@@ -0,0 +1,140 @@
+## Binary Analysis Next Generation (BANG!)
+##
+## Copyright 2018 - Armijn Hemel
+## Licensed under the terms of the GNU Affero General Public License version 3
+## SPDX-License-Identifier: AGPL-3.0-only
+##
+## Tests for unpacking timezone files (man 5 tzfile).
+
+import os, random, string, struct
+import pytest
+
+import bangunpack
+
+## Create the header and the data of a timezone file, with 4 byte times
+## for version 1 data and 8 byte times for version 2+ data.
+def createtimezonedata(version, timesize, transitions, ttinfos, abbreviations, leapseconds=[]):
+        data = b'TZif' + version + b'\x00' * 15
+        data += struct.pack('>6I', len(ttinfos), len(ttinfos), len(leapseconds), len(transitions), len(ttinfos), len(abbreviations))
+        timeformat = '>q' if timesize == 8 else '>i'
+        for (transitiontime, index) in transitions:
+                data += struct.pack(timeformat, transitiontime)
+        data += bytes(map(lambda x: x[1], transitions))
+        for (gmtoffset, dst, abbreviationindex) in ttinfos:
+                data += struct.pack('>iBB', gmtoffset, dst, abbreviationindex)
+        data += abbreviations
+        for (leaptime, correction) in leapseconds:
+                data += struct.pack(timeformat, leaptime) + struct.pack('>i', correction)
+        data += b'\x00' * len(ttinfos) * 2
+        return data
+
+transitions = [(-1000, 0), (0, 1), (1000, 0)]
+ttinfos = [(3600, 0, 0), (7200, 1, 4)]
+abbreviations = b'CET\x00CEST\x00'
+leapseconds = [(78796800, 1), (94694401, 2)]
+
+def createtimezone(version=b'2', tzstring=b'CET-1CEST,M3.5.0,M10.5.0/3'):
+        data = createtimezonedata(version, 4, transitions, ttinfos, abbreviations, leapseconds)
+        if version == b'\x00':
+                return data
+        data += createtimezonedata(version, 8, transitions, ttinfos, abbreviations, leapseconds)
+        return data + b'\n' + tzstring + b'\n'
+
+@pytest.mark.parametrize('version', [b'\x00', b'2', b'3'])
+def test_timezone(writetestfile, version):
+        timezonedata = createtimezone(version)
+        (testfile, unpackdir) = writetestfile(timezonedata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTimeZone(testfile, 0, unpackdir, None)
+        assert status
+        assert size == len(timezonedata)
+        assert 'timezone' in labels
+
+def test_timezone_carved(writetestfile):
+        timezonedata = createtimezone()
+        (testfile, unpackdir) = writetestfile(b'\xff' * 7 + timezonedata + timezonedata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTimeZone(testfile, 7, unpackdir, None)
+        assert status
+        assert size == len(timezonedata)
+        assert open(unpackedfilesandlabels[0][0], 'rb').read() == timezonedata
+
+## the timezone files of the system, if there are any
+def test_timezone_system(writetestfile):
+        zoneinfo = '/usr/share/zoneinfo'
+        timezonefiles = []
+        for name in ['UTC', 'Europe/Amsterdam', 'America/New_York', 'Asia/Kolkata', 'right/UTC']:
+                if os.path.isfile(os.path.join(zoneinfo, name)):
+                        timezonefiles.append(os.path.join(zoneinfo, name))
+        if timezonefiles == []:
+                pytest.skip('no timezone files found')
+        unpackdir = writetestfile(b'')[1]
+        for timezonefile in timezonefiles:
+                (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTimeZone(timezonefile, 0, unpackdir, None)
+                assert status
+                assert size == os.stat(timezonefile).st_size
+
+## A truncated file is rejected, wherever it is truncated, and the
+## reported error is inside of the file.
+def test_timezone_truncated(writetestfile):
+        timezonedata = createtimezone()
+        for length in range(44, len(timezonedata)):
+                (testfile, unpackdir) = writetestfile(timezonedata[:length], 'truncated%d' % length)
+                (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTimeZone(testfile, 0, unpackdir, None)
+                assert not status
+                assert error['offset'] <= length
+                assert os.listdir(unpackdir) == []
+
+@pytest.mark.parametrize('timezonedata,reason', [
+        (createtimezonedata(b'\x00', 4, [(0, 5)], ttinfos, abbreviations), 'invalid index for transition time'),
+        (createtimezonedata(b'\x00', 4, transitions, [(0, 2, 0)], abbreviations), 'invalid value for ttinfo DST info'),
+        (createtimezonedata(b'\x00', 4, transitions, [(0, 0, 20), (0, 0, 0)], abbreviations), 'invalid value for ttinfo abbreviation index'),
+        (createtimezonedata(b'\x00', 4, [], [], abbreviations), 'local of times set to not-permitted 0'),
+        (createtimezone(b'2')[:20] + b'\x00' * 24, 'local of times set to not-permitted 0'),
+        (createtimezonedata(b'2', 4, transitions, ttinfos, abbreviations) + createtimezonedata(b'3', 8, transitions, ttinfos, abbreviations) + b'\n\n', 'versions in headers don\'t match'),
+        (createtimezone(tzstring=b'CET -1'), 'invalid character in POSIX TZ environment style string'),
+        ])
+def test_timezone_invalid(writetestfile, timezonedata, reason):
+        (testfile, unpackdir) = writetestfile(timezonedata)
+        (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTimeZone(testfile, 0, unpackdir, None)
+        assert not status
+        assert error['reason'] == reason
+
+## The old check of the POSIX TZ string at the end of the file, one
+## character at a time. Returns the position after the string (or after
+## the character that is not valid) and the reason if it is not valid.
+def checktzstringperbyte(data, position):
+        while True:
+                if position >= len(data):
+                        return (position, 'enclosing newline for POSIX TZ environment style string not found')
+                character = chr(data[position])
+                position += 1
+                if character == '\n':
+                        return (position, None)
+                if not character in string.printable or character in string.whitespace:
+                        return (position, 'invalid character in POSIX TZ environment style string')
+
+## The POSIX TZ string is checked in chunks, which gives the same result
+## as checking it one character at a time, also for long strings, strings
+## without an enclosing newline and strings followed by other data.
+@pytest.mark.parametrize('seed', range(5))
+def test_timezone_tzstring(writetestfile, seed):
+        randomgenerator = random.Random(seed)
+        header = createtimezone(tzstring=b'')[:-1]
+        validcharacters = (string.ascii_letters + string.digits + string.punctuation).encode()
+        for i in range(40):
+                tzstring = bytes(randomgenerator.choice(validcharacters) for j in range(randomgenerator.choice([0, 10, 63, 64, 65, 200, 1000])))
+                if randomgenerator.random() < 0.5 and tzstring != b'':
+                        position = randomgenerator.randrange(len(tzstring))
+                        tzstring = tzstring[:position] + bytes([randomgenerator.choice(b' \t\x00\x7f\xff')]) + tzstring[position+1:]
+                if randomgenerator.random() < 0.8:
+                        tzstring += b'\n'
+                timezonedata = header + tzstring + randomgenerator.choice([b'', b'\n', b'trailing data'])
+                (testfile, unpackdir) = writetestfile(timezonedata, 'tzstring%d' % i)
+                (status, size, unpackedfilesandlabels, labels, error) = bangunpack.unpackTimeZone(testfile, 0, unpackdir, None)
+                (position, reason) = checktzstringperbyte(timezonedata, len(header))
+                assert size == position
+                if reason == None:
+                        assert status
+                else:
+                        assert not status
+                        assert error['reason'] == reason
+                        assert error['offset'] == position